@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+
+""" Comparison of two results of the benchmark suite
+
+usage: python benchmarks/compare.py old.json new.json
+
+The results saved by benchmarks/suite.py (-j file) for two commits are
+compared grammar by grammar and lexer by lexer. Each measure is printed
+with the ratio new/old: below 1 the new commit is faster (or needs less
+memory), except for tokens per second where above 1 is better.
+"""
+
+import json
+import sys
+
+measures = [
+    ("compile", "%.3f s"),
+    ("tokens_per_second", "%.0f tok/s"),
+    ("parse", "%.3f s"),
+    ("memory", "%.0f B"),
+]
+
+def load(filename):
+    f = open(filename)
+    try:
+        return json.load(f)
+    finally:
+        f.close()
+
+def describe(run):
+    return "%s (tpg %s, %s %s, scale %s)"%(run["commit"] or "unknown commit", run["tpg"], run["implementation"], run["python"], run["scale"])
+
+def compare(old, new):
+    results = dict(((result["grammar"], result["lexer"]), result) for result in old["results"])
+    for result in new["results"]:
+        key = result["grammar"], result["lexer"]
+        print("%s / %s"%key)
+        previous = results.get(key)
+        if previous is None:
+            print("    not measured in %s"%describe(old))
+            continue
+        for run, r in (("old", previous), ("new", result)):
+            if "error" in r:
+                print("    %s error: %s"%(run, r["error"]))
+        if "error" in previous or "error" in result:
+            continue
+        for measure, fmt in measures:
+            a, b = previous.get(measure), result.get(measure)
+            if a is None or b is None:
+                continue
+            ratio = a and "%6.2f"%(float(b)/a) or "%6s"%"-"
+            print("    %-18s %16s %16s   %s"%(measure, fmt%a, fmt%b, ratio))
+
+def main():
+    if len(sys.argv) != 3:
+        sys.stderr.write(__doc__)
+        sys.exit(1)
+    old, new = load(sys.argv[1]), load(sys.argv[2])
+    print("old: %s"%describe(old))
+    print("new: %s"%describe(new))
+    if old["scale"] != new["scale"]:
+        print("warning: the inputs have different scales")
+    compare(old, new)
+
+if __name__ == "__main__":
+    main()
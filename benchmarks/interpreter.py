@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+
+""" Execution of loop-heavy main.py programs
+
+usage: python benchmarks/interpreter.py [number of iterations]
+
+Programs of the language of main.py are parsed once and executed by the
+tree walker (evaluate), by the closures built by compile (run) and by the
+register machine (run with engine="vm"). The closures and the register machine
+also run the programs optimized by execute.optimize (-O).
+
+For each engine the benchmark prints the best time, the iterations per
+second and the peak memory allocated by a run (tracemalloc, Python 3).
+"""
+
+import os
+import runpy
+import sys
+import time
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, root)
+
+programs = [
+    ("arithmetic loop", """
+        i = 0;
+        s = 0;
+        while (i < ITERATIONS) {
+            s = s + i * 2 - i // 3 % 7;
+            i = i + 1;
+        }
+        print(s);
+    """),
+    ("nested loops and arrays", """
+        a = [0, 0, 0, 0, 0, 0, 0, 0, 0, 0];
+        i = 0;
+        while (i < ITERATIONS // 10) {
+            j = 0;
+            while (j < 10) {
+                a[j] = a[j] + i;
+                j = j + 1;
+            }
+            i = i + 1;
+        }
+        print(a);
+    """),
+    ("conditions", """
+        i = 0;
+        n = 0;
+        while (i < ITERATIONS) {
+            if (i % 3 == 0 and i % 5 <> 0) {
+                n = n + 1;
+            } else {
+                if (i in [1, 2, 4] or i >= 100) {
+                    n = n - 1;
+                }
+            }
+            i = i + 1;
+        }
+        print(n);
+    """),
+    ("literal arrays", """
+        i = 0;
+        n = 0;
+        while (i < ITERATIONS) {
+            if (i % 10 in [1, 3, 5, 7, 9]) {
+                n = n + [1, 2, 3, 4][i % 4];
+            }
+            p = [0, 0, 0, 0, 0, 0, 0, 0];
+            p[i % 8] = i;
+            n = n + p[i % 8] % 3;
+            i = i + 1;
+        }
+        print(n);
+    """),
+]
+
+engines = [
+    ("evaluate", False),
+    ("closures", False),
+    ("vm", False),
+    ("closures", True),
+    ("vm", True),
+]
+
+class Output:
+    """ Output()
+
+    Standard output replacement collecting the printed text.
+    """
+
+    def __init__(self):
+        self.text = []
+
+    def write(self, text):
+        self.text.append(text)
+
+    def flush(self):
+        pass
+
+def best(f, repeat=3):
+    times = []
+    for _ in range(repeat):
+        t0 = time.time()
+        result = f()
+        times.append(time.time() - t0)
+    return result, min(times)
+
+def peak_memory(f):
+    if tracemalloc is None:
+        return None
+    tracemalloc.start()
+    try:
+        f()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def execute(node, how):
+    stdout, sys.stdout = sys.stdout, Output()
+    try:
+        if how == "evaluate":
+            node.evaluate()
+        else:
+            node.run(engine=how)
+        return "".join(sys.stdout.text)
+    finally:
+        sys.stdout = stdout
+
+def main():
+    n = len(sys.argv) > 1 and int(sys.argv[1]) or 20000
+    env = runpy.run_path(os.path.join(root, "main.py"), run_name="main")
+    parse = env["Parser"]()
+    print("%d iterations"%n)
+    for name, source in programs:
+        source = source.replace("ITERATIONS", str(n))
+        node = parse(source)
+        optimized = parse(source)
+        eliminated = optimized.optimize()
+        print("%s: %d nodes, %d eliminated by -O"%(name, node.count(), eliminated))
+        outputs = []
+        for how, optimize in engines:
+            program = optimize and optimized or node
+            output, t = best(lambda: execute(program, how))
+            outputs.append(output)
+            memory = peak_memory(lambda: execute(program, how))
+            memory = memory is not None and "%8.1f kB"%(memory/1e3) or "%11s"%"-"
+            print("    %-12s %8.3f s %12.0f it/s %s"%(how + (optimize and " -O" or ""), t, n/t, memory))
+        assert len(set(outputs)) == 1, outputs
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+
+""" Lexical analysis of whitespace-heavy inputs
+
+usage: python benchmarks/separators.py [number of lines]
+
+The tokens of a generated input with a lot of indentation, blank lines
+and comments are scanned by NamedGroupLexer, first with the separators
+skipped by separator_re and then matched one by one by token_re (as
+before separator_re was introduced). Separators match a single space
+as in main.py and a whole comment.
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import tpg
+
+grammar = r"""
+    set lexer = NamedGroupLexer
+
+    separator space '\s' ;
+    separator comment '\#.*' ;
+
+    token int '\d+' $ int
+    token ident '\w+' ;
+    token op '[-+*/=;()]' ;
+
+    START -> ( int | ident | op )* ;
+"""
+
+class Parser(tpg.Parser):
+    __doc__ = grammar
+
+def make_input(lines):
+    return "".join("%s x%d  =  ( y  +  %d )  *  z ;    # comment %d\n\n"%(" "*(4*(i%8)), i, i, i) for i in range(lines))
+
+def scan(lexer, text):
+    lexer.start(text)
+    n = 0
+    while not isinstance(lexer.cur_token, tpg.EOFToken):
+        lexer.next_token()
+        n += 1
+    return n
+
+def best(f, repeat=5):
+    times = []
+    for _ in range(repeat):
+        t0 = time.time()
+        result = f()
+        times.append(time.time() - t0)
+    return result, min(times)
+
+def main():
+    lines = len(sys.argv) > 1 and int(sys.argv[1]) or 20000
+    text = make_input(lines)
+    print("%d lines, %d characters"%(lines, len(text)))
+    fast, slow = Parser().lexer, Parser().lexer
+    slow.separator_re = None
+    for name, lexer in (("separator_re", fast), ("token_re only", slow)):
+        ntokens, t = best(lambda: scan(lexer, text))
+        print("    %-36s %8.3f s (%d tokens)"%(name, t, ntokens))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,259 @@
+#!/usr/bin/env python
+
+""" Lexers, parsers and code generator benchmark suite
+
+usage: python benchmarks/suite.py [-s scale] [-r repeat] [-g grammar]... [-l lexer]... [-j file]
+
+Each grammar is compiled with each lexer and parses a generated input
+whose size is proportional to the scale:
+
+    synthetic   a small statement language
+    calc        the calculator of examples/calc.pyg
+    main        the language of main.py (without blocks nor real numbers)
+    tpg         the TPGParser self-grammar parsing and generating the code
+                of a grammar with many rules
+
+For each grammar and lexer the suite measures:
+
+    compile     time to define the parser class (grammar_cache disabled)
+                and to create its first parser (the lexer is built)
+    tokens      number of tokens of the input and tokens per second
+                scanned by tpg.tokenize (not available for
+                ContextSensitiveLexer)
+    parse       time to parse the input
+    memory      peak memory allocated by a parse (tracemalloc, Python 3)
+
+Times are the best of several runs. The results can be saved as JSON
+(-j file, or -j - for the standard output) and two result files compared
+with benchmarks/compare.py.
+"""
+
+import argparse
+import json
+import os
+import platform
+import re
+import runpy
+import subprocess
+import sys
+import time
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, root)
+
+import tpg
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+lexers = [
+    "NamedGroupLexer",
+    "Lexer",
+    "CacheNamedGroupLexer",
+    "CacheLexer",
+    "CompactCacheNamedGroupLexer",
+    "StreamNamedGroupLexer",
+    "ContextSensitiveLexer",
+    "auto",
+]
+
+class Workload:
+    """ Workload(name, base, env, size, make_input, init_args=())
+
+    A grammar to benchmark.
+
+    Attributes:
+        name       : name of the workload
+        base       : parser class defining the grammar
+        env        : globals of the module of the parser class
+        size       : size of the input for a scale of 1
+        make_input : function returning an input of a given size
+        init_args  : arguments of the parser constructor
+    """
+
+    def __init__(self, name, base, env, size, make_input, init_args=()):
+        self.name = name
+        self.base = base
+        self.env = env
+        self.size = size
+        self.make_input = make_input
+        self.init_args = init_args
+
+    def grammar(self, lexer):
+        grammar = getattr(self.base, "__grammar__", None) or self.base.__doc__
+        grammar = re.sub(r"(?m)^\s*set\s+lexer\s*=.*$", "", grammar)
+        return "set lexer = %s\n"%lexer + grammar
+
+    def parser_class(self, lexer):
+        """ define a subclass of the parser class using another lexer
+
+        The class is defined in a copy of the globals of the parser
+        module so that semantic actions find the same names.
+        """
+        env = dict(self.env)
+        env["benchmark_base"] = self.base
+        env["benchmark_grammar"] = self.grammar(lexer)
+        exec("class BenchmarkParser(benchmark_base):\n"
+             "    grammar_cache = False\n"
+             "    __doc__ = benchmark_grammar\n", env)
+        return env["BenchmarkParser"]
+
+    def parser(self, parser_class):
+        return parser_class(*self.init_args)
+
+synthetic_grammar = r"""
+    separator spaces '\s+' ;
+    separator comment '\#.*' ;
+
+    token number '\d+' $ int
+    token ident '[a-zA-Z_]\w*' ;
+
+    START/n -> $ n = 0
+        ( Stmt $ n += 1
+        )*
+    ;
+
+    Stmt -> 'let' ident '=' Expr ';' | 'print' Expr ';' ;
+
+    Expr/x -> Term/x ( '[-+]'/op Term/y $ x = (op, x, y)
+                     )*
+    ;
+
+    Term/x -> Atom/x ( '[*/]'/op Atom/y $ x = (op, x, y)
+                     )*
+    ;
+
+    Atom/x -> number/x | ident/x | '\(' Expr/x '\)' ;
+"""
+
+def synthetic():
+    class Synthetic(tpg.Parser):
+        __doc__ = synthetic_grammar
+    def make_input(size):
+        return "".join("let x%d = (y + %d) * z - %d / w;    # comment\nprint x%d * 2;\n"%(i, i, i, i) for i in range(size))
+    return Workload("synthetic", Synthetic, {"tpg": tpg}, 2000, make_input)
+
+def calc():
+    env = runpy.run_path(os.path.join(root, "examples", "calc.pyg"), run_name="calc")
+    terms = ["x", "2.5e1", "cos(y)", "norm(3, 4)", "(z - 1)", "sqrt(16)", "2^3"]
+    def make_input(size):
+        return "a = 1 + " + " + ".join("%d * %s"%(i, terms[i%len(terms)]) for i in range(size))
+    return Workload("calc", env["Calc"], env, 4000, make_input)
+
+def main_language():
+    env = runpy.run_path(os.path.join(root, "main.py"), run_name="main")
+    def make_input(size):
+        return "".join('x%d = [1, %d, "s%d"];\nprint(x%d[0] + %d * (y - 2) // 4 and z <= 3);\n'%(i, i, i, i, i) for i in range(size))
+    return Workload("main", env["Parser"], env, 1000, make_input)
+
+def tpg_grammar():
+    def make_input(size):
+        rules = ["R%d/x -> 'k%d' number/x ( ',' number/y $ x = x + y\n    )* | ident/x R%d/y ;\n"%(i, i, (i+1)%size) for i in range(size)]
+        return "separator spaces '\\s+' ;\ntoken number '\\d+' $ int\ntoken ident '\\w+' ;\nSTART/x -> R0/x ;\n" + "".join(rules)
+    return Workload("tpg", tpg.TPGParser, vars(tpg), 400, make_input, ({},))
+
+workloads = [synthetic, calc, main_language, tpg_grammar]
+
+def best(f, repeat=5):
+    times = []
+    for _ in range(repeat):
+        t0 = time.time()
+        result = f()
+        times.append(time.time() - t0)
+    return result, min(times)
+
+def peak_memory(f):
+    if tracemalloc is None:
+        return None
+    tracemalloc.start()
+    try:
+        f()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def count_tokens(parser, text):
+    n = 0
+    for _ in tpg.tokenize(parser, text):
+        n += 1
+    return n
+
+def measure(workload, lexer, text, repeat):
+    result = {"grammar": workload.name, "lexer": lexer, "characters": len(text)}
+    def define():
+        return workload.parser(workload.parser_class(lexer))
+    try:
+        parser, result["compile"] = best(define, repeat)
+        if lexer == "ContextSensitiveLexer":
+            result["tokens"] = result["tokens_per_second"] = None
+        else:
+            result["tokens"], t = best(lambda: count_tokens(parser, text), repeat)
+            result["tokens_per_second"] = t and result["tokens"] / t
+        _, result["parse"] = best(lambda: parser(text), repeat)
+        result["memory"] = peak_memory(lambda: parser(text))
+    except Exception:
+        result["error"] = str(sys.exc_info()[1])
+    return result
+
+def commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=root, stderr=subprocess.STDOUT).decode().strip()
+    except Exception:
+        return None
+
+def report(result):
+    if "error" in result:
+        print("    %-28s error: %s"%(result["lexer"], result["error"]))
+        return
+    tokens = result["tokens_per_second"] and "%10.0f tok/s"%result["tokens_per_second"] or "%16s"%"-"
+    memory = result["memory"] is not None and "%8.1f MB"%(result["memory"]/1e6) or "%11s"%"-"
+    print("    %-28s compile %7.3f s   %s   parse %7.3f s   %s"%(result["lexer"], result["compile"], tokens, result["parse"], memory))
+
+def main():
+    names = [workload.__name__.replace("_language", "").replace("_grammar", "") for workload in workloads]
+    options = argparse.ArgumentParser(description="TPG benchmark suite")
+    options.add_argument("-s", "--scale", type=float, default=1.0, help="input size factor (default 1)")
+    options.add_argument("-r", "--repeat", type=int, default=3, help="number of runs of each measure (default 3)")
+    options.add_argument("-g", "--grammar", action="append", choices=names, help="grammars to benchmark (default all)")
+    options.add_argument("-l", "--lexer", action="append", choices=lexers, help="lexers to benchmark (default all)")
+    options.add_argument("-j", "--json", metavar="FILE", help="save the results as JSON in FILE (- for stdout)")
+    args = options.parse_args()
+    log = args.json == "-" and sys.stderr or sys.stdout
+    results = []
+    for name, workload in zip(names, workloads):
+        if args.grammar and name not in args.grammar:
+            continue
+        workload = workload()
+        text = workload.make_input(max(1, int(workload.size*args.scale)))
+        log.write("%s: %d characters\n"%(workload.name, len(text)))
+        for lexer in args.lexer or lexers:
+            result = measure(workload, lexer, text, args.repeat)
+            results.append(result)
+            if log is sys.stdout:
+                report(result)
+            else:
+                log.write("    %s\n"%lexer)
+    if args.json:
+        output = {
+            "commit": commit(),
+            "tpg": tpg.__version__,
+            "python": platform.python_version(),
+            "implementation": platform.python_implementation(),
+            "scale": args.scale,
+            "repeat": args.repeat,
+            "results": results,
+        }
+        if args.json == "-":
+            json.dump(output, sys.stdout, indent=1, sort_keys=True)
+            sys.stdout.write("\n")
+        else:
+            f = open(args.json, "w")
+            try:
+                json.dump(output, f, indent=1, sort_keys=True)
+            finally:
+                f.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+
+""" Memory used per token by the cache lexers
+
+usage: python benchmarks/token_memory.py [number of lines]
+
+The token list of a generated input is built by each cache lexer and
+the memory allocated during the lexical analysis (without the input
+string) is divided by the number of tokens. The size of the token
+objects alone is also compared with objects storing the same
+attributes in a __dict__, as tokens did before Token used __slots__.
+"""
+
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import tpg
+
+grammar = r"""
+    set lexer = %s
+
+    separator spaces '\s+' ;
+
+    token int '\d+' $ int
+    token ident '\w+' ;
+    token op '[-+*/=;()]' ;
+
+    START -> ( int | ident | op )* ;
+"""
+
+def make_input(lines):
+    return "".join("x%d = (y + %d) * z / 2;\n"%(i, i) for i in range(lines))
+
+class DictToken:
+    def __init__(self, token):
+        self.__dict__.update((name, getattr(token, name)) for name in tpg.Token.__slots__
+                             if name != '__weakref__' and hasattr(token, name))
+
+def measure(build):
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = build()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, after - before
+
+def lexer_for(name):
+    class Parser(tpg.Parser):
+        __doc__ = grammar%name
+    return Parser().lexer
+
+def main():
+    lines = len(sys.argv) > 1 and int(sys.argv[1]) or 20000
+    text = make_input(lines)
+    print("%d lines, %d characters"%(lines, len(text)))
+
+    lexer = lexer_for("CacheNamedGroupLexer")
+    lexer.start(text)
+    ntokens = len(lexer.cache)
+    print("token objects (text and value shared):")
+    tokens, size = measure(lambda: [DictToken(t) for t in lexer.cache])
+    print("    %-36s %8.1f bytes/token"%("Token with __dict__", float(size)/ntokens))
+    del tokens
+    tokens, size = measure(lambda: [tpg.Token(t.name, t.text, t.value, t.line, t.column, t.end_line, t.end_column, t.start, t.stop, t.prev_stop)
+                                    for t in lexer.cache])
+    print("    %-36s %8.1f bytes/token"%("Token with __slots__", float(size)/ntokens))
+    del tokens, lexer
+
+    print("token list built by the lexer:")
+    for name in ("CacheNamedGroupLexer", "CompactCacheNamedGroupLexer"):
+        lexer = lexer_for(name)
+        lexer.build()
+        _, size = measure(lambda: lexer.start(text))
+        print("    %-36s %8.1f bytes/token"%(name, float(size)/ntokens))
+        del lexer
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+
+""" Tokenizing without a parser
+
+usage: python benchmarks/tokenizer.py [number of lines]
+
+The tokens of a generated input are built by driving the lexer with
+tpg.tokenize and by scanning the whole input with tpg.tokenize_all.
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import tpg
+
+grammar = r"""
+    set lexer = %s
+
+    separator spaces '\s+' ;
+    separator comment '\#.*' ;
+
+    token int '\d+' $ int
+    token ident '\w+' ;
+    token op '[-+*/=;()]' ;
+
+    START -> ( int | ident | op )* ;
+"""
+
+def make_input(lines):
+    return "".join("x%d = (y + %d) * z / 2;    # comment\n"%(i, i) for i in range(lines))
+
+def parser_for(name):
+    class Parser(tpg.Parser):
+        __doc__ = grammar%name
+    return Parser()
+
+def best(f, repeat=5):
+    times = []
+    for _ in range(repeat):
+        t0 = time.time()
+        result = f()
+        times.append(time.time() - t0)
+    return result, min(times)
+
+def main():
+    lines = len(sys.argv) > 1 and int(sys.argv[1]) or 20000
+    text = make_input(lines)
+    print("%d lines, %d characters"%(lines, len(text)))
+    for name in ("NamedGroupLexer", "CacheNamedGroupLexer"):
+        p = parser_for(name)
+        print("%s:"%name)
+        for f in (tpg.tokenize, tpg.tokenize_all):
+            tokens, t = best(lambda: list(f(p, text)))
+            print("    %-36s %8.3f s (%d tokens)"%(f.__name__, t, len(tokens)))
+
+if __name__ == "__main__":
+    main()
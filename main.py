@@ -1,8 +1,8 @@
 #Antony Kwok 108497731
+import operator
 import sys
 import tpg
 
-dict = {}
 class SemanticError(Exception):
     """
     This is the class of the exception that is raised when a semantic error
@@ -15,39 +15,234 @@ class Node(object):
     A base class for nodes. Might come in handy in the future.
     """
 
-    def evaluate(self):
+    def evaluate(self, env):
         """
-        Called on children of Node to evaluate that child.
+        Called on children of Node to evaluate that child. env is the list
+        of the values of the variables, indexed by their slots.
         """
         raise Exception("Not implemented.")
 
+    def compile(self):
+        """
+        Called on children of Node to turn that child into a closure. The
+        closure takes the list of the values of the variables and evaluates
+        the child without walking the tree again.
+        """
+        raise Exception("Not implemented.")
+
+    def emit(self, program):
+        """
+        Called on children of Node (statements) to append the instructions
+        of that child to a Program of the register machine.
+        """
+        raise Exception("Not implemented.")
+
+    def operand(self, program):
+        """
+        Called on children of Node (expressions) to append the instructions
+        computing that child to a Program of the register machine. Returns
+        the slot of the frame holding the value: the slot of a variable or
+        of a constant, or a temporary slot.
+        """
+        raise Exception("Not implemented.")
+
+    def compile_value(self):
+        """
+        Like compile, for a child whose value may be stored (in a variable
+        or in an array) and then modified.
+        """
+        return self.compile()
+
+    def storable(self, program):
+        """
+        Like operand, for a child whose value may be stored.
+        """
+        return self.operand(program)
+
+    def emit_store(self, program, slot):
+        """
+        Appends the instructions storing the value of that child in slot.
+        """
+        source = self.storable(program)
+        program.release(source)
+        program.emit(MOVE, slot, source)
+
+    def emit_jump(self, program, jump):
+        """
+        Appends the instructions jumping on the value of that child used as
+        a condition (jump is JUMP_IF_FALSE or JUMP_IF_TRUE). Returns the
+        position of the jump, to patch its target.
+        """
+        source = self.operand(program)
+        program.release(source)
+        return program.emit(jump, 0, source)
+
+    def may_raise(self):
+        """
+        Tells whether the evaluation of this child may raise another
+        exception than SemanticError (floor divisions are not checked).
+        """
+        for child in self.children():
+            if child.may_raise():
+                return True
+        return False
+
+    # Names of the attributes holding the children (nodes or lists of
+    # nodes).
+    fields = ()
+
+    def children(self):
+        """
+        The nodes under this node.
+        """
+        for field in self.fields:
+            value = getattr(self, field)
+            if isinstance(value, list):
+                for item in value:
+                    yield item
+            else:
+                yield value
+
+    def count(self):
+        """
+        The number of nodes of the tree of this node.
+        """
+        return 1 + sum([child.count() for child in self.children()])
+
+    def is_constant(self):
+        """
+        Tells whether the value of this node is known before running the
+        program (literals and arrays of literals).
+        """
+        return False
+
+    def fold(self):
+        """
+        Called on children of Node to fold the constants under that child.
+        Returns the node replacing the child.
+        """
+        for field in self.fields:
+            value = getattr(self, field)
+            if isinstance(value, list):
+                setattr(self, field, [item.fold() for item in value])
+            else:
+                setattr(self, field, value.fold())
+        return self
+
+
+# Types accepted by the arithmetic operators.
+numbers = (int, float)
+
+# Types accepted by "+" (both operands must have the same type).
+addables = (int, float, str, list)
+
+# Value of the variables that have not been assigned yet.
+unset = object()
+
+# Largest power of integers computed by fold, in bits. Larger powers are
+# left to be computed when the program runs, if it ever does.
+fold_power_bits = 4096
+
 
 class Array(Node):
+    fields = ("value",)
+
     def __init__(self, value):
         self.value = value
 
-    def evaluate(self):
+    def evaluate(self, env):
         list = []
         for i in self.value:
-            list.append(i.evaluate())
+            list.append(i.evaluate(env))
         return list
 
+    def compile(self):
+        if self.is_shared():
+            shared = self.evaluate(None)
+            return lambda env: shared
+        items = [i.compile_value() for i in self.value]
+        def run(env):
+            return [item(env) for item in items]
+        return run
+
+    def compile_value(self):
+        if self.is_shared():
+            shared = self.evaluate(None)
+            return lambda env: shared[:]
+        return self.compile()
+
+    def operand(self, program):
+        if self.is_shared():
+            return program.constant(self.evaluate(None))
+        sources = operands(program, self.value, True)
+        program.release(*sources)
+        target = program.temporary()
+        program.emit(ARRAY, target, tuple(sources))
+        return target
+
+    def storable(self, program):
+        if self.is_shared():
+            target = program.temporary()
+            program.emit(COPY, target, program.constant(self.evaluate(None)))
+            return target
+        return self.operand(program)
+
+    def emit_store(self, program, slot):
+        if self.is_shared():
+            program.emit(COPY, slot, program.constant(self.evaluate(None)))
+        else:
+            sources = operands(program, self.value, True)
+            program.release(*sources)
+            program.emit(ARRAY, slot, tuple(sources))
+
+    def is_constant(self):
+        for i in self.value:
+            if not i.is_constant():
+                return False
+        return True
+
+    def is_shared(self):
+        """
+        Tells whether the compiled array is built once and shared by all
+        the runs: arrays of literals that are not arrays. The shared list
+        is read (indexed, added, printed...) but never stored: where it may
+        be stored and then modified, a copy is made (compile_value).
+        """
+        if not self.is_constant():
+            return False
+        for i in self.value:
+            if isinstance(i, Array):
+                return False
+        return True
+
 class Str(Node):
     def __init__(self, value):
         self.value = value[1:len(value) - 1]
 
-    def evaluate(self):
+    def evaluate(self, env):
         return self.value
 
+    def compile(self):
+        value = self.value
+        return lambda env: value
+
+    def operand(self, program):
+        return program.constant(self.value)
+
+    def is_constant(self):
+        return True
+
 class operation(Node):
+    fields = ("left", "right")
+
     def __init__(self, left, op, right):
         self.left = left
         self.op = op
         self.right = right
 
-    def evaluate(self):
-        left = self.left.evaluate()
-        right = self.right.evaluate()
+    def evaluate(self, env):
+        left = self.left.evaluate(env)
+        right = self.right.evaluate(env)
         if self.op == '[':
             if not (isinstance(right, int)):
                 raise SemanticError
@@ -158,43 +353,273 @@ class operation(Node):
                 return 0
             return 1
 
+    def compile(self):
+        """
+        The operator is resolved here, once, and the closure only does the
+        type checks of this operator. Operands are evaluated from left to
+        right and raise the same SemanticErrors as evaluate.
+        """
+        left = self.left.compile()
+        right = self.right.compile()
+        op = self.op
+        if op == '[':
+            def run(env):
+                l = left(env)
+                r = right(env)
+                if type(r) is not int or type(l) not in (list, str):
+                    raise SemanticError
+                try:
+                    return l[r]
+                except IndexError:
+                    raise SemanticError
+        elif op == "*":
+            def run(env):
+                l = left(env)
+                r = right(env)
+                if type(l) not in numbers or type(r) not in numbers:
+                    raise SemanticError
+                return l * r
+        elif op == "/":
+            def run(env):
+                l = left(env)
+                r = right(env)
+                if type(l) not in numbers or type(r) not in numbers or r == 0:
+                    raise SemanticError
+                return l / r
+        elif op == "%":
+            def run(env):
+                l = left(env)
+                r = right(env)
+                if type(l) not in numbers or type(r) not in numbers:
+                    raise SemanticError
+                return l % r
+        elif op == "**":
+            def run(env):
+                l = left(env)
+                r = right(env)
+                if type(l) not in numbers or type(r) not in numbers:
+                    raise SemanticError
+                return pow(l, r)
+        elif op == "//":
+            def run(env):
+                return left(env) // right(env)
+        elif op == "+":
+            def run(env):
+                l = left(env)
+                r = right(env)
+                if type(l) is not type(r) or type(l) not in addables:
+                    raise SemanticError
+                return l + r
+        elif op == "-":
+            def run(env):
+                l = left(env)
+                r = right(env)
+                if type(l) not in numbers or type(r) not in numbers:
+                    raise SemanticError
+                return l - r
+        elif op == "in":
+            def run(env):
+                l = left(env)
+                r = right(env)
+                try:
+                    return 1 if l in r else 0
+                except:
+                    raise SemanticError
+        elif op in comparisons:
+            compare = comparisons[op]
+            def run(env):
+                l = left(env)
+                r = right(env)
+                if type(l) is not int or type(r) is not int:
+                    raise SemanticError
+                return 1 if compare(l, r) else 0
+        elif op == "not":
+            # the parser gives the operand as left and right operand
+            def run(env):
+                r = right(env)
+                if type(r) is not int:
+                    raise SemanticError
+                return 1 if r == 0 else 0
+        elif op in ("and", "&", "&&"):
+            def run(env):
+                l = left(env)
+                r = right(env)
+                if type(l) is not int or type(r) is not int:
+                    raise SemanticError
+                return 0 if l == 0 or r == 0 else 1
+        elif op in ("or", "|", "||"):
+            def run(env):
+                l = left(env)
+                r = right(env)
+                if type(l) is not int or type(r) is not int:
+                    raise SemanticError
+                return 0 if l == 0 and r == 0 else 1
+        else:
+            # operators without semantics (xor) evaluate to None
+            def run(env):
+                left(env)
+                right(env)
+        return run
+
+    def operand(self, program):
+        return self.emit_operation(program, None)
+
+    def emit_store(self, program, slot):
+        self.emit_operation(program, slot)
+
+    def emit_jump(self, program, jump):
+        if self.op not in comparisons:
+            return Node.emit_jump(self, program, jump)
+        # the comparison and the jump are done by one instruction
+        left, right = operands(program, (self.left, self.right))
+        program.release(left, right)
+        return program.emit(comparison_jumps[jump], 0, comparisons[self.op], left, right)
+
+    def may_raise(self):
+        return self.op == "//" or Node.may_raise(self)
+
+    def emit_operation(self, program, target):
+        """
+        Appends the instruction of the operation, which stores its result
+        in target (a new temporary slot if target is None). Returns the
+        slot of the result.
+        """
+        op = self.op
+        if op == "not":
+            # the parser gives the operand as left and right operand
+            sources = [self.right.operand(program)]
+        else:
+            sources = operands(program, (self.left, self.right))
+        program.release(*sources)
+        if target is None:
+            target = program.temporary()
+        if op in arithmetic_functions:
+            program.emit(ARITHMETIC, target, arithmetic_functions[op], *sources)
+        elif op in comparisons:
+            program.emit(COMPARE, target, comparisons[op], *sources)
+        else:
+            program.emit(operation_instructions.get(op, XOR), target, *sources)
+        return target
+
+    def fold(self):
+        """
+        An operation of constants is replaced by its value, unless it
+        raises an error, which is left to be raised when the program runs,
+        or it is a power larger than fold_power_bits.
+        """
+        Node.fold(self)
+        if not (self.left.is_constant() and self.right.is_constant()):
+            return self
+        if self.op == "**":
+            base, exponent = self.left.evaluate(None), self.right.evaluate(None)
+            if (isinstance(base, int) and isinstance(exponent, int) and
+                    exponent * base.bit_length() > fold_power_bits):
+                return self
+        try:
+            value = self.evaluate(None)
+        except Exception:
+            return self
+        return literal(value)
+
+# Comparison operators of integers.
+comparisons = {
+    "<": operator.lt,
+    "<=": operator.le,
+    "==": operator.eq,
+    "<>": operator.ne,
+    ">": operator.gt,
+    ">=": operator.ge,
+}
+
 class assignment(Node):
+    fields = ("left", "right")
+
     def __init__(self, left, op, right):
         self.left = left
         self.right = right
         self.op = op
 
-    def evaluate(self):
+    def evaluate(self, env):
+        if isinstance(self.left, Variable):
+            env[self.left.slot] = self.right.evaluate(env)
+        elif isinstance(self.left, arrayIndex):
+            (self.left.array.evaluate(env))[self.left.index.evaluate(env)] = self.right.evaluate(env)
+
+    def compile(self):
+        right = self.right.compile_value()
+        if isinstance(self.left, Variable):
+            slot = self.left.slot
+            def run(env):
+                env[slot] = right(env)
+        elif isinstance(self.left, arrayIndex):
+            array = self.left.array.compile()
+            index = self.left.index.compile()
+            def run(env):
+                # same order as evaluate: value, array and then index
+                value = right(env)
+                array(env)[index(env)] = value
+        else:
+            def run(env):
+                pass
+        return run
+
+    def emit(self, program):
         if isinstance(self.left, Variable):
-            dict[self.left.value] = self.right.evaluate()
+            self.right.emit_store(program, self.left.slot)
         elif isinstance(self.left, arrayIndex):
-            (self.left.array.evaluate())[self.left.index.evaluate()] = self.right.evaluate()
+            # same order as evaluate: value, array and then index
+            value, array, index = operands(program, (self.right, self.left.array, self.left.index), True)
+            program.release(value, array, index)
+            program.emit(STORE_INDEX, array, index, value)
 
 class Variable(Node):
     """
-    A node representing integer literals.
+    A node representing variables. slot is the index of the variable in
+    the environment, given by resolve.
     """
 
     def __init__(self, value):
         self.value = value
+        self.slot = None
 
-    def evaluate(self):
-        try:
-            return dict[self.value]
-        except:
+    def evaluate(self, env):
+        value = env[self.slot]
+        if value is unset:
             raise SemanticError
+        return value
+
+    def compile(self):
+        slot = self.slot
+        def run(env):
+            value = env[slot]
+            if value is unset:
+                raise SemanticError
+            return value
+        return run
+
+    def operand(self, program):
+        return self.slot
 
 class arrayIndex(Node):
     """
     A node representing an array[index] call for assignment
     """
+    fields = ("array", "index")
+
     def __init__(self, array, index):
         self.array = array
         self.index = index
 
-    def evaluate(self):
+    def evaluate(self, env):
         return self.array
 
+    def compile(self):
+        array = self.array
+        return lambda env: array
+
+    def operand(self, program):
+        return program.constant(self.array)
+
 class IntLiteral(Node):
     """
     A node representing integer literals.
@@ -203,9 +628,19 @@ class IntLiteral(Node):
     def __init__(self, value):
         self.value = int(value)
 
-    def evaluate(self):
+    def evaluate(self, env):
         return self.value
 
+    def compile(self):
+        value = self.value
+        return lambda env: value
+
+    def operand(self, program):
+        return program.constant(self.value)
+
+    def is_constant(self):
+        return True
+
 class RealLiteral(Node):
     """
     A node representing real literals.
@@ -214,65 +649,643 @@ class RealLiteral(Node):
     def __init__(self, value):
         self.value = float(value)
         print("real is ", value)
-    def evaluate(self):
+    def evaluate(self, env):
+        return self.value
+
+    def compile(self):
+        value = self.value
+        return lambda env: value
+
+    def operand(self, program):
+        return program.constant(self.value)
+
+    def is_constant(self):
+        return True
+
+class Constant(Node):
+    """
+    A node representing a value computed by fold.
+    """
+
+    def __init__(self, value):
+        self.value = value
+
+    def evaluate(self, env):
         return self.value
 
+    def compile(self):
+        value = self.value
+        return lambda env: value
+
+    def operand(self, program):
+        return program.constant(self.value)
+
+    def is_constant(self):
+        return True
+
+def literal(value):
+    """
+    Returns a node representing a value computed by fold. Arrays give
+    Array nodes, so that each evaluation gives a new list.
+    """
+    if isinstance(value, list):
+        return Array([literal(i) for i in value])
+    return Constant(value)
+
 class printer(Node):
+    fields = ("value",)
+
     def __init__(self, value):
         self.value = value
-    def evaluate(self):
-        print(str(self.value.evaluate()))
+    def evaluate(self, env):
+        print(str(self.value.evaluate(env)))
+
+    def compile(self):
+        value = self.value.compile()
+        def run(env):
+            print(str(value(env)))
+        return run
+
+    def emit(self, program):
+        source = self.value.operand(program)
+        program.release(source)
+        program.emit(PRINT, source)
 
 class block(Node):
+    fields = ("value",)
+
     def __init__(self, value):
         self.value = value
-    def evaluate(self):
-        list = []
+    def evaluate(self, env):
         for i in self.value:
-            list.append(i.evaluate())
-        pass
+            i.evaluate(env)
+
+    def statements(self):
+        """
+        The statements of the block, the blocks nested in the block being
+        replaced by their statements.
+        """
+        statements = []
+        for i in self.value:
+            if isinstance(i, block):
+                statements.extend(i.statements())
+            else:
+                statements.append(i)
+        return statements
+
+    def compile(self):
+        statements = tuple([i.compile() for i in self.statements()])
+        if len(statements) == 1:
+            return statements[0]
+        def run(env):
+            for statement in statements:
+                statement(env)
+        return run
+
+    def emit(self, program):
+        for i in self.value:
+            i.emit(program)
+
+    def fold(self):
+        Node.fold(self)
+        # the blocks emptied by the removal of branches are removed too
+        self.value = [i for i in self.value if not (isinstance(i, block) and not i.value)]
+        return self
 
 class ifCall(Node):
+    fields = ("condition", "value")
+
     def __init__(self, conidition, value):
         self.condition = conidition
         self.value = value
 
-    def evaluate(self):
-        if self.condition.evaluate() != 0:
-            self.value.evaluate()
+    def evaluate(self, env):
+        if self.condition.evaluate(env) != 0:
+            self.value.evaluate(env)
         pass
 
+    def compile(self):
+        condition = self.condition.compile()
+        value = self.value.compile()
+        def run(env):
+            if condition(env) != 0:
+                value(env)
+        return run
+
+    def emit(self, program):
+        end = self.condition.emit_jump(program, JUMP_IF_FALSE)
+        self.value.emit(program)
+        program.patch(end)
+
+    def fold(self):
+        Node.fold(self)
+        if not self.condition.is_constant():
+            return self
+        if self.condition.evaluate(None) != 0:
+            return self.value
+        return block([])
+
 class ifElseCall(Node):
+    fields = ("ifCall", "value")
+
     def __init__(self, ifCall, value):
         self.ifCall = ifCall
         self.value = value
 
-    def evaluate(self):
-        if self.ifCall.condition.evaluate() != 0:            #get value of ifCall's condition
-            self.ifCall.evaluate()
+    def evaluate(self, env):
+        if self.ifCall.condition.evaluate(env) != 0:            #get value of ifCall's condition
+            self.ifCall.evaluate(env)
         else:
-            self.value.evaluate()
+            self.value.evaluate(env)
         pass
 
+    def compile(self):
+        # evaluate computes the condition twice; as expressions have no
+        # side effects, the closure computes it once
+        condition = self.ifCall.condition.compile()
+        value = self.ifCall.value.compile()
+        other = self.value.compile()
+        def run(env):
+            if condition(env) != 0:
+                value(env)
+            else:
+                other(env)
+        return run
+
+    def emit(self, program):
+        other = self.ifCall.condition.emit_jump(program, JUMP_IF_FALSE)
+        self.ifCall.value.emit(program)
+        end = program.emit(JUMP)
+        program.patch(other)
+        self.value.emit(program)
+        program.patch(end)
+
+    def fold(self):
+        # ifCall is folded here as it must stay an ifCall
+        condition = self.ifCall.condition = self.ifCall.condition.fold()
+        self.ifCall.value = self.ifCall.value.fold()
+        self.value = self.value.fold()
+        if not condition.is_constant():
+            return self
+        if condition.evaluate(None) != 0:
+            return self.ifCall.value
+        return self.value
+
 class whileLoop(Node):
+    fields = ("condition", "value")
+
     def __init__(self, conidition, value):
         self.condition = conidition
         self.value = value
 
-    def evaluate(self):
-        while self.condition.evaluate() != 0:
-            self.value.evaluate()
+    def evaluate(self, env):
+        while self.condition.evaluate(env) != 0:
+            self.value.evaluate(env)
         pass
 
+    def compile(self):
+        condition = self.condition.compile()
+        statements = tuple([i.compile() for i in self.value.statements()])
+        if len(statements) == 1:
+            statement = statements[0]
+            def run(env):
+                while condition(env) != 0:
+                    statement(env)
+        else:
+            # the statements of the body are run here, without a call to
+            # the closure of the block at each iteration
+            def run(env):
+                while condition(env) != 0:
+                    for statement in statements:
+                        statement(env)
+        return run
+
+    def emit(self, program):
+        # the condition is placed after the body: an iteration runs one
+        # compare-and-jump instead of a jump back and a conditional jump
+        condition = program.emit(JUMP)
+        start = len(program.code)
+        self.value.emit(program)
+        program.patch(condition)
+        program.patch(self.condition.emit_jump(program, JUMP_IF_TRUE), start)
+
+    def fold(self):
+        Node.fold(self)
+        if self.condition.is_constant() and self.condition.evaluate(None) == 0:
+            return block([])
+        return self
+
+def resolve(node):
+    """
+    Gives a slot to every variable under node, the same slot to the
+    variables of the same name. Returns the list of the names of the
+    slots.
+    """
+    slots = {}
+    names = []
+    nodes = [node]
+    while nodes:
+        node = nodes.pop()
+        if isinstance(node, Variable):
+            if node.value not in slots:
+                slots[node.value] = len(names)
+                names.append(node.value)
+            node.slot = slots[node.value]
+        nodes.extend(node.children())
+    return names
+
+class Environment(object):
+    """
+    The variables of a run of a program. values is the list of the values
+    of the variables, indexed by the slots given by resolve, and names
+    gives the name of each slot. Runs with their own environments are
+    isolated, even when they run the same program at the same time.
+    """
+
+    def __init__(self, names, variables=None):
+        self.names = names
+        self.values = [unset] * len(names)
+        if variables:
+            for slot, name in enumerate(names):
+                if name in variables:
+                    self.values[slot] = variables[name]
+
+    def variables(self):
+        """
+        Returns the dictionary of the variables that have a value.
+        """
+        return dict([(name, value) for name, value in zip(self.names, self.values) if value is not unset])
+
 class execute(Node):
     """
-    Does evaluate to execute
+    Does evaluate to execute. The variables of the program are resolved
+    to slots when the node is built.
     """
+    fields = ("value",)
+
     def __init__(self, value):
         self.value = value
+        self.names = resolve(value)
+        self.code = None
+        self.program = None
+
+    def environment(self, variables=None):
+        """
+        Returns a new environment for this program, with the values of
+        the variables given in the variables dictionary.
+        """
+        return Environment(self.names, variables)
 
-    def evaluate(self):
-        self.value.evaluate()
+    def evaluate(self, environment=None):
+        """
+        Executes the program by walking the tree. The variables are stored
+        in environment (a new one by default), which is returned.
+        """
+        if environment is None:
+            environment = self.environment()
+        self.value.evaluate(environment.values)
+        return environment
+
+    def compile(self):
+        return self.value.compile()
+
+    def emit(self, program):
+        self.value.emit(program)
+
+    def optimize(self):
+        """
+        Folds the operations of constants and removes the branches whose
+        condition is constant. Returns the number of nodes eliminated.
+        """
+        count = self.count()
+        self.value = self.value.fold()
+        self.code = None
+        self.program = None
+        return count - self.count()
+
+    def assemble(self):
+        """
+        Compiles the program to the instructions of the register machine.
+        """
+        program = Program(len(self.names))
+        self.emit(program)
+        return program
+
+    def run(self, environment=None, engine="closures"):
+        """
+        Executes the program with closures (engine="closures") or with the
+        register machine (engine="vm"), compiled on the first run. The
+        variables are stored in environment (a new one by default), which
+        is returned.
+        """
+        if environment is None:
+            environment = self.environment()
+        if engine == "vm":
+            if self.program is None:
+                self.program = self.assemble()
+            interpret(self.program, environment.values)
+        else:
+            if self.code is None:
+                self.code = self.compile()
+            self.code(environment.values)
+        return environment
+
+
+# This is the register machine running the compiled programs.
+
+# Opcodes of the instructions, the most frequent in loops first. An
+# instruction is a tuple of its opcode and of its arguments, the first
+# one being the slot of the result or the target of a jump:
+#   ARITHMETIC, COMPARE               target, function, left, right
+#   COMPARE_JUMP_IF_TRUE/FALSE        target, function, left, right
+#   ADD, INDEX, IN, FLOOR_DIVIDE,
+#   AND, OR, DIVIDE, XOR              target, left, right
+#   MOVE, COPY, NOT                   target, source
+#   JUMP_IF_FALSE, JUMP_IF_TRUE       target, source
+#   ARRAY                             target, sources
+#   STORE_INDEX                       array, index, value
+#   JUMP                              target
+#   PRINT                             source
+#
+# The instructions are tuples rather than integers encoded in an
+# array('i'): the dispatch loop unpacks a tuple in one step, while it
+# would read each argument of an encoded instruction by indexing the
+# array, which is about three times slower per instruction. Tuples also
+# hold the functions of the operators and the slots of ARRAY directly.
+(ARITHMETIC, ADD, COMPARE_JUMP_IF_TRUE, COMPARE_JUMP_IF_FALSE, MOVE, INDEX,
+ STORE_INDEX, COMPARE, JUMP, IN, FLOOR_DIVIDE, AND, OR, JUMP_IF_FALSE,
+ JUMP_IF_TRUE, COPY, ARRAY, DIVIDE, NOT, PRINT, XOR) = range(21)
+
+# Functions of the operators of ARITHMETIC (the functions of COMPARE are
+# in comparisons).
+arithmetic_functions = {
+    "*": operator.mul,
+    "%": operator.mod,
+    "**": pow,
+    "-": operator.sub,
+}
+
+# Instructions of the other operators (XOR for the operators without
+# semantics).
+operation_instructions = {
+    "[": INDEX,
+    "/": DIVIDE,
+    "//": FLOOR_DIVIDE,
+    "+": ADD,
+    "in": IN,
+    "not": NOT,
+    "and": AND, "&": AND, "&&": AND,
+    "or": OR, "|": OR, "||": OR,
+}
+
+# Instructions comparing and jumping, for the jump on a comparison.
+comparison_jumps = {
+    JUMP_IF_FALSE: COMPARE_JUMP_IF_FALSE,
+    JUMP_IF_TRUE: COMPARE_JUMP_IF_TRUE,
+}
+
+class Program(object):
+    """
+    A program compiled for the register machine. code is the list of the
+    instructions. The instructions read and write the values in a frame:
+    the variables (slots 0 to variables - 1), then the constants, whose
+    values are in constants, and then the temporary values of the
+    expressions, whose slots are negative (counted from the end of the
+    frame). temporaries is the number of temporary slots.
+    """
+
+    def __init__(self, variables):
+        self.code = []
+        self.variables = variables
+        self.constants = []
+        self.constant_slots = {}
+        self.temporaries = 0
+        self.depth = 0
+
+    def emit(self, op, *args):
+        """
+        Appends an instruction and returns its position (to patch jumps).
+        """
+        self.code.append((op,) + args)
+        return len(self.code) - 1
+
+    def patch(self, position, target=None):
+        """
+        Makes the jump at position go to target (by default the end of the
+        code).
+        """
+        if target is None:
+            target = len(self.code)
+        instruction = self.code[position]
+        self.code[position] = (instruction[0], target) + instruction[2:]
+
+    def constant(self, value):
+        """
+        Returns the slot of a constant.
+        """
+        # repr tells 0.0 from -0.0
+        key = type(value), repr(value)
+        if key not in self.constant_slots:
+            self.constant_slots[key] = self.variables + len(self.constants)
+            self.constants.append(value)
+        return self.constant_slots[key]
+
+    def temporary(self):
+        """
+        Returns a free temporary slot. The temporary slots are used as a
+        stack: they are released in the reverse order.
+        """
+        self.depth += 1
+        self.temporaries = max(self.temporaries, self.depth)
+        return -self.depth
+
+    def release(self, *slots):
+        """
+        Frees the temporary slots among slots, once they have been read.
+        """
+        for slot in slots:
+            if slot < 0:
+                self.depth -= 1
+
+    def is_variable(self, slot):
+        """
+        Tells whether slot is the slot of a variable.
+        """
+        return 0 <= slot < self.variables
+
+def operands(program, nodes, storable=False):
+    """
+    Appends the instructions computing the nodes, from left to right, and
+    returns the slots of their values (storable values if storable is
+    True). A variable read before a node that may raise another exception
+    than SemanticError is moved to a temporary slot first: when it is not
+    set, its SemanticError is raised first, as by evaluate.
+    """
+    slots = []
+    for i, node in enumerate(nodes):
+        if storable:
+            slot = node.storable(program)
+        else:
+            slot = node.operand(program)
+        if program.is_variable(slot) and [n for n in nodes[i+1:] if n.may_raise()]:
+            source, slot = slot, program.temporary()
+            program.emit(MOVE, slot, source)
+        slots.append(slot)
+    return slots
+
+def interpret(program, env, ARITHMETIC=ARITHMETIC, ADD=ADD,
+              COMPARE_JUMP_IF_TRUE=COMPARE_JUMP_IF_TRUE,
+              COMPARE_JUMP_IF_FALSE=COMPARE_JUMP_IF_FALSE, MOVE=MOVE,
+              INDEX=INDEX, STORE_INDEX=STORE_INDEX, COMPARE=COMPARE,
+              JUMP=JUMP, IN=IN, FLOOR_DIVIDE=FLOOR_DIVIDE, AND=AND, OR=OR,
+              JUMP_IF_FALSE=JUMP_IF_FALSE, JUMP_IF_TRUE=JUMP_IF_TRUE,
+              COPY=COPY, ARRAY=ARRAY, DIVIDE=DIVIDE, NOT=NOT, PRINT=PRINT,
+              unset=unset, numbers=numbers, addables=addables):
+    """
+    The dispatch loop of the register machine. The instructions read their
+    operands in the frame and write their result there, without a stack.
+    The operators checking the types of their operands need not check
+    that variables are set (unset has no valid type). The names used by
+    the loop are bound as default arguments (local variables are faster
+    than globals). The variables are copied back to env at the end of the
+    run.
+    """
+    code = program.code
+    frame = env + program.constants + [None] * program.temporaries
+    pc = 0
+    end = len(code)
+    try:
+        while pc < end:
+            instruction = code[pc]
+            op = instruction[0]
+            pc += 1
+            if op == ARITHMETIC:
+                _, target, function, l, r = instruction
+                l = frame[l]
+                r = frame[r]
+                if type(l) not in numbers or type(r) not in numbers:
+                    raise SemanticError
+                frame[target] = function(l, r)
+            elif op == ADD:
+                _, target, l, r = instruction
+                l = frame[l]
+                r = frame[r]
+                if type(l) is not type(r) or type(l) not in addables:
+                    raise SemanticError
+                frame[target] = l + r
+            elif op == COMPARE_JUMP_IF_TRUE:
+                _, target, function, l, r = instruction
+                l = frame[l]
+                r = frame[r]
+                if type(l) is not int or type(r) is not int:
+                    raise SemanticError
+                if function(l, r):
+                    pc = target
+            elif op == COMPARE_JUMP_IF_FALSE:
+                _, target, function, l, r = instruction
+                l = frame[l]
+                r = frame[r]
+                if type(l) is not int or type(r) is not int:
+                    raise SemanticError
+                if not function(l, r):
+                    pc = target
+            elif op == MOVE:
+                value = frame[instruction[2]]
+                if value is unset:
+                    raise SemanticError
+                frame[instruction[1]] = value
+            elif op == INDEX:
+                _, target, l, r = instruction
+                l = frame[l]
+                r = frame[r]
+                if type(r) is not int or type(l) not in (list, str):
+                    raise SemanticError
+                try:
+                    frame[target] = l[r]
+                except IndexError:
+                    raise SemanticError
+            elif op == STORE_INDEX:
+                _, array, index, value = instruction
+                value = frame[value]
+                array = frame[array]
+                index = frame[index]
+                if value is unset or array is unset or index is unset:
+                    raise SemanticError
+                array[index] = value
+            elif op == COMPARE:
+                _, target, function, l, r = instruction
+                l = frame[l]
+                r = frame[r]
+                if type(l) is not int or type(r) is not int:
+                    raise SemanticError
+                frame[target] = 1 if function(l, r) else 0
+            elif op == JUMP:
+                pc = instruction[1]
+            elif op == IN:
+                _, target, l, r = instruction
+                l = frame[l]
+                r = frame[r]
+                if l is unset or r is unset:
+                    raise SemanticError
+                try:
+                    frame[target] = 1 if l in r else 0
+                except:
+                    raise SemanticError
+            elif op == FLOOR_DIVIDE:
+                _, target, l, r = instruction
+                l = frame[l]
+                r = frame[r]
+                if l is unset or r is unset:
+                    raise SemanticError
+                frame[target] = l // r
+            elif op == AND or op == OR:
+                _, target, l, r = instruction
+                l = frame[l]
+                r = frame[r]
+                if type(l) is not int or type(r) is not int:
+                    raise SemanticError
+                if op == AND:
+                    frame[target] = 0 if l == 0 or r == 0 else 1
+                else:
+                    frame[target] = 0 if l == 0 and r == 0 else 1
+            elif op == JUMP_IF_FALSE or op == JUMP_IF_TRUE:
+                value = frame[instruction[2]]
+                if value is unset:
+                    raise SemanticError
+                if (value == 0) == (op == JUMP_IF_FALSE):
+                    pc = instruction[1]
+            elif op == COPY:
+                frame[instruction[1]] = frame[instruction[2]][:]
+            elif op == ARRAY:
+                items = [frame[slot] for slot in instruction[2]]
+                for item in items:
+                    if item is unset:
+                        raise SemanticError
+                frame[instruction[1]] = items
+            elif op == DIVIDE:
+                _, target, l, r = instruction
+                l = frame[l]
+                r = frame[r]
+                if type(l) not in numbers or type(r) not in numbers or r == 0:
+                    raise SemanticError
+                frame[target] = l / r
+            elif op == NOT:
+                value = frame[instruction[2]]
+                if type(value) is not int:
+                    raise SemanticError
+                frame[instruction[1]] = 1 if value == 0 else 0
+            elif op == PRINT:
+                value = frame[instruction[1]]
+                if value is unset:
+                    raise SemanticError
+                print(str(value))
+            elif op == XOR:
+                _, target, l, r = instruction
+                if frame[l] is unset or frame[r] is unset:
+                    raise SemanticError
+                frame[target] = None
+    finally:
+        env[:] = frame[:len(env)]
 
 # This is the TPG Parser that is responsible for turning our language into
 # an abstract syntax tree.
@@ -316,12 +1329,11 @@ class Parser(tpg.Parser):
        "\]"
         | "\[" "\]"          $a = Array([]) $;
     block/a -> "\{"          $a = block([]) $
-       ( exe/b    $a.value.append(b) $)*
+       exe/b      $a.value.append(b) $
        "\}"
         | "\{" "\}"          $a = block([]) $;
-    conditional/a -> ifElseCall/a | ifCall/a | whileLoop/a;
+    conditional/a -> ifCall/a ( "else" block/b                      $a = ifElseCall(a, b)$ )? | whileLoop/a;
     whileLoop/a -> "while" "\(" expression/a "\)" block/b          $a = whileLoop(a, b)$;
-    ifElseCall/a -> ifCall/a "else" block/b                        $a = ifElseCall(a, b)$;
     ifCall/a -> "if" "\(" expression/a "\)" block/b                $a = ifCall(a, b)$;
     """
 
@@ -329,34 +1341,36 @@ class Parser(tpg.Parser):
 # Make an instance of the parser. This acts like a function.
 parse = Parser()
 
-# This is the driver code, that reads in lines, deals with errors, and
-# prints the output if no error occurs.
-
-# Open the file containing the input.
-try:
-    f = open(sys.argv[1], "r")
-except(IndexError, IOError):
-    f = open("input1.txt", "r")
-
-l = f.read()
-try:
-    # Try to parse the expression.
-    node = parse(l)
-
-    # Try to get a result.
-    result = node.evaluate()
-
-# If an exception is thrown, print the appropriate error.
-except tpg.Error:
-    print("SYNTAX ERROR")
-    # Uncomment the next line to re-raise the syntax error,
-    # displaying where it occurs. Comment it for submission.
-    # raise
-
-except SemanticError:
-    print("SEMANTIC ERROR")
-    # Uncomment the next line to re-raise the semantic error,
-    # displaying where it occurs. Comment it for submission.
-    # raise
-
-f.close()
+if __name__ == "__main__":
+    # This is the driver code, that reads in lines, deals with errors, and
+    # prints the output if no error occurs.
+
+    # Open the file containing the input.
+    try:
+        f = open(sys.argv[1], "r")
+    except(IndexError, IOError):
+        f = open("input1.txt", "r")
+
+    l = f.read()
+    try:
+        # Try to parse the expression.
+        node = parse(l)
+        node.optimize()
+
+        # Try to get a result.
+        result = node.run()
+
+    # If an exception is thrown, print the appropriate error.
+    except tpg.Error:
+        print("SYNTAX ERROR")
+        # Uncomment the next line to re-raise the syntax error,
+        # displaying where it occurs. Comment it for submission.
+        # raise
+
+    except SemanticError:
+        print("SEMANTIC ERROR")
+        # Uncomment the next line to re-raise the semantic error,
+        # displaying where it occurs. Comment it for submission.
+        # raise
+
+    f.close()
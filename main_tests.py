@@ -0,0 +1,259 @@
+#!/usr/bin/env python
+
+import os
+import runpy
+import sys
+import threading
+import unittest
+
+import tpg
+
+print("*"*70)
+print("*")
+print("* Unit tests for main.py with %(__name__)s %(__version__)s (%(__date__)s)"%tpg.__dict__)
+print("*")
+print("* Platform : %s"%sys.platform.replace('\n', ' '))
+print("* Version  : %s"%sys.version.replace('\n', ' '))
+print("*")
+print("*"*70)
+
+class InterpreterTestCase(unittest.TestCase):
+
+    main = runpy.run_path(os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py"), run_name="main")
+
+    # (engine, optimized) pairs running the programs of main.py
+    engines = [ (engine, optimized) for optimized in (False, True)
+                                    for engine in ("evaluate", "closures", "vm") ]
+
+    programs = [
+        # arithmetic, strings and comparisons
+        """ i = 0; s = 0;
+            while (i < 10) { s = s + i * 2 - i // 3 % 7; i = i + 1; }
+            print(s); print(2 ** 10); print(7 / 2); print(1.5 + 2.25);
+            print("ab" + "cd"); print("abc"[1]); print(3 <> 4 and not 0);
+            print(2 in [1, 2, 3]); print("b" in "abc"); print(1 xor 2);
+        """,
+        # constant folding and dead branches
+        """ print(1 + 2 * 3); if (0) { x = 1 / 0; } if (1) { print(4); } else { print(5); }
+            while (0) { print(6); } x = [1 + 1, 2 * 3]; print(x);
+        """,
+        # semantic errors (after the output of the first statements)
+        "print(1); x = 1 / 0;",
+        "print(1); x = 1.0 / 0;",
+        "print(1); x = 1 / 0.0;",
+        "print(y);",
+        "x = 1; y = x + z;",
+        "x = 1 + \"a\";",
+        "x = [1] + 1;",
+        "x = 1.0 + 1;",
+        "x = \"a\" * 2;",
+        "x = [1, 2][2];",
+        "x = \"ab\"[1.0];",
+        "x = 1[0];",
+        "x = \"a\" < \"b\";",
+        "x = 1.0 == 1.0;",
+        "x = not \"a\";",
+        "x = 1 and 1.0;",
+        "x = [] or 1;",
+        "x = 1 in 2;",
+        "i = 0; while (i < 3) { i = i + 1; if (i == 2) { x = [i][i]; } }",
+        # floor division and stores in arrays are not checked: Python errors
+        "x = [1, 2]; x[5] = 1;",
+        "x = 1; x[0] = 1;",
+        "print(1); x = 1 // 0;",
+        "x = 1.0 // 0;",
+        "x = \"a\" // 2;",
+        # an unset variable raises its error before a floor division
+        "x = y + 1 // 0;",
+        "x = [y, 1 // 0];",
+        "x = [1]; x[1 // 0] = y;",
+        "x[1 // 0] = 1;",
+        # literal arrays are copied when stored (copy-on-write)
+        """ i = 0;
+            while (i < 3) { a = [1, 2, 3]; a[0] = a[0] + i; print(a); i = i + 1; }
+        """,
+        """ i = 0;
+            while (i < 3) { a = [0, 0]; b = a; b[i % 2] = i + 1; print(a); print(b); i = i + 1; }
+        """,
+        """ i = 0;
+            while (i < 3) { a = [[0, 0], [1]]; x = a[0]; x[0] = i; print(a); i = i + 1; }
+        """,
+        """ i = 0;
+            while (i < 3) {
+                a = [1, 2] + [3]; a[0] = i; print(a);
+                b = [[1, 2], 3][0]; b[1] = i; print(b);
+                print([4, 5, 6][i]); print(i in [0, 2]);
+                i = i + 1;
+            }
+        """,
+        """ i = 0; a = [];
+            while (i < 3) { b = [1, 2]; a = a + [b]; b[0] = i; i = i + 1; }
+            print(a);
+        """,
+    ]
+
+    class Output:
+        """ standard output replacement collecting the printed text """
+        def __init__(self):
+            self.text = []
+        def write(self, text):
+            self.text.append(text)
+        def flush(self):
+            pass
+
+    def execute(self, source, engine, optimized):
+        """ run a program twice (with the same compiled code)
+
+        return the output, the exception and the variables of each run
+        """
+        stdout, sys.stdout = sys.stdout, self.Output()
+        try:
+            node = self.main['parse'](source)
+        finally:
+            sys.stdout = stdout
+        if optimized:
+            node.optimize()
+        results = []
+        for run in range(2):
+            environment = node.environment()
+            stdout, sys.stdout = sys.stdout, self.Output()
+            try:
+                try:
+                    if engine == "evaluate":
+                        node.evaluate(environment)
+                    else:
+                        node.run(environment, engine=engine)
+                    error = None
+                except Exception:
+                    error = tpg.exc().__class__
+                output = "".join(sys.stdout.text)
+            finally:
+                sys.stdout = stdout
+            results.append((output, error, environment.variables()))
+        return results
+
+    def testEngines(self):
+        SemanticError = self.main['SemanticError']
+        errors = set()
+        for source in self.programs:
+            expected = self.execute(source, "evaluate", False)
+            self.assertEqual(expected[0], expected[1], source)
+            errors.add(expected[0][1])
+            for engine, optimized in self.engines:
+                self.assertEqual(self.execute(source, engine, optimized), expected,
+                                 "%s%s: %s"%(engine, optimized and " (optimized)" or "", source))
+        # every kind of error is covered
+        self.assertEqual(errors, set([None, SemanticError, ZeroDivisionError, TypeError, IndexError]))
+
+    def testFolding(self):
+        main = self.main
+        node = main['parse']("x = 1 + 2 * 3; y = 1 / 0; z = [1 // 1, 2]; if (1 < 0) { x = 0; }")
+        self.assertTrue(node.optimize() > 0)
+        x, y, z = node.value.value
+        self.assertTrue(isinstance(x.right, main['Constant']) and x.right.value == 7)
+        # 1 / 0 is not folded, it raises a SemanticError when the program runs
+        self.assertTrue(isinstance(y.right, main['operation']) and y.right.op == "/")
+        self.assertTrue(isinstance(z.right, main['Array']) and z.right.is_shared())
+        for engine, optimized in self.engines:
+            output, error, variables = self.execute("x = 1 + 2 * 3; y = 1 / 0;", engine, optimized)[0]
+            self.assertEqual((error, variables), (main['SemanticError'], {'x': 7}))
+
+    def testFoldingLimits(self):
+        main = self.main
+        node = main['parse']("x = 2 ** 10; y = 7 ** 30000000; if (x < 0) { z = 7 ** 30000000; }")
+        node.optimize()
+        x, y, z = node.value.value
+        self.assertTrue(isinstance(x.right, main['Constant']) and x.right.value == 1024)
+        # large operations are left to be computed when the program runs,
+        # even in branches that never run
+        self.assertTrue(isinstance(y.right, main['operation']) and y.right.op == "**")
+        operations = []
+        nodes = [z]
+        while nodes:
+            node = nodes.pop()
+            if isinstance(node, main['operation']):
+                operations.append(node.op)
+            nodes.extend(node.children())
+        self.assertEqual(operations, ["**", "<"])
+        for engine, optimized in self.engines:
+            output, error, variables = self.execute("x = 0; if (x) { y = 7 ** 30000000; } z = 3 ** 3;", engine, optimized)[0]
+            self.assertEqual((error, variables), (None, {'x': 0, 'z': 27}))
+
+    def testDeadBranches(self):
+        main = self.main
+        node = main['parse']("if (0) { x = 1; } if (1) { y = 2; } else { y = 3; } while (0) { z = 4; } print(y);")
+        self.assertTrue(node.optimize() > 0)
+        # only the live branch and the print are left
+        live, output = node.value.value
+        self.assertEqual(main['resolve'](live), ['y'])
+        self.assertTrue(isinstance(output, main['printer']))
+        for engine, optimized in self.engines:
+            output, error, variables = self.execute("if (0) { x = 1 / 0; } while (0) { y = 1; } z = 2;", engine, optimized)[0]
+            self.assertEqual((error, variables), (None, {'z': 2}))
+
+    def testEnvironments(self):
+        main = self.main
+        node = main['parse']("y = x + 1; x = y * 2; z = [x];")
+        self.assertEqual(sorted(node.names), ['x', 'y', 'z'])
+        # the variables of the same name get the same slot
+        slots = set()
+        nodes = [node]
+        while nodes:
+            n = nodes.pop()
+            if isinstance(n, main['Variable']):
+                slots.add((n.value, n.slot))
+            nodes.extend(n.children())
+        self.assertEqual(sorted(slots), sorted([(name, slot) for slot, name in enumerate(node.names)]))
+        environment = node.environment({'x': 1, 'w': 0})
+        self.assertEqual(environment.variables(), {'x': 1})
+        results = {}
+        def work(n):
+            for engine in ("evaluate", "closures", "vm"):
+                environment = node.environment({'x': n})
+                if engine == "evaluate":
+                    node.evaluate(environment)
+                else:
+                    node.run(environment, engine=engine)
+                results[n, engine] = environment.variables()
+        threads = [threading.Thread(target=work, args=(n,)) for n in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for (n, engine), variables in results.items():
+            self.assertEqual(variables, {'x': 2*n + 2, 'y': n + 1, 'z': [2*n + 2]})
+        self.assertEqual(len(results), 24)
+        # a new environment has no variables set
+        self.assertEqual(node.environment().variables(), {})
+        self.assertRaises(main['SemanticError'], node.run)
+
+    def testStatements(self):
+        main = self.main
+        node = main['parse']("x = 1; { y = 2; { z = 3; } } print(x);")
+        statements = node.value.statements()
+        self.assertEqual([i.__class__.__name__ for i in statements], ["assignment"]*3 + ["printer"])
+
+    def testSharedArrays(self):
+        main = self.main
+        parse = main['parse']
+        array = lambda source: parse("x = %s;"%source).value.value[0].right
+        self.assertTrue(array("[1, 2]").is_shared())
+        self.assertFalse(array("[[1], 2]").is_shared())
+        self.assertFalse(array("[y, 2]").is_shared())
+        # read places share the list, stored places get a copy
+        shared = array("[1, 2]")
+        read = shared.compile()
+        self.assertTrue(read(None) is read(None))
+        stored = shared.compile_value()
+        self.assertTrue(stored(None) is not stored(None))
+        self.assertEqual(stored(None), [1, 2])
+        program = parse("a = [1, 2]; b = [[1, 2]]; print([1, 2][0]);").assemble()
+        ops = [instruction[0] for instruction in program.code]
+        self.assertEqual(ops.count(main['COPY']), 2)
+        # each run gets fresh copies of the stored lists
+        for engine, optimized in self.engines:
+            for output, error, variables in self.execute("a = [1, 2]; b = [a, [3]]; a[0] = a[0] + 1; c = b[1]; c[0] = 4;", engine, optimized):
+                self.assertEqual((error, variables), (None, {'a': [2, 2], 'b': [[2, 2], [4]], 'c': [4]}))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -51,25 +51,59 @@ __author__ = 'Christophe Delord'
 __email__ = 'cdsoft.fr'
 __url__ = 'http://cdsoft.fr/tpg/'
 
-import parser
+import array
+import ast
+import bisect
+import codecs
+import collections
+import copy
+import hashlib
+import marshal
+import operator
+import os
 import re
 import sre_parse
 import sys
+import threading
+import weakref
+
+try:
+    import concurrent.futures as futures
+except ImportError:
+    futures = None
 
 # Python 2/3 compatibility
 __python__ = sys.version_info[0]
 
 if __python__ == 3:
-    import collections
-    callable = lambda value: isinstance(value, collections.Callable)
+    try:
+        from collections.abc import Callable
+    except ImportError:
+        from collections import Callable
+    callable = lambda value: isinstance(value, Callable)
     exc = lambda: sys.exc_info()[1]
+    string_types = (str,)
 
 if __python__ == 2:
     exc = lambda: sys.exc_value
+    string_types = (str, unicode)
 
 _id = lambda x: x
 tab = " "*4
 
+class Constant:
+    """ Constant(value)
+
+    Constant is the value function of tokens whose value does not depend on
+    their text. Lexers read the value attribute instead of calling it.
+    """
+
+    def __init__(self, value):
+        self.value = value
+
+    def __call__(self, text):
+        return self.value
+
 class Error(Exception):
     """ Error((line, column), msg)
 
@@ -127,11 +161,420 @@ class SemanticError(Error):
         msg  : message associated to the error
     """
     def __init__(self, msg):
-        Exception.__init__(self)
+        Exception.__init__(self, msg)
         self.msg = msg
     def __str__(self):
         return "%s: %s"%(self.__class__.__name__, self.msg)
 
+def chunks(input, size, encoding="utf-8"):
+    """ iterate over the chunks of an input
+
+    Parameters:
+        input    : string, file object, mmap object or iterable of chunks
+        size     : size of the chunks read from strings, files and mmap objects
+        encoding : encoding used to decode bytes (Python 3 only)
+    """
+    if isinstance(input, string_types):
+        source = (input[i:i+size] for i in range(0, len(input), size))
+    elif isinstance(input, (bytes, bytearray)):
+        source = [input]
+    elif hasattr(input, "read"):
+        source = iter(lambda: input.read(size), input.read(0))
+    else:
+        source = input
+    decoder = None
+    for chunk in source:
+        if __python__ == 3 and isinstance(chunk, (bytes, bytearray)):
+            if decoder is None:
+                decoder = codecs.getincrementaldecoder(encoding)()
+            chunk = decoder.decode(chunk)
+        yield chunk
+    if decoder is not None:
+        yield decoder.decode(b"", True)
+
+ascii_chars = [chr(c) for c in range(128)]
+category_chars = {}
+for category, expr in ( (sre_parse.CATEGORY_DIGIT, r"\d"), (sre_parse.CATEGORY_NOT_DIGIT, r"\D"),
+                        (sre_parse.CATEGORY_SPACE, r"\s"), (sre_parse.CATEGORY_NOT_SPACE, r"\S"),
+                        (sre_parse.CATEGORY_WORD, r"\w"), (sre_parse.CATEGORY_NOT_WORD, r"\W"),
+                      ):
+    category_chars[category] = set([c for c in ascii_chars if re.match(expr, c)])
+del category, expr
+
+first_chars_cache = collections.OrderedDict()
+first_chars_cache_size = 512
+
+def first_chars(regexp):
+    """ first_chars(regexp)
+
+    Return (chars, non_ascii) where chars is the set of the ASCII characters
+    that can start a match of a compiled regular expression and non_ascii
+    is True if a match can also start with another character.
+    Return None if the regular expression can match an empty string
+    or if it is too complex to be analysed.
+    Results are cached as the lexers are built for every parser instance.
+    The cache keeps the first_chars_cache_size most recently used results.
+    """
+    key = regexp.pattern, regexp.flags
+    try:
+        first = first_chars_cache.pop(key)
+    except KeyError:
+        first = analyse_first_chars(regexp)
+    first_chars_cache[key] = first
+    while len(first_chars_cache) > first_chars_cache_size:
+        try:
+            first_chars_cache.popitem(last=False)
+        except KeyError:
+            break
+    return first
+
+def analyse_first_chars(regexp):
+    """ analyse_first_chars(regexp)
+
+    Compute first_chars(regexp) from the parsed regular expression.
+    """
+    if regexp.flags & (re.IGNORECASE | re.LOCALE):
+        return None
+    try:
+        first = items_first(sre_parse.parse(regexp.pattern, regexp.flags), regexp.flags)
+    except Exception:
+        return None
+    if first is None or first[2]:
+        return None
+    return frozenset(first[0]), bool(first[1])
+
+def group_items(av):
+    """ group_items(av)
+
+    Return the items of a parsed group (SUBPATTERN) or None if the group
+    changes the flags of the regular expression (e.g. '(?i:if)').
+    Such groups are not analysed.
+    """
+    if len(av) == 4 and (av[1] or av[2]):
+        return None
+    return av[-1]
+
+def items_first(items, flags):
+    """ items_first(items, flags)
+
+    Return (chars, sources, nullable) for a sequence of parsed regular
+    expression items: the ASCII characters that can start a match, the
+    sources of the other characters that can start a match (see
+    item_chars) and True if the items can match an empty string.
+    Return None if the items are too complex to be analysed.
+    """
+    chars, sources = set(), frozenset()
+    for op, av in items:
+        if op == sre_parse.AT:
+            continue
+        first = item_first(op, av, flags)
+        if first is None:
+            return None
+        item_chars, item_sources, nullable = first
+        chars |= item_chars
+        sources = sources | item_sources
+        if not nullable:
+            return chars, sources, False
+    return chars, sources, True
+
+def item_first(op, av, flags):
+    """ item_first(op, av, flags)
+
+    Return items_first for a single parsed regular expression item.
+    """
+    if op in (sre_parse.LITERAL, sre_parse.NOT_LITERAL, sre_parse.ANY, sre_parse.IN):
+        chars = item_chars(op, av, flags)
+        if chars is None:
+            return None
+        return set(chars[0]), chars[1], False
+    if op == sre_parse.SUBPATTERN:
+        items = group_items(av)
+        if items is None:
+            return None
+        return items_first(items, flags)
+    if op == sre_parse.BRANCH:
+        chars, sources, nullable = set(), frozenset(), False
+        for branch in av[1]:
+            first = items_first(branch, flags)
+            if first is None:
+                return None
+            chars |= first[0]
+            sources = sources | first[1]
+            nullable = nullable or first[2]
+        return chars, sources, nullable
+    if op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT):
+        min, max, items = av
+        first = items_first(items, flags)
+        if first is None:
+            return None
+        return first[0], first[1], first[2] or min == 0
+    return None
+
+def item_chars(op, av, flags):
+    """ item_chars(op, av, flags)
+
+    Return (chars, sources) for a parsed regular expression item matching
+    a single character: chars is the set of the ASCII characters it
+    matches and sources describes the other characters it matches: the
+    categories of a class, "any" for all of them and "other" for some of
+    them. Return None if the item is too complex to be analysed.
+    """
+    if op == sre_parse.LITERAL:
+        if av < 128:
+            return frozenset([chr(av)]), frozenset()
+        return frozenset(), frozenset(["other"])
+    if op == sre_parse.NOT_LITERAL:
+        return frozenset(ascii_chars) - frozenset([chr(av)]), frozenset(["any"])
+    if op == sre_parse.ANY:
+        if flags & re.DOTALL:
+            return frozenset(ascii_chars), frozenset(["any"])
+        return frozenset(ascii_chars) - frozenset(["\n"]), frozenset(["any"])
+    if op == sre_parse.IN:
+        chars, sources = set(), set()
+        for item_op, item_av in av:
+            if item_op == sre_parse.LITERAL:
+                if item_av < 128:
+                    chars.add(chr(item_av))
+                else:
+                    sources.add("other")
+            elif item_op == sre_parse.RANGE:
+                lo, hi = item_av
+                chars |= set(ascii_chars[lo:hi+1])
+                if hi >= 128:
+                    sources.add("other")
+            elif item_op == sre_parse.CATEGORY and item_av in category_chars:
+                chars |= category_chars[item_av]
+                sources.add(item_av)
+            else:
+                return None
+        return frozenset(chars), frozenset(sources)
+    return None
+
+def literal_text(regexp):
+    """ literal_text(regexp)
+
+    Return the only text that a compiled regular expression can match
+    (e.g. keywords and punctuation signs) or None if it can match
+    several texts. Word boundaries are ignored.
+    """
+    if regexp.flags & (re.IGNORECASE | re.LOCALE):
+        return None
+    try:
+        items = sre_parse.parse(regexp.pattern, regexp.flags)
+    except Exception:
+        return None
+    if __python__ == 2 and isinstance(regexp.pattern, unicode):
+        char = unichr
+    else:
+        char = chr
+    chars = []
+    for op, av in items:
+        if op == sre_parse.LITERAL:
+            chars.append(char(av))
+        elif op != sre_parse.AT:
+            return None
+    return regexp.pattern[:0].join(chars) or None
+
+def items_chars(items, flags):
+    """ items_chars(items, flags)
+
+    Return (chars, sources) for the characters of any match of a
+    sequence of parsed regular expression items (see item_chars).
+    Return None if the items are too complex to be analysed.
+    """
+    chars, sources = set(), set()
+    for op, av in items:
+        if op == sre_parse.AT:
+            continue
+        if op == sre_parse.SUBPATTERN:
+            group = group_items(av)
+            sub = [group is not None and items_chars(group, flags) or None]
+        elif op == sre_parse.BRANCH:
+            sub = [items_chars(branch, flags) for branch in av[1]]
+        elif op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT):
+            sub = [items_chars(av[2], flags)]
+        else:
+            sub = [item_chars(op, av, flags)]
+        for item in sub:
+            if item is None:
+                return None
+            chars |= item[0]
+            sources |= item[1]
+    return frozenset(chars), frozenset(sources)
+
+def covers(chars, other):
+    """ covers(chars, other)
+
+    Return True if the characters described by other (see item_chars)
+    are all described by chars.
+    """
+    if not other[0] <= chars[0]:
+        return False
+    if "any" in chars[1]:
+        return True
+    return "other" not in other[1] and other[1] <= chars[1]
+
+word_chars = frozenset(category_chars[sre_parse.CATEGORY_WORD]), frozenset([sre_parse.CATEGORY_WORD, sre_parse.CATEGORY_DIGIT])
+
+disjoint_categories = set()
+for category, other in ( (sre_parse.CATEGORY_SPACE, sre_parse.CATEGORY_NOT_SPACE),
+                         (sre_parse.CATEGORY_DIGIT, sre_parse.CATEGORY_NOT_DIGIT),
+                         (sre_parse.CATEGORY_WORD, sre_parse.CATEGORY_NOT_WORD),
+                         (sre_parse.CATEGORY_SPACE, sre_parse.CATEGORY_DIGIT),
+                         (sre_parse.CATEGORY_SPACE, sre_parse.CATEGORY_WORD),
+                         (sre_parse.CATEGORY_DIGIT, sre_parse.CATEGORY_NOT_WORD),
+                       ):
+    disjoint_categories.add((category, other))
+    disjoint_categories.add((other, category))
+del category, other
+
+def disjoint(first, other):
+    """ disjoint(first, other)
+
+    Return True if no character is described by both first and other
+    (see item_chars).
+    """
+    if first[0] & other[0]:
+        return False
+    for source in first[1]:
+        for other_source in other[1]:
+            if (source, other_source) not in disjoint_categories:
+                return False
+    return True
+
+def longer_match_possible(regexp, later):
+    r""" longer_match_possible(regexp, later)
+
+    Return False if the compiled regular expression later can not match a
+    longer text than regexp where regexp matches. Return True if it may
+    happen or if the regular expressions are too complex to be analysed.
+
+    The recognized cases are:
+        - regexp and later can not start with the same character
+        - later can not match more characters than the shortest match of regexp
+        - regexp only matches literal texts and later does not match them
+          followed by other characters (e.g. '\bint\b' and '\binteger\b')
+          or regexp only matches word bounded words and later only matches
+          words (e.g. '(cos|sin)\b' and '\w+')
+        - each alternative of regexp starts with a greedy repetition of a
+          character class that later can not leave and that the rest of
+          the alternative can not continue (e.g. '\d*\.\d*|\.\d*' and '\d+')
+    """
+    if (regexp.flags | later.flags) & (re.IGNORECASE | re.LOCALE):
+        return True
+    first, later_first = first_chars(regexp), first_chars(later)
+    if first is not None and later_first is not None:
+        if not (first[0] & later_first[0]) and not (first[1] and later_first[1]):
+            return False
+    try:
+        parsed = sre_parse.parse(regexp.pattern, regexp.flags)
+        later_parsed = sre_parse.parse(later.pattern, later.flags)
+        later_first = items_first(later_parsed, later.flags)
+        later_chars = items_chars(later_parsed, later.flags)
+        if later_parsed.getwidth()[1] <= parsed.getwidth()[0]:
+            return False
+    except Exception:
+        return True
+    if later_first is None or later_first[2]:
+        return True
+    if __python__ == 2 and isinstance(regexp.pattern, unicode):
+        char = unichr
+    else:
+        char = chr
+    def texts(items, bounded=False):
+        # [(text, bounded)] for items that only match literal texts
+        items = list(items)
+        while items and items[0][0] == sre_parse.AT:
+            del items[0]
+        if items and items[-1] == (sre_parse.AT, sre_parse.AT_BOUNDARY):
+            items, bounded = items[:-1], True
+        if len(items) == 1 and items[0][0] == sre_parse.SUBPATTERN:
+            if group_items(items[0][1]) is None:
+                return None
+            return texts(items[0][1][-1], bounded)
+        if len(items) == 1 and items[0][0] == sre_parse.BRANCH:
+            alternatives = []
+            for branch in items[0][1][1]:
+                branch_texts = texts(branch, bounded)
+                if branch_texts is None:
+                    return None
+                alternatives.extend(branch_texts)
+            return alternatives
+        if not items or [op for op, av in items if op != sre_parse.LITERAL]:
+            return None
+        text = "".join([char(av) for op, av in items])
+        return [(text, bounded and LexerOptions.word_re.match(text) is not None)]
+    def expand(items):
+        # alternatives of items where the groups and alternations at the beginning are expanded
+        items = list(items)
+        while items and items[0][0] == sre_parse.AT:
+            del items[0]
+        if items and items[0][0] == sre_parse.SUBPATTERN and group_items(items[0][1]) is not None:
+            return expand(list(items[0][1][-1]) + items[1:])
+        if items and items[0][0] == sre_parse.BRANCH:
+            alternatives = []
+            for branch in items[0][1][1]:
+                alternatives.extend(expand(list(branch) + items[1:]))
+            return alternatives
+        return [items]
+    literals = texts(parsed)
+    if literals is not None:
+        later_texts = texts(later_parsed)
+        for text, bounded in literals:
+            if later_texts is not None:
+                for later_text, _ in later_texts:
+                    # a word bounded literal can not match the beginning of a longer word
+                    if len(later_text) > len(text) and later_text.startswith(text) and not (bounded and LexerOptions.word_re.match(later_text[len(text)])):
+                        return True
+            elif not (bounded and later_chars is not None and covers(word_chars, later_chars)):
+                first = items_first([(sre_parse.LITERAL, ord(text[0]))], regexp.flags)
+                if not disjoint(first, later_first):
+                    return True
+        return False
+    for branch in expand(parsed):
+        first = items_first(branch, regexp.flags)
+        if first is not None and not first[2] and disjoint(first, later_first):
+            continue
+        if not branch or later_chars is None:
+            return True
+        op, av = branch[0]
+        if op != sre_parse.MAX_REPEAT or av[1] != sre_parse.MAXREPEAT or len(av[2]) != 1:
+            return True
+        run = item_chars(av[2][0][0], av[2][0][1], regexp.flags)
+        if run is None or not covers(run, later_chars):
+            return True
+        # the greedy repetition reads the longest run of characters that
+        # later can match and the rest of the branch can not read them again
+        rest = branch[1:]
+        if not rest:
+            continue
+        if [op for op, av in rest if op == sre_parse.AT]:
+            return True
+        rest_first = items_first(rest, regexp.flags)
+        if rest_first is None:
+            return True
+        if not rest_first[2] and not disjoint(rest_first, run):
+            return True
+    return False
+
+def first_match_is_longest(regexps):
+    """ first_match_is_longest(regexps)
+
+    Return True if the first of the compiled regular expressions matching
+    a text is always one of the longest matches, so that NamedGroupLexer
+    (first match) and Lexer (first of the longest matches) return the
+    same tokens. Regular expressions that can match an empty string
+    are not accepted as Lexer ignores empty matches.
+    """
+    for regexp in regexps:
+        if first_chars(regexp) is None:
+            return False
+    for i, regexp in enumerate(regexps):
+        for later in regexps[i+1:]:
+            if longer_match_possible(regexp, later):
+                return False
+    return True
+
 class LexerOptions:
     """ LexerOptions(word_bounded, compile_options)
 
@@ -140,9 +583,31 @@ class LexerOptions:
     Parameters:
         word_bounded    : if True identifier like regular expressions are added word boundaries
         compile_options : options given to re.compile to compile regular expressions
+
+    Attributes:
+        streaming      : True if the lexer can read its input by chunks
+        reach          : end of the furthest token examined by the parser
+                         (only maintained by cache lexers, used by incremental parsers)
+        lazy_positions : if True line and column numbers are computed only when needed
+                         (set lazy_positions = True). The lexer creates LazyToken objects
+                         and does not maintain its line and column attributes.
+        lines          : LineIndex of the input string (lazy_positions only)
+        separator_hook : function called with the name, the text and the value
+                         of each separator (separator values are not computed
+                         when separator_hook is None)
+        unbound_tokens : names of the tokens whose values are never bound by the
+                         rules of the grammar (set by the code generator before
+                         the tokens are defined). Named group lexers create
+                         LiteralToken objects for those that match only one text.
     """
 
     word_re = re.compile(r"^\w+$")
+    streaming = False
+    unbound_tokens = ()
+    reach = 0
+    lazy_positions = False
+    lines = None
+    separator_hook = None
 
     def __init__(self, wb, compile_options):
         if not wb:
@@ -167,18 +632,100 @@ class LexerOptions:
         """
         return expr
 
+    def position(self):
+        """ return the line and column numbers of the current position
+        """
+        if self.lines is None:
+            return self.line, self.column
+        return self.lines.line_column(self.pos)
+
+    def reached(self, reach):
+        """ record that the parser has examined the tokens up to reach (memoized results replayed)
+        """
+        self.reach = reach
+
+    def clone(self):
+        """ return a copy of the lexer with its own token tables
+
+        The compiled regular expressions are shared with the lexer, the
+        lists and dictionnaries are copied so that the tokens defined on
+        the copy do not change the lexer.
+        """
+        lexer = copy.copy(self)
+        for name, value in list(vars(lexer).items()):
+            if isinstance(value, (list, dict)):
+                setattr(lexer, name, copy.copy(value))
+        return lexer
+
+    def memo_position(self):
+        """ return the position of the next token to be parsed (memoized rules)
+
+        This is the start of the current token, which is read ahead: its
+        stop is shared by the zero-width EOF token and the last token.
+        """
+        return self.cur_token.start
+
+    def eof_token(self, prev_stop):
+        """ return the EOFToken of the current position
+
+        With lazy positions, the line and column numbers are computed
+        only when they are needed (see LazyEOFToken).
+        """
+        if self.lines is None:
+            return EOFToken(self.line, self.column, self.pos, prev_stop)
+        return LazyEOFToken(self.lines, self.pos, prev_stop)
+
+class Alternation:
+    r""" Alternation(regexps)
+
+    Alternation behaves like the compiled alternation of several compiled
+    regular expressions. The first regular expression that matches wins,
+    as in a single regular expression.
+
+    Attributes:
+        regexps : list of compiled regular expressions
+    """
+
+    def __init__(self, regexps):
+        self.regexps = regexps
+
+    def match(self, input, pos=0):
+        """ return the match of the first regular expression matching input at pos
+        """
+        for regexp in self.regexps:
+            tok = regexp.match(input, pos)
+            if tok:
+                return tok
+        return None
+
 class NamedGroupLexer(LexerOptions):
     r""" NamedGroupLexer(word_bounded, compile_options)
 
     NamedGroupLexer is a TPG lexer:
-        - use named group regular expressions (faster but limited to 100 tokens)
+        - use named group regular expressions (faster)
+        - the regular expression is split in several regular expressions
+          when it has more groups than the re module accepts
+        - runs of separators are skipped by a single regular expression
+          when no token can start like a separator
 
     Attributes:
-        token_re : regular expression containing the whole lexer
-        tokens   : dictionnary name -> (value, is_real_token)
+        max_groups   : maximum number of groups in a regular expression
+                       (token_re is built again when it is changed)
+        token_re     : regular expression containing the whole lexer
+        named_exprs  : named regular expressions of the tokens and separators
+        built_groups : max_groups used to build token_re (None before the first build
+                       and when a token is defined)
+        separator_re : regular expression matching runs of separators
+                       (None if separators can not be skipped this way)
+        separator_exprs : regular expressions of the separators
+        tokens       : dictionnary name -> (value, is_real_token)
                         name is a token name
                         value is a function that compute the value of a token from its text
                         is_real_token is a boleean. True for tokens, False for separators
+        literals     : dictionnary name -> text for the tokens that can match only one text
+                        (the text is shared by all the tokens)
+        literal_kinds : dictionnary name -> TokenKind of the LiteralToken objects created
+                        for the literal tokens whose values are never bound (see unbound_tokens)
     Once the lexer is started more attributes are defined:
         input      : input string being parsed
         max_pos    : maximum position reached in the input string
@@ -189,10 +736,20 @@ class NamedGroupLexer(LexerOptions):
         cur_token  : current token
     """
 
+    # older versions of re only accept 99 groups (100 including the whole match)
+    max_groups = getattr(sre_parse, "MAXGROUPS", 99)
+
     def __init__(self, wb, compile_options):
         LexerOptions.__init__(self, wb, compile_options)
-        self.token_re = []              # [named_regexp] and then regexp
+        self.named_exprs = []           # [named_regexp]
+        self.token_re = self.named_exprs
+        self.built_groups = None
         self.tokens = {}                # name -> value, is_real_token
+        self.literals = {}              # name -> text
+        self.literal_kinds = {}         # name -> TokenKind
+        self.separator_re = None
+        self.separator_exprs = []       # [regexp] of the separators
+        self.token_exprs = []           # [regexp] of the real tokens
 
     def def_token(self, name, expr, value=_id):
         """ add a new token to the lexer
@@ -206,10 +763,17 @@ class NamedGroupLexer(LexerOptions):
         it is returned whatever the text of the token.
         """
         if not callable(value):
-            value = lambda _, value=value: value
+            value = Constant(value)
         if name not in self.tokens:
-            self.token_re.append("(?P<%s>%s)"%(name, self.word_bounded(expr)))
+            self.named_exprs.append("(?P<%s>%s)"%(name, self.word_bounded(expr)))
+            self.token_exprs.append(self.word_bounded(expr))
             self.tokens[name] = value, True
+            text = literal_text(self.re_compile(expr))
+            if text is not None:
+                self.literals[name] = text
+                if name in self.unbound_tokens and value is _id:
+                    self.literal_kinds[name] = TokenKind(name, text, text)
+            self.built_groups = None
         else:
             raise SemanticError("Duplicate token definition (%s)"%name)
 
@@ -223,21 +787,81 @@ class NamedGroupLexer(LexerOptions):
 
         The default for value is the identity function. If value is not callable
         it is returned whatever the text of the separator. Note that separator
-        values are ignored.
+        values are only computed for separator_hook.
         """
         if not callable(value):
-            value = lambda _, value=value: value
+            value = Constant(value)
         if name not in self.tokens:
-            self.token_re.append("(?P<%s>%s)"%(name, self.word_bounded(expr)))
+            self.named_exprs.append("(?P<%s>%s)"%(name, self.word_bounded(expr)))
+            self.separator_exprs.append(self.word_bounded(expr))
             self.tokens[name] = value, False
+            self.built_groups = None
         else:
             raise SemanticError("Duplicate token definition (%s)"%name)
 
     def build(self):
         """ build the token_re attribute from the tokens and separators
+
+        If the regular expression has too many groups, token_re is an
+        Alternation of several regular expressions.
+        The lexers of the parsers are copies of a lexer built once per
+        parser class, token_re is built again for the copies whose
+        max_groups or tokens have been changed.
+        """
+        if self.built_groups == self.max_groups:
+            return
+        self.built_groups = self.max_groups
+        self.separator_re = self.build_separators()
+        if "".join(self.named_exprs).count("(") <= self.max_groups:
+            self.token_re = self.re_compile("|".join(self.named_exprs))
+            return
+        shards = [[]]
+        groups = 0
+        for expr in self.named_exprs:
+            n = self.re_compile(expr).groups
+            if shards[-1] and groups + n > self.max_groups:
+                shards.append([])
+                groups = 0
+            shards[-1].append(expr)
+            groups += n
+        if len(shards) == 1:
+            self.token_re = self.re_compile("|".join(shards[0]))
+        else:
+            self.token_re = Alternation([self.re_compile("|".join(shard)) for shard in shards])
+
+    def build_separators(self):
+        """ return a regular expression matching runs of separators
+
+        Separators can be skipped before matching tokens only if no token can
+        start with a character that can start a separator (otherwise the
+        token may have precedence).
+        None is returned if separators can not be skipped this way.
+        first_chars does not tell which non ASCII characters start a
+        regular expression so if both separators and tokens can start with
+        a non ASCII character, only separators starting with an ASCII
+        character are skipped.
         """
-        if isinstance(self.token_re, list):
-            self.token_re = self.re_compile("|".join(self.token_re))
+        if not self.separator_exprs:
+            return None
+        def chars(exprs):
+            ascii, non_ascii = set(), False
+            for expr in exprs:
+                first = first_chars(self.re_compile(expr))
+                if first is None:
+                    return None
+                ascii.update(first[0])
+                non_ascii = non_ascii or first[1]
+            return ascii, non_ascii
+        separators = chars(self.separator_exprs)
+        tokens = chars(self.token_exprs)
+        if separators is None or tokens is None:
+            return None
+        if separators[0] & tokens[0]:
+            return None
+        if separators[1] and tokens[1]:
+            # separators starting with a non ASCII character are left to token_re
+            return self.re_compile("(?:(?=[\\x00-\\x7f])(?:%s))+"%"|".join(self.separator_exprs))
+        return self.re_compile("(?:%s)+"%"|".join(self.separator_exprs))
 
     def start(self, input):
         """ start a lexical analysis
@@ -246,6 +870,7 @@ class NamedGroupLexer(LexerOptions):
             input : input string to be parsed
         """
         self.input = input
+        self.lines = self.lazy_positions and LineIndex(input) or None
         self.max_pos = 0
         self.last_token = None
         self.build()
@@ -266,7 +891,8 @@ class NamedGroupLexer(LexerOptions):
             self.cur_token = None
         else:
             self.pos = token.stop
-            self.line, self.column = token.end_line, token.end_column
+            if self.lines is None:
+                self.line, self.column = token.end_line, token.end_column
             self.cur_token = token
 
     def next_token(self):
@@ -279,20 +905,64 @@ class NamedGroupLexer(LexerOptions):
         else:
             prev_stop = self.cur_token.stop
         while True:
+            if self.separator_re is not None and self.separator_hook is None:
+                sep = self.separator_re.match(self.input, self.pos)
+                if sep:
+                    stop = sep.end()
+                    if self.lines is None:
+                        nl = self.input.count('\n', self.pos, stop)
+                        if nl:
+                            self.line += nl
+                            self.column = stop - self.input.rfind('\n', self.pos, stop)
+                        else:
+                            self.column += stop - self.pos
+                    self.pos = stop
             if self.pos >= len(self.input):
-                self.cur_token = EOFToken(self.line, self.column, self.pos, prev_stop)
+                self.cur_token = self.eof_token(prev_stop)
                 return self.cur_token
             tok = self.token_re.match(self.input, self.pos)
             if tok:
                 name = tok.lastgroup
-                text = tok.group()
+                kind = self.literal_kinds.get(name)
+                if kind is not None and self.lines is None:
+                    # the value is never bound: a LiteralToken is enough
+                    self.cur_token = LiteralToken(kind, self.line, self.column, self.pos, prev_stop)
+                    self.pos = self.cur_token.stop
+                    if kind.newlines:
+                        self.line += kind.newlines
+                        self.column = kind.last_column
+                    else:
+                        self.column += kind.length
+                    if self.pos > self.max_pos:
+                        self.max_pos = self.pos
+                        self.last_token = self.cur_token
+                    return self.cur_token
                 value, real_token = self.tokens[name]
-                try:
-                    value = value(text)
-                except WrongToken:
-                    raise LexicalError((self.line, self.column), "Lexical error in %s"%text)
+                text = self.literals.get(name)
+                if text is None:
+                    text = tok.group()
+                if not real_token:
+                    if self.separator_hook is not None:
+                        self.separator_hook(name, text, value(text))
+                elif value is _id:
+                    value = text
+                elif isinstance(value, Constant):
+                    value = value.value
+                else:
+                    try:
+                        value = value(text)
+                    except WrongToken:
+                        raise LexicalError(self.position(), "Lexical error in %s"%text)
                 start, stop = tok.span()
                 self.pos = stop
+                if self.lines is not None:
+                    if real_token:
+                        self.cur_token = LazyToken(self.lines, name, text, value, start, stop, prev_stop)
+                        if self.pos > self.max_pos:
+                            self.max_pos = self.pos
+                            self.last_token = self.cur_token
+                        return self.cur_token
+                    continue
                 tok_line, tok_column = self.line, self.column
                 if '\n' in text:
                     self.line += text.count('\n')
@@ -312,7 +982,7 @@ class NamedGroupLexer(LexerOptions):
                     err = self.input[self.pos:nl]
                 else:
                     err = self.input[self.pos:self.pos+w]
-                raise LexicalError((self.line, self.column), "Lexical error near %s"%err)
+                raise LexicalError(self.position(), "Lexical error near %s"%err)
 
     def token(self):
         """ return the current token
@@ -335,13 +1005,17 @@ class Lexer(NamedGroupLexer):
         - based on NamedGroupLexer
         - doesn't use named group regular expressions (slower but not limited to 100 tokens)
         - select the longuest match so the order of token definitions doesn't mater
+        - only the tokens that can start with the current character are tried
 
     Attributes:
-        tokens : list (name, regexp, value, is_real_token)
+        tokens   : list (name, regexp, value, is_real_token)
                         name is a token name
                         regexp is the regular expression of the token
                         value is a function that computes the value of a token from its text
                         is_real_token is a boleean. True for tokens, False for separators
+        dispatch : dictionnary ASCII character -> list of the tokens that can start with this character
+                   (None until the lexer is built)
+        default  : list of the tokens that can start with a non ASCII character
     Once the lexer is started more attributes are defined:
         input      : input string being parsed
         max_pos    : maximum position reached in the input string
@@ -355,6 +1029,7 @@ class Lexer(NamedGroupLexer):
     def __init__(self, wb, compile_options):
         LexerOptions.__init__(self, wb, compile_options)
         self.tokens = []        # [(name, regexp, value, is_real_token)]
+        self.dispatch = None    # char -> [(name, regexp, value, is_real_token)]
 
     def def_token(self, name, expr, value=_id):
         """ adds a new token to the lexer
@@ -368,9 +1043,10 @@ class Lexer(NamedGroupLexer):
         it is returned whatever the text of the token.
         """
         if not callable(value):
-            value = lambda _, value=value: value
+            value = Constant(value)
         if name not in self.tokens:
             self.tokens.append((name, self.re_compile(self.word_bounded(expr)), value, True))
+            self.dispatch = None
         else:
             raise SemanticError("Duplicate token definition (%s)"%name)
 
@@ -384,15 +1060,29 @@ class Lexer(NamedGroupLexer):
 
         The default for value is the identity function. If value is not callable
         it is returned whatever the text of the separator. Note that separator
-        values are ignored.
+        values are only computed for separator_hook.
         """
         if not callable(value):
-            value = lambda _, value=value: value
+            value = Constant(value)
         if name not in self.tokens:
             self.tokens.append((name, self.re_compile(self.word_bounded(expr)), value, False))
+            self.dispatch = None
         else:
             raise SemanticError("Duplicate token definition (%s)"%name)
 
+    def build(self):
+        """ build the dispatch table from the first characters of the tokens and separators
+
+        The order of the definitions is kept in each list so that the
+        first of the longuest matches is still selected.
+        """
+        if self.dispatch is None:
+            firsts = [first_chars(token[1]) for token in self.tokens]
+            self.dispatch = {}
+            for c in ascii_chars:
+                self.dispatch[c] = [token for token, first in zip(self.tokens, firsts) if first is None or c in first[0]]
+            self.default = [token for token, first in zip(self.tokens, firsts) if first is None or first[1]]
+
     def start(self, input):
         """ start a lexical analysis
 
@@ -400,8 +1090,10 @@ class Lexer(NamedGroupLexer):
             input : input string to be parsed
         """
         self.input = input
+        self.lines = self.lazy_positions and LineIndex(input) or None
         self.max_pos = 0
         self.last_token = None
+        self.build()
         self.back(None)
         self.next_token()
 
@@ -416,11 +1108,11 @@ class Lexer(NamedGroupLexer):
             prev_stop = self.cur_token.stop
         while True:
             if self.pos >= len(self.input):
-                self.cur_token = EOFToken(self.line, self.column, self.pos, prev_stop)
+                self.cur_token = self.eof_token(prev_stop)
                 return self.cur_token
             tok = None
             text = ""
-            for _name, _regexp, _value, _is_real_token in self.tokens:
+            for _name, _regexp, _value, _is_real_token in self.dispatch.get(self.input[self.pos], self.default):
                 _tok = _regexp.match(self.input, self.pos)
                 if _tok:
                     _text = _tok.group()
@@ -431,12 +1123,28 @@ class Lexer(NamedGroupLexer):
                         value = _value
                         real_token = _is_real_token
             if tok:
-                try:
-                    value = value(text)
-                except WrongToken:
-                    raise LexicalError((self.line, self.column), "Lexical error in %s"%text)
+                if not real_token:
+                    if self.separator_hook is not None:
+                        self.separator_hook(name, text, value(text))
+                elif value is _id:
+                    value = text
+                elif isinstance(value, Constant):
+                    value = value.value
+                else:
+                    try:
+                        value = value(text)
+                    except WrongToken:
+                        raise LexicalError(self.position(), "Lexical error in %s"%text)
                 start, stop = tok.span()
                 self.pos = stop
+                if self.lines is not None:
+                    if real_token:
+                        self.cur_token = LazyToken(self.lines, name, text, value, start, stop, prev_stop)
+                        if self.pos > self.max_pos:
+                            self.max_pos = self.pos
+                            self.last_token = self.cur_token
+                        return self.cur_token
+                    continue
                 tok_line, tok_column = self.line, self.column
                 if '\n' in text:
                     self.line += text.count('\n')
@@ -456,36 +1164,16 @@ class Lexer(NamedGroupLexer):
                     err = self.input[self.pos:nl]
                 else:
                     err = self.input[self.pos:self.pos+w]
-                raise LexicalError((self.line, self.column), "Lexical error near %s"%err)
+                raise LexicalError(self.position(), "Lexical error near %s"%err)
 
-class CacheNamedGroupLexer(NamedGroupLexer):
-    r""" CacheNamedGroupLexer(word_bounded, compile_options)
+class TokenCacheLexer:
+    """ TokenCacheLexer is the base class of the lexers that build the
+    complete token list before parsing (CacheNamedGroupLexer and CacheLexer).
 
-    CacheNamedGroupLexer is a TPG lexer:
-        - based on NamedGroupLexer
-        - the complete token list is built before parsing
-          (faster with very ambigous grammars but needs more memory)
-
-    Attributes:
-        token_re : regular expression containing the whole lexer
-        tokens   : dictionnary name -> (value, is_real_token)
-                        name is a token name
-                        value is a function that computes the value of a token from its text
-                        is_real_token is a boleean. True for tokens, False for separators
-        cache    : token list
-    Once the lexer is started more attributes are defined:
-        input      : input string being parsed
-        max_pos    : maximum position reached in the input string
-        last_token : last token reached in the input string
-        pos        : position in the input string of the current token
-        line       : line of the current token
-        column     : column of the current token
-        cur_token  : current token
+    The lexers scan the tokens with their scan method. The token list
+    can be updated after an edit of the input string (incremental parsers).
     """
 
-    def __init__(self, wb, compile_options):
-        NamedGroupLexer.__init__(self, wb, compile_options)
-
     def start(self, input):
         """ start a lexical analysis
 
@@ -494,21 +1182,93 @@ class CacheNamedGroupLexer(NamedGroupLexer):
         """
         self.cache = []
         self.input = input
+        self.lines = self.lazy_positions and LineIndex(input) or None
         self.max_pos = 0
         self.last_token = None
         self.build()
         self.back(None)
         while True:
-            token = NamedGroupLexer.next_token(self)
+            token = self.scan()
             token.index = len(self.cache)
             self.cache.append(token)
             if isinstance(token, EOFToken):
                 break
         self.max_pos = 0
         self.last_token = None
+        self.reach = 0
         self.back(None)
         self.next_token()
 
+    def update(self, start, stop, text):
+        """ update the token list after an edit of the input string
+
+        Parameters:
+            start : position of the first character replaced in the input string
+            stop  : position following the last character replaced
+            text  : text replacing the characters between start and stop
+
+        Only the tokens around the edit are scanned again, the tokens
+        after the edit are shifted. Returns (limit, resume, delta) where
+        limit is the end of the last token kept before the edit, resume
+        the start of the first token kept after the edit (both in the input
+        string before the edit) and delta the shift of the tokens after
+        the edit.
+        """
+        cache = self.cache
+        delta = len(text) - (stop - start)
+        # the token before the first token touching the edit is scanned again
+        # as it may be extended by the new text
+        lo, hi = 0, len(cache)-1
+        while lo < hi:
+            mid = (lo+hi)//2
+            if cache[mid].stop < start:
+                lo = mid+1
+            else:
+                hi = mid
+        i = max(lo-1, 0)
+        # the new tokens are scanned before anything is changed so that a
+        # lexical error leaves the input string and the token list unchanged
+        input = self.input
+        state = self.pos, self.line, self.column, self.cur_token, self.max_pos, self.last_token
+        if i == 0:
+            self.back(None)
+            limit = 0
+        else:
+            self.back(cache[i-1])
+            limit = cache[i-1].stop
+        self.input = input[:start] + text + input[stop:]
+        # scan new tokens until a token after the edit is found again
+        tokens = []
+        j = i
+        try:
+            while True:
+                token = self.scan()
+                while j < len(cache) and (cache[j].start < stop or cache[j].start+delta < token.start):
+                    j += 1
+                old = cache[j]
+                if old.start+delta == token.start and old.stop+delta == token.stop and old.name == token.name:
+                    break
+                tokens.append(token)
+        except Exception:
+            self.input = input
+            self.pos, self.line, self.column, self.cur_token, self.max_pos, self.last_token = state
+            raise
+        # shift the tokens after the edit
+        resume = old.start
+        line, dline, dcolumn = old.line, token.line-old.line, token.column-old.column
+        for old in cache[j:]:
+            old.shift(line, dline, dcolumn, delta)
+        cache[j].prev_stop = token.prev_stop
+        cache[i:j] = tokens
+        for index in range(i, len(cache)):
+            cache[index].index = index
+        self.max_pos = 0
+        self.last_token = None
+        self.reach = 0
+        self.back(None)
+        self.next_token()
+        return limit, resume, delta
+
     def next_token(self):
         """ return the next token
 
@@ -520,14 +1280,70 @@ class CacheNamedGroupLexer(NamedGroupLexer):
             index = self.cur_token.index+1
         token = self.cache[index]
         self.pos = token.stop
-        self.line, self.column = token.line, token.column
+        if self.lines is None:
+            self.line, self.column = token.line, token.column
         self.cur_token = token
+        if self.pos > self.reach:
+            self.reach = self.pos
         if self.pos > self.max_pos:
             self.max_pos = self.pos
             self.last_token = self.cur_token
         return self.cur_token
 
-class CacheLexer(Lexer):
+    def reached(self, reach):
+        """ record that the parser has examined the tokens up to reach
+
+        This is called when a memoized result is replayed, so that the
+        furthest token reached (used to report syntax errors) is the same
+        as if the rule had been parsed again.
+        """
+        self.reach = reach
+        if reach > self.max_pos:
+            cache = self.cache
+            lo, hi = 0, len(cache)-1
+            while lo < hi:
+                mid = (lo+hi)//2
+                if cache[mid].stop < reach:
+                    lo = mid+1
+                else:
+                    hi = mid
+            self.max_pos = reach
+            self.last_token = cache[lo]
+
+class CacheNamedGroupLexer(TokenCacheLexer, NamedGroupLexer):
+    r""" CacheNamedGroupLexer(word_bounded, compile_options)
+
+    CacheNamedGroupLexer is a TPG lexer:
+        - based on NamedGroupLexer
+        - the complete token list is built before parsing
+          (faster with very ambigous grammars but needs more memory)
+
+    Attributes:
+        token_re : regular expression containing the whole lexer
+        tokens   : dictionnary name -> (value, is_real_token)
+                        name is a token name
+                        value is a function that computes the value of a token from its text
+                        is_real_token is a boleean. True for tokens, False for separators
+        cache    : token list
+    Once the lexer is started more attributes are defined:
+        input      : input string being parsed
+        max_pos    : maximum position reached in the input string
+        last_token : last token reached in the input string
+        pos        : position in the input string of the current token
+        line       : line of the current token
+        column     : column of the current token
+        cur_token  : current token
+    """
+
+    def __init__(self, wb, compile_options):
+        NamedGroupLexer.__init__(self, wb, compile_options)
+
+    def scan(self):
+        """ scan the next token of the input string
+        """
+        return NamedGroupLexer.next_token(self)
+
+class CacheLexer(TokenCacheLexer, Lexer):
     r""" CacheLexer(word_bounded, compile_options)
 
     CacheLexer is a TPG lexer:
@@ -557,28 +1373,111 @@ class CacheLexer(Lexer):
     def __init__(self, wb, compile_options):
         Lexer.__init__(self, wb, compile_options)
 
+    def scan(self):
+        """ scan the next token of the input string
+        """
+        return Lexer.next_token(self)
+
+class CompactCacheNamedGroupLexer(NamedGroupLexer):
+    r""" CompactCacheNamedGroupLexer(word_bounded, compile_options)
+
+    CompactCacheNamedGroupLexer is a TPG lexer:
+        - based on NamedGroupLexer
+        - the complete token list is built before parsing as CacheNamedGroupLexer
+          but it is stored in arrays instead of Token objects
+          (Token objects are created when the parser reads them, which needs less memory)
+
+    Attributes:
+        token_re : regular expression containing the whole lexer
+        tokens   : dictionnary name -> (value, is_real_token)
+                        name is a token name
+                        value is a function that computes the value of a token from its text
+                        is_real_token is a boleean. True for tokens, False for separators
+        names          : token names (kinds stores indices in this list)
+        kinds          : array of the token kinds
+        starts         : array of the start positions of the tokens
+        stops          : array of the stop positions of the tokens
+        line_numbers   : array of the lines of the tokens (empty with lazy_positions)
+        column_numbers : array of the columns of the tokens (empty with lazy_positions)
+        values         : dictionnary index -> value for the tokens which value is not their text
+    Once the lexer is started more attributes are defined:
+        input      : input string being parsed
+        max_pos    : maximum position reached in the input string
+        last_token : last token reached in the input string
+        pos        : position in the input string of the current token
+        line       : line of the current token
+        column     : column of the current token
+        cur_token  : current token
+    """
+
+    def __init__(self, wb, compile_options):
+        NamedGroupLexer.__init__(self, wb, compile_options)
+
     def start(self, input):
         """ start a lexical analysis
 
         Parameters:
             input : input string to be parsed
         """
-        self.cache = []
         self.input = input
+        self.lines = self.lazy_positions and LineIndex(input) or None
         self.max_pos = 0
         self.last_token = None
+        self.build()
+        self.names = ["EOF"] + sorted(self.tokens)
+        kind = dict([(name, i) for i, name in enumerate(self.names)])
+        self.kinds = array.array('l')
+        self.starts = array.array('l')
+        self.stops = array.array('l')
+        self.line_numbers = array.array('l')
+        self.column_numbers = array.array('l')
+        self.values = {}
         self.back(None)
         while True:
-            token = Lexer.next_token(self)
-            token.index = len(self.cache)
-            self.cache.append(token)
+            token = NamedGroupLexer.next_token(self)
+            if token.value is not token.text:
+                self.values[len(self.kinds)] = token.value
+            self.kinds.append(kind[token.name])
+            self.starts.append(token.start)
+            self.stops.append(token.stop)
+            if self.lines is None:
+                self.line_numbers.append(token.line)
+                self.column_numbers.append(token.column)
             if isinstance(token, EOFToken):
                 break
         self.max_pos = 0
         self.last_token = None
+        self.reach = 0
         self.back(None)
         self.next_token()
 
+    def token_at(self, index):
+        """ return the token at a given index of the token list
+        """
+        start, stop = self.starts[index], self.stops[index]
+        prev_stop = index and self.stops[index-1] or 0
+        if index == len(self.kinds)-1:
+            if self.lines is not None:
+                token = LazyEOFToken(self.lines, start, prev_stop)
+            else:
+                token = EOFToken(self.line_numbers[index], self.column_numbers[index], start, prev_stop)
+        else:
+            name = self.names[self.kinds[index]]
+            text = self.input[start:stop]
+            value = self.values.get(index, text)
+            if self.lines is not None:
+                token = LazyToken(self.lines, name, text, value, start, stop, prev_stop)
+            else:
+                line, column = self.line_numbers[index], self.column_numbers[index]
+                if '\n' in text:
+                    end_line = line + text.count('\n')
+                    end_column = len(text) - text.rfind('\n')
+                else:
+                    end_line, end_column = line, column + len(text)
+                token = Token(name, text, value, line, column, end_line, end_column, start, stop, prev_stop)
+        token.index = index
+        return token
+
     def next_token(self):
         """ return the next token
 
@@ -588,15 +1487,181 @@ class CacheLexer(Lexer):
             index = 0
         else:
             index = self.cur_token.index+1
-        token = self.cache[index]
+        token = self.token_at(index)
         self.pos = token.stop
-        self.line, self.column = token.line, token.column
+        if self.lines is None:
+            self.line, self.column = token.line, token.column
         self.cur_token = token
+        if self.pos > self.reach:
+            self.reach = self.pos
         if self.pos > self.max_pos:
             self.max_pos = self.pos
             self.last_token = self.cur_token
         return self.cur_token
 
+class StreamNamedGroupLexer(NamedGroupLexer):
+    r""" StreamNamedGroupLexer(word_bounded, compile_options)
+
+    StreamNamedGroupLexer is a TPG lexer:
+        - based on NamedGroupLexer
+        - the input can be a string, a file object, a mmap object or an iterable of chunks
+          (bytes are decoded according to the encoding attribute)
+        - the input is read by chunks and the text before the oldest token still referenced
+          (by the parser, the memoization table, ...) is discarded
+          (the memory used depends on the lookahead of the parser instead of the input size)
+
+    Tokens are matched with at least window characters read ahead, and matches
+    reaching the end of the characters read are retried with the next chunks.
+    The tokens are the same as the tokens of NamedGroupLexer as long as no
+    token alternative needs more than window characters to fail: such an
+    alternative may fail on the truncated input and let a shorter alternative
+    defined after it match instead (window should be larger than the longest
+    text an alternative can read before failing, e.g. an unterminated string).
+
+    Attributes:
+        token_re : regular expression containing the whole lexer
+        tokens   : dictionnary name -> (value, is_real_token)
+                        name is a token name
+                        value is a function that computes the value of a token from its text
+                        is_real_token is a boleean. True for tokens, False for separators
+        window   : minimum number of characters read ahead of the current position
+                   (tokens longer than window are read in full, see above for alternatives
+                   failing after more than window characters)
+        encoding : encoding of the input when it is read as bytes
+    Once the lexer is started more attributes are defined:
+        input      : part of the input string still in memory
+        offset     : position of input in the whole input string
+        stream     : iterator over the remaining chunks (None at the end of the input)
+        alive      : tokens that may still be used for backtracking
+        max_pos    : maximum position reached in the input string
+        last_token : last token reached in the input string
+        pos        : position in the input string of the current token
+        line       : line of the current token
+        column     : column of the current token
+        cur_token  : current token
+    """
+
+    streaming = True
+    window = 65536
+    encoding = "utf-8"
+
+    def __init__(self, wb, compile_options):
+        NamedGroupLexer.__init__(self, wb, compile_options)
+
+    def start(self, input):
+        """ start a lexical analysis
+
+        Parameters:
+            input : input string, file object, mmap object or iterable of chunks to be parsed
+        """
+        self.stream = chunks(input, self.window, self.encoding)
+        self.input = ""
+        self.offset = 0
+        self.alive = weakref.WeakSet()
+        self.max_pos = 0
+        self.last_token = None
+        self.build()
+        self.back(None)
+        self.next_token()
+
+    def fill(self):
+        """ read the next chunk of the input
+
+        The text before the current position and before the tokens
+        still alive is discarded.
+        Return False at the end of the input.
+        """
+        if self.stream is None:
+            return False
+        try:
+            chunk = next(self.stream)
+        except StopIteration:
+            self.stream = None
+            return False
+        keep = self.pos
+        for token in self.alive:
+            if token.start < keep:
+                keep = token.start
+        self.input = self.input[keep-self.offset:] + chunk
+        self.offset = keep
+        return True
+
+    def eof(self):
+        """ True if the current position of the lexer is the end of the input string
+        """
+        return self.stream is None and self.pos >= self.offset+len(self.input) and isinstance(self.cur_token, EOFToken)
+
+    def next_token(self):
+        """ return the next token
+
+        Tokens are Token instances. Separators are ignored.
+        """
+        if self.cur_token is None:
+            prev_stop = 0
+        else:
+            prev_stop = self.cur_token.stop
+        while True:
+            while self.pos+self.window > self.offset+len(self.input) and self.fill():
+                pass
+            if self.pos >= self.offset+len(self.input):
+                self.cur_token = EOFToken(self.line, self.column, self.pos, prev_stop)
+                return self.cur_token
+            tok = self.token_re.match(self.input, self.pos-self.offset)
+            while (not tok or tok.end() == len(self.input)) and self.fill():
+                # the token may continue in the next chunk
+                tok = self.token_re.match(self.input, self.pos-self.offset)
+            if tok:
+                name = tok.lastgroup
+                value, real_token = self.tokens[name]
+                text = self.literals.get(name)
+                if text is None:
+                    text = tok.group()
+                if not real_token:
+                    if self.separator_hook is not None:
+                        self.separator_hook(name, text, value(text))
+                elif value is _id:
+                    value = text
+                elif isinstance(value, Constant):
+                    value = value.value
+                else:
+                    try:
+                        value = value(text)
+                    except WrongToken:
+                        raise LexicalError((self.line, self.column), "Lexical error in %s"%text)
+                start, stop = self.offset+tok.start(), self.offset+tok.end()
+                self.pos = stop
+                tok_line, tok_column = self.line, self.column
+                if '\n' in text:
+                    self.line += text.count('\n')
+                    self.column = len(text) - text.rfind('\n')
+                else:
+                    self.column += len(text)
+                if real_token:
+                    self.cur_token = Token(name, text, value, tok_line, tok_column, self.line, self.column, start, stop, prev_stop)
+                    self.alive.add(self.cur_token)
+                    if self.pos > self.max_pos:
+                        self.max_pos = self.pos
+                        self.last_token = self.cur_token
+                    return self.cur_token
+            else:
+                w = 20
+                pos = self.pos-self.offset
+                nl = self.input.find('\n', pos, pos+w)
+                if nl > -1:
+                    err = self.input[pos:nl]
+                else:
+                    err = self.input[pos:pos+w]
+                raise LexicalError(self.position(), "Lexical error near %s"%err)
+
+    def extract(self, start, stop):
+        """ extract text from the input string
+
+        Parameters:
+           start : token from which the extraction starts
+           stop  : token where the extraction stops
+        """
+        return self.input[start.start-self.offset:stop.prev_stop-self.offset]
+
 class ContextSensitiveLexer(LexerOptions):
     r""" ContextSensitiveLexer(word_bounded, compile_options)
 
@@ -640,7 +1705,7 @@ class ContextSensitiveLexer(LexerOptions):
         it is returned whatever the text of the token.
         """
         if not callable(value):
-            value = lambda _, value=value: value
+            value = Constant(value)
         if name not in self.tokens and name not in self.separators:
             self.tokens[name] = self.re_compile(self.word_bounded(expr)), value
         else:
@@ -656,10 +1721,10 @@ class ContextSensitiveLexer(LexerOptions):
 
         The default for value is the identity function. If value is not callable
         it is returned whatever the text of the separator. Note that separator
-        values are ignored.
+        values are only computed for separator_hook.
         """
         if not callable(value):
-            value = lambda _, value=value: value
+            value = Constant(value)
         if name not in self.tokens and name not in self.separators:
             self.separators.append((name, self.re_compile(self.word_bounded(expr)), value))
         else:
@@ -672,6 +1737,7 @@ class ContextSensitiveLexer(LexerOptions):
             input : input string to be parsed
         """
         self.input = input
+        self.lines = self.lazy_positions and LineIndex(input) or None
         self.max_pos = 0
         self.last_token = None
         self.back(None)
@@ -681,6 +1747,13 @@ class ContextSensitiveLexer(LexerOptions):
         """
         return self.pos >= len(self.input)
 
+    def memo_position(self):
+        """ return the position of the next token to be parsed (memoized rules)
+
+        Tokens are not read ahead, the next token is read from the current position.
+        """
+        return self.pos
+
     def back(self, token):
         """ change the current token to token (used for backtracking)
         """
@@ -690,7 +1763,8 @@ class ContextSensitiveLexer(LexerOptions):
             self.cur_token = SOFToken()
         else:
             self.pos = token.stop
-            self.line, self.column = token.end_line, token.end_column
+            if self.lines is None:
+                self.line, self.column = token.end_line, token.end_column
             self.cur_token = token
         self.eat_separators()
         self.cur_token.next_start = self.pos
@@ -706,13 +1780,15 @@ class ContextSensitiveLexer(LexerOptions):
                 if sep:
                     start, stop = sep.span()
                     text = self.input[start:stop]
-                    value = value(text)
+                    if self.separator_hook is not None:
+                        self.separator_hook(name, text, value(text))
                     self.pos = stop
-                    if '\n' in text:
-                        self.line += text.count('\n')
-                        self.column = len(text) - text.rfind('\n')
-                    else:
-                        self.column += len(text)
+                    if self.lines is None:
+                        if '\n' in text:
+                            self.line += text.count('\n')
+                            self.column = len(text) - text.rfind('\n')
+                        else:
+                            self.column += len(text)
                     done = False
 
     def eat(self, name):
@@ -729,15 +1805,23 @@ class ContextSensitiveLexer(LexerOptions):
                 prev_stop = self.cur_token.stop
             start, stop = tok.span()
             text = self.input[start:stop]
-            value = value(text)
+            if value is _id:
+                value = text
+            elif isinstance(value, Constant):
+                value = value.value
+            else:
+                value = value(text)
             self.pos = stop
-            tok_line, tok_column = self.line, self.column
-            if '\n' in text:
-                self.line += text.count('\n')
-                self.column = len(text) - text.rfind('\n')
+            if self.lines is not None:
+                self.cur_token = LazyToken(self.lines, name, text, value, start, stop, prev_stop)
             else:
-                self.column += len(text)
-            self.cur_token = Token(name, text, value, tok_line, tok_column, self.line, self.column, start, stop, prev_stop)
+                tok_line, tok_column = self.line, self.column
+                if '\n' in text:
+                    self.line += text.count('\n')
+                    self.column = len(text) - text.rfind('\n')
+                else:
+                    self.column += len(text)
+                self.cur_token = Token(name, text, value, tok_line, tok_column, self.line, self.column, start, stop, prev_stop)
             if self.pos > self.max_pos:
                 self.max_pos = self.pos
                 self.last_token = self.cur_token
@@ -761,7 +1845,26 @@ class ContextSensitiveLexer(LexerOptions):
         stop = stop and stop.stop or -1
         return self.input[start:stop]
 
-class Token:
+class BaseToken(object):
+    """ BaseToken()
+
+    Methods shared by Token and LiteralToken objects
+    """
+
+    __slots__ = ()
+
+    def match(self, name):
+        """ return True is the token name is the name of the expected token
+
+        Parameters:
+            name : name of the expected token
+        """
+        return name == self.name
+
+    def __str__(self):
+        return "line %s, column %s: %s %s %s"%(self.line, self.column, self.name, self.text, self.value)
+
+class Token(BaseToken):
     """ Token(name, text, value, line, column, end_line, end_column, start, stop, prev_stop)
 
     Token object used by lexers
@@ -777,8 +1880,13 @@ class Token:
         start      : position of the start in the input string of the token
         stop       : position of the end in the input string of the token
         prev_stop  : position of the end of the previous token
+        index      : position of the token in the token list (cache lexers only)
+        next_start : position of the next token (context sensitive lexer only)
     """
 
+    __slots__ = ('name', 'text', 'value', 'line', 'column', 'end_line', 'end_column',
+                 'start', 'stop', 'prev_stop', 'index', 'next_start', '__weakref__')
+
     def __init__(self, name, text, value, line, column, end_line, end_column, start, stop, prev_stop):
         self.name = name
         self.text = text
@@ -788,16 +1896,136 @@ class Token:
         self.start, self.stop = start, stop
         self.prev_stop = prev_stop
 
-    def match(self, name):
-        """ return True is the token name is the name of the expected token
+    def shift(self, line, dline, dcolumn, delta):
+        """ move the token after an edit of the input string (incremental parsers)
 
         Parameters:
-            name : name of the expected token
+            line    : line of the edit (columns are only shifted on this line)
+            dline   : number of lines added by the edit
+            dcolumn : number of columns added by the edit
+            delta   : number of characters added by the edit
         """
-        return name == self.name
+        if self.line == line:
+            self.column += dcolumn
+        if self.end_line == line:
+            self.end_column += dcolumn
+        self.line += dline
+        self.end_line += dline
+        self.start += delta
+        self.stop += delta
+        self.prev_stop += delta
+
+class LazyToken(Token):
+    """ LazyToken(lines, name, text, value, start, stop, prev_stop)
+
+    Token object used by lexers when line and column numbers are
+    computed only when needed (set lazy_positions = True).
+    LazyToken is a Token object.
 
-    def __str__(self):
-        return "line %s, column %s: %s %s %s"%(self.line, self.column, self.name, self.text, self.value)
+    Attributes:
+        lines : LineIndex of the input string used to compute
+                line, column, end_line and end_column
+    """
+
+    __slots__ = ('lines',)
+
+    def __init__(self, lines, name, text, value, start, stop, prev_stop):
+        self.lines = lines
+        self.name = name
+        self.text = text
+        self.value = value
+        self.start, self.stop = start, stop
+        self.prev_stop = prev_stop
+
+    line = property(lambda self: self.lines.line_column(self.start)[0])
+    column = property(lambda self: self.lines.line_column(self.start)[1])
+    end_line = property(lambda self: self.lines.line_column(self.stop)[0])
+    end_column = property(lambda self: self.lines.line_column(self.stop)[1])
+
+class TokenKind(object):
+    """ TokenKind(name, text, value)
+
+    Description of the tokens of a literal token definition whose values
+    are never bound by the parser, shared by all its LiteralToken objects.
+
+    Attributes:
+        name        : name of the token
+        text        : text matched by the regular expression
+        value       : value of the token
+        length      : length of the text
+        newlines    : number of newlines in the text
+        last_column : column following the text if it contains a newline
+    """
+
+    __slots__ = ('name', 'text', 'value', 'length', 'newlines', 'last_column')
+
+    def __init__(self, name, text, value):
+        self.name = name
+        self.text = text
+        self.value = value
+        self.length = len(text)
+        self.newlines = text.count('\n')
+        self.last_column = len(text) - text.rfind('\n')
+
+class LiteralToken(BaseToken):
+    """ LiteralToken(kind, line, column, start, prev_stop)
+
+    Token object created by named group lexers for the tokens that match
+    only one text and whose values are never bound by the parser (e.g. the
+    punctuation signs of inline tokens). The text is stored once in a
+    TokenKind and no end position is stored, a LiteralToken has no
+    dictionnary. It has the attributes and the methods of Token objects.
+
+    Attributes:
+        kind : TokenKind of the token
+    """
+
+    __slots__ = ('kind', 'name', 'value', 'line', 'column', 'start', 'stop', 'prev_stop', 'index', 'next_start', '__weakref__')
+
+    def __init__(self, kind, line, column, start, prev_stop):
+        self.kind = kind
+        self.name, self.value = kind.name, kind.value
+        self.line, self.column = line, column
+        self.start, self.stop = start, start + kind.length
+        self.prev_stop = prev_stop
+
+    text = property(lambda self: self.kind.text)
+    end_line = property(lambda self: self.line + self.kind.newlines)
+    end_column = property(lambda self: self.kind.newlines and self.kind.last_column or self.column + self.kind.length)
+
+    def shift(self, line, dline, dcolumn, delta):
+        """ move the token after an edit of the input string (see Token.shift)
+        """
+        if self.line == line:
+            self.column += dcolumn
+        self.line += dline
+        self.start += delta
+        self.stop += delta
+        self.prev_stop += delta
+
+class LineIndex:
+    """ LineIndex(input)
+
+    LineIndex computes line and column numbers from positions in an
+    input string. The positions of the line starts are searched the
+    first time they are needed.
+
+    Attributes:
+        input  : input string
+        starts : positions of the line starts (None before the first use)
+    """
+
+    def __init__(self, input):
+        self.input = input
+        self.starts = None
+
+    def line_column(self, pos):
+        """ return the line and column numbers of a position
+        """
+        if self.starts is None:
+            self.starts = [0] + [nl.end() for nl in re.finditer("\n", self.input)]
+        line = bisect.bisect_right(self.starts, pos)
+        return line, pos - self.starts[line-1] + 1
 
 class EOFToken(Token):
     """ EOFToken(line, column, pos, prev_stop)
@@ -818,39 +2046,517 @@ class EOFToken(Token):
         prev_stop  : position of the end of the previous token
     """
 
+    __slots__ = ()
+
     def __init__(self, line, column, pos, prev_stop):
         Token.__init__(self, "EOF", "EOF", None, line, column, line, column, pos, pos, prev_stop)
 
+class LazyEOFToken(LazyToken, EOFToken):
+    """ LazyEOFToken(lines, pos, prev_stop)
+
+    EOFToken used by lexers when line and column numbers are
+    computed only when needed (set lazy_positions = True).
+
+    Attributes:
+        lines : LineIndex of the input string used to compute
+                line, column, end_line and end_column
+    """
+
+    __slots__ = ()
+
+    def __init__(self, lines, pos, prev_stop):
+        LazyToken.__init__(self, lines, "EOF", "EOF", None, pos, pos, prev_stop)
+
 class SOFToken(Token):
     """ SOFToken()
 
-    Token for the start of file (start of the input string).
-    SOFToken is a Token object.
+    Token for the start of file (start of the input string).
+    SOFToken is a Token object.
+
+    Attributes:
+        name       : name of the token
+        text       : text matched by the regular expression
+        value      : value computed from the text
+        line       : line of the token in the input string
+        column     : column of the token in the input string
+        end_line   : line of the end of the token
+        end_column : column of the end of the token
+        start      : position of the start in the input string of the token
+        stop       : position of the end in the input string of the token
+        prev_stop  : position of the end of the previous token
+    """
+
+    __slots__ = ()
+
+    def __init__(self):
+        Token.__init__(self, "SOF", "SOF", None, 1, 1, 1, 1, 0, 0, 0)
+
+def tokenize(lexer, input):
+    """ generate the tokens of an input string
+
+    Parameters:
+        lexer : lexer or parser (its lexer is used)
+        input : input string (or file object, mmap object or iterable of chunks)
+
+    Tokens are Token instances. Separators and the EOF token are not
+    generated. The context sensitive lexer can not be used without a parser.
+    The input is scanned by a copy of the lexer (as the lexers of new
+    parsers are copied from lexer_prototype), the state of the lexer and
+    of the parser is not changed.
+    """
+    lexer = getattr(lexer, "lexer", lexer)
+    if isinstance(lexer, ContextSensitiveLexer):
+        raise SemanticError("ContextSensitiveLexer can not tokenize without a parser")
+    lexer = copy.copy(lexer)
+    if not isinstance(input, string_types) and not lexer.streaming:
+        input = "".join(chunks(input, 65536))
+    lexer.start(input)
+    token = lexer.token()
+    while not isinstance(token, EOFToken):
+        yield token
+        token = lexer.next_token()
+
+def tokenize_all(lexer, input):
+    """ return the list of the tokens of an input string
+
+    Parameters:
+        lexer : lexer or parser (its lexer is used)
+        input : input string (or file object, mmap object or iterable of chunks)
+
+    The tokens are the same as the tokens generated by tokenize. The whole
+    input is scanned at once by the scanner of the regular expression of
+    named group lexers. Other lexers are driven by tokenize.
+    As with tokenize, the input is scanned by a copy of the lexer, the
+    state of the lexer and of the parser is not changed.
+    """
+    lexer = getattr(lexer, "lexer", lexer)
+    if not isinstance(lexer, NamedGroupLexer) or isinstance(lexer, Lexer) or lexer.streaming:
+        return list(tokenize(lexer, input))
+    lexer = copy.copy(lexer)
+    lexer.build()
+    if isinstance(lexer.token_re, Alternation):
+        return list(tokenize(lexer, input))
+    if not isinstance(input, string_types):
+        input = "".join(chunks(input, 65536))
+    definitions = lexer.tokens
+    literals = lexer.literals
+    hook = lexer.separator_hook
+    lines = lexer.lazy_positions and LineIndex(input) or None
+    tokens = []
+    append = tokens.append
+    line, column = 1, 1
+    pos = prev_stop = 0
+    for tok in iter(lexer.token_re.scanner(input).match, None):
+        name = tok.lastgroup
+        value, real_token = definitions[name]
+        text = literals.get(name)
+        if text is None:
+            text = tok.group()
+        if not real_token:
+            if hook is not None:
+                hook(name, text, value(text))
+        elif value is _id:
+            value = text
+        elif isinstance(value, Constant):
+            value = value.value
+        else:
+            try:
+                value = value(text)
+            except WrongToken:
+                raise LexicalError(lines and lines.line_column(pos) or (line, column), "Lexical error in %s"%text)
+        start, pos = tok.span()
+        if lines is not None:
+            if real_token:
+                append(LazyToken(lines, name, text, value, start, pos, prev_stop))
+                prev_stop = pos
+            continue
+        tok_line, tok_column = line, column
+        if '\n' in text:
+            line += text.count('\n')
+            column = len(text) - text.rfind('\n')
+        else:
+            column += len(text)
+        if real_token:
+            append(Token(name, text, value, tok_line, tok_column, line, column, start, pos, prev_stop))
+            prev_stop = pos
+    if pos < len(input):
+        w = 20
+        nl = input.find('\n', pos, pos+w)
+        if nl > -1:
+            err = input[pos:nl]
+        else:
+            err = input[pos:pos+w]
+        raise LexicalError(lines and lines.line_column(pos) or (line, column), "Lexical error near %s"%err)
+    return tokens
+
+class Memo:
+    """ Memo(size)
+
+    Memo is the memoization table of packrat parsers (set memoize = True).
+    It is created for each parse and maps (rule, position, arguments)
+    to the result of the rule and the token where the rule stopped.
+
+    Attributes:
+        size   : maximum number of entries (the oldest entries are discarded first)
+        table  : dictionnary (rule, position, args, kws) -> (value, token, reach)
+                    token is None if the rule has failed
+                    reach is the end of the furthest token examined by the rule
+        hits   : number of rule calls found in the table
+        misses : number of rule calls computed and stored in the table
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.table = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def store(self, key, value, token, reach):
+        """ store the result of a rule and discard the oldest entry if the table is full
+        """
+        table = self.table
+        table[key] = value, token, reach
+        if len(table) > self.size:
+            table.popitem(last=False)
+
+    def update(self, limit, resume, delta):
+        """ update the table after an edit of the input string (incremental parsers)
+
+        Parameters:
+            limit  : end of the last token kept before the edit
+            resume : start of the first token kept after the edit
+            delta  : shift of the tokens after the edit
+
+        The results of the rules that only examined tokens before the edit
+        are kept, the results of the rules starting after the edit are
+        shifted and the others are discarded.
+        """
+        table = collections.OrderedDict()
+        for key, (value, token, reach) in self.table.items():
+            pos = key[1]
+            if reach < limit:
+                table[key] = value, token, reach
+            elif pos >= resume:
+                table[(key[0], pos+delta)+key[2:]] = value, token, reach+delta
+        self.table = table
+        self.hits = 0
+        self.misses = 0
+
+def memoized(rule):
+    """ memoized(rule)
+
+    Decorator of the rule methods of packrat parsers.
+    The result of a rule (or its failure) at a given position
+    is computed once per parse and then replayed from the Memo
+    of the parser. Rules called with unhashable arguments are
+    not memoized.
+    """
+    name = rule.__name__
+    def memoized_rule(self, *args, **kws):
+        memo = self.memo
+        if memo is None:
+            return rule(self, *args, **kws)
+        lexer = self.lexer
+        key = (name, lexer.memo_position(), args, kws and tuple(sorted(kws.items())) or ())
+        try:
+            value, token, reach = memo.table[key]
+        except KeyError:
+            pass
+        except TypeError:
+            return rule(self, *args, **kws)
+        else:
+            memo.hits += 1
+            if reach > lexer.reach:
+                lexer.reached(reach)
+            if token is None:
+                raise WrongToken
+            lexer.back(token)
+            return value
+        memo.misses += 1
+        outer_reach, lexer.reach = lexer.reach, lexer.pos
+        try:
+            value = rule(self, *args, **kws)
+            token = lexer.token()
+        except WrongToken:
+            value, token = None, None
+        reach = lexer.reach
+        if outer_reach > reach:
+            lexer.reach = outer_reach
+        memo.store(key, value, token, reach)
+        if token is None:
+            raise WrongToken
+        return value
+    memoized_rule.__name__ = name
+    memoized_rule.__doc__ = rule.__doc__
+    return memoized_rule
+
+class Py:
+    def __init__(self, level=0):
+        frame = sys._getframe(1+level)
+        self.globals = frame.f_globals
+        self.locals = frame.f_locals
+    def __getitem__(self, item):
+        return eval(item%self, self.globals, self.locals)
+
+
+class GrammarCache:
+    """ GrammarCache(path, key)
+
+    GrammarCache stores the code generated from a grammar in a file
+    so that the next processes can load it instead of parsing the
+    grammar and generating the parser again.
+
+    Attributes:
+        path : name of the cache file
+        key  : hash of the grammar, the TPG version and source and the default options
+    """
+
+    def __init__(self, path, key):
+        self.path = path
+        self.key = key
+
+    def load(self):
+        """ return the cached attributes or None if the cache is missing or outdated
+
+        Attributes are (attribute, source, code) tuples where code is the
+        compiled source defining the attribute.
+        """
+        try:
+            f = open(self.path, 'rb')
+            try:
+                key, attributes = marshal.load(f)
+            finally:
+                f.close()
+        except Exception:
+            return None
+        if key != self.key:
+            return None
+        return attributes
+
+    def save(self, attributes):
+        """ store the attributes in the cache file
+
+        Parameters:
+            attributes : list of (attribute, source, code) tuples
+
+        As for Python bytecode, errors are ignored and nothing is written
+        when sys.dont_write_bytecode is set.
+        """
+        if sys.dont_write_bytecode:
+            return
+        tmp = "%s.%s"%(self.path, os.getpid())
+        try:
+            directory = os.path.dirname(self.path)
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            f = open(tmp, 'wb')
+            try:
+                marshal.dump((self.key, attributes), f)
+            finally:
+                f.close()
+            if os.path.exists(self.path) and not hasattr(os, 'replace'):
+                os.remove(self.path)
+            getattr(os, 'replace', os.rename)(tmp, self.path)
+        except (IOError, OSError):
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    def update(self, attribute, source):
+        """ replace the entry of a rule of a lazy grammar by its compiled method
+
+        Parameters:
+            attribute : name of the rule
+            source    : source of the compiled method of the rule
+
+        Rules of lazy grammars that have not been used yet are stored
+        as (attribute, None, None) entries.
+        """
+        attributes = self.load()
+        if attributes is None:
+            return
+        entry = (attribute, source, compile(source, "<string>", "exec"))
+        self.save([attribute == cached[0] and entry or cached for cached in attributes])
+
+generator_source_hash = None
+
+def generator_hash():
+    """ return a hash of the source of the TPG module or None if it can not be read
+
+    The generated code depends on the code generator, not only on its
+    version number, so the hash of the module is part of the key of the
+    grammar cache.
+    """
+    global generator_source_hash
+    if generator_source_hash is None:
+        filename = __file__
+        if filename[-4:] in ('.pyc', '.pyo'):
+            filename = filename[:-1]
+        try:
+            f = open(filename, 'rb')
+            try:
+                generator_source_hash = hashlib.sha1(f.read()).hexdigest()
+            finally:
+                f.close()
+        except (IOError, OSError):
+            return None
+    return generator_source_hash
+
+def grammar_cache(cls, env, grammar):
+    """ return the GrammarCache of a parser class or None if it is not cached
+
+    Parameters:
+        cls     : parser class
+        env     : globals of the module defining the parser
+        grammar : grammar of the parser
+
+    The cache file is stored in cls.grammar_cache if it is a directory name.
+    If cls.grammar_cache is True, it is stored in the __pycache__ directory
+    of the module defining the parser.
+    If cls.grammar_cache is None (the default), it is stored in the directory
+    given by the TPG_GRAMMAR_CACHE environment variable, if it is set.
+    Grammars are not cached when the source of TPG can not be read (see
+    generator_hash).
+    """
+    directory = cls.grammar_cache
+    if directory is None:
+        directory = os.environ.get('TPG_GRAMMAR_CACHE')
+    if not directory:
+        return None
+    generator = generator_hash()
+    if generator is None:
+        return None
+    if directory is True:
+        filename = env.get('__file__')
+        if not filename:
+            return None
+        directory = os.path.join(os.path.dirname(os.path.abspath(filename)), '__pycache__')
+    implementation = getattr(sys, 'implementation', None)
+    tag = getattr(implementation, 'cache_tag', None) or "py%s%s"%sys.version_info[:2]
+    name = getattr(cls, '__qualname__', cls.__name__)
+    path = os.path.join(directory, "%s.%s.%s.tpg"%(env.get('__name__', ''), name, tag))
+    defaults = sorted([ (option, default) for option, (values, default) in TPGParser.Options.option_dict.items() ])
+    key = repr((__version__, generator, sys.version, defaults, grammar)).encode('utf-8', 'backslashreplace')
+    return GrammarCache(path, hashlib.sha1(key).hexdigest())
+
+class LazyGrammar(object):
+    """ LazyGrammar(env, grammar)
+
+    LazyGrammar gives the rules of a lazy grammar loaded from the grammar
+    cache whose methods were not compiled yet. The grammar is parsed again,
+    only once, when the first of these rules is used.
+
+    Attributes:
+        env     : global namespace of the parser class
+        grammar : grammar of the parser class
+        rules   : LazyRule objects of the rules not compiled yet
+    """
+
+    def __init__(self, env, grammar):
+        self.env = env
+        self.grammar = grammar
+        self.rules = None
+
+    def rule(self, name):
+        """ return the LazyRule (with a parser and a rule) of a rule
+        """
+        if self.rules is None:
+            self.rules = {}
+            for attribute, source, code in TPGParser(self.env)(self.grammar):
+                if isinstance(code, LazyRule):
+                    self.rules[attribute] = code
+        return self.rules.pop(name)
+
+class LazyRule(object):
+    """ LazyRule(parser, rule, name=None)
+
+    LazyRule replaces the method of a rule in lazy grammars (set lazy = True).
+    The code of the rule is generated and compiled the first time the rule
+    is used, then the LazyRule is replaced by the compiled method and the
+    compiled method is added to the grammar cache.
+
+    The parser and the rule are released once the rule is compiled.
+    LazyRules of grammars loaded from the cache have no parser nor rule,
+    they get them from a LazyGrammar.
+
+    Attributes:
+        parser  : TPGParser object that has parsed the grammar
+        rule    : rule to compile
+        name    : name of the rule
+        owner   : parser class containing the rule
+        cache   : GrammarCache of the parser class (None if not cached)
+        grammar : LazyGrammar of the parser class (rules loaded from the cache)
+    """
+
+    lock = threading.RLock()
+
+    def __init__(self, parser, rule, name=None):
+        self.parser = parser
+        self.rule = rule
+        self.name = name or rule.head.name
+        self.owner = None
+        self.cache = None
+        self.grammar = None
+
+    def compile(self):
+        """ generate and compile the rule
+
+        Returns the (attribute, source, code) tuple of the rule method.
+        """
+        if self.rule is None:
+            lazy = self.grammar.rule(self.name)
+            self.parser, self.rule = lazy.parser, lazy.rule
+        name, code = self.rule.gen_code()
+        attribute = self.parser.make_code(name, *code)
+        self.parser = self.rule = self.grammar = None
+        return attribute
+
+    def materialize(self):
+        """ replace the LazyRule by the compiled method in the parser class
+        """
+        with self.lock:
+            code = self.owner.__dict__.get(self.name)
+            if code is not self:
+                # already compiled by another thread
+                return code
+            attribute, source, code = self.compile()
+            setattr(self.owner, attribute, code)
+            if self.cache:
+                self.cache.update(attribute, source)
+            return code
+
+    def __get__(self, obj, cls):
+        return self.materialize().__get__(obj, cls)
+
+class ParseState(threading.local):
+    """ ParseState(**state)
+
+    ParseState holds the state of the parses of a parser (the lexer, the
+    memoization table, ...). Each thread has its own state, initialized
+    with the state given when the parser is created, so several threads
+    can parse with the same parser at the same time.
 
     Attributes:
-        name       : name of the token
-        text       : text matched by the regular expression
-        value      : value computed from the text
-        line       : line of the token in the input string
-        column     : column of the token in the input string
-        end_line   : line of the end of the token
-        end_column : column of the end of the token
-        start      : position of the start in the input string of the token
-        stop       : position of the end in the input string of the token
-        prev_stop  : position of the end of the previous token
+        parsing : True while the thread is parsing an input
     """
 
-    def __init__(self):
-        Token.__init__(self, "SOF", "SOF", None, 1, 1, 1, 1, 0, 0, 0)
+    parsing = False
+    memo = None
+    axiom_call = None
+    string_prefix = 'r'
+    axiom = None
 
-class Py:
-    def __init__(self, level=0):
-        frame = sys._getframe(1+level)
-        self.globals = frame.f_globals
-        self.locals = frame.f_locals
-    def __getitem__(self, item):
-        return eval(item%self, self.globals, self.locals)
+    def __init__(self, **state):
+        self.__dict__.update(state)
 
+def parse_state_property(name):
+    """ return a property reading and writing an attribute of the parse
+    state of the current thread (see ParseState)
+    """
+    def fset(parser, value):
+        setattr(parser.parse_states, name, value)
+    def fdel(parser):
+        delattr(parser.parse_states, name)
+    return property(operator.attrgetter("parse_states." + name), fset, fdel)
 
 class ParserMetaClass(type):
     """ ParserMetaClass is the metaclass of Parser objects.
@@ -859,6 +2565,11 @@ class ParserMetaClass(type):
     a grammar. This grammar is parsed by TPGParser and the generated code
     is added to the class.
     If the class doesn't have a doc string, nothing is generated
+
+    The generated code can be cached on disk (see GrammarCache) and reused
+    as long as the grammar, TPG and Python are not changed.
+    Rules of lazy grammars are compiled when they are first used
+    (see LazyRule) and are added to the cache once compiled.
     """
 
     def __init__(cls, name, bases, dict):
@@ -868,9 +2579,42 @@ class ParserMetaClass(type):
         except KeyError:
             pass
         else:
-            parser = TPGParser(sys._getframe(1).f_globals)
-            for attribute, source, code in parser(grammar):
-                setattr(cls, attribute, code)
+            env = sys._getframe(1).f_globals
+            cache = grammar_cache(cls, env, grammar)
+            attributes = cache and cache.load()
+            if attributes is not None:
+                lazy_grammar = LazyGrammar(env, grammar)
+                for attribute, source, code in attributes:
+                    if code is None:
+                        code = LazyRule(None, None, attribute)
+                        code.owner, code.cache, code.grammar = cls, cache, lazy_grammar
+                        setattr(cls, attribute, code)
+                        continue
+                    local_namespace = {}
+                    exec(code, env, local_namespace)
+                    setattr(cls, attribute, local_namespace[attribute])
+            else:
+                parser = TPGParser(env)
+                attributes = []
+                for attribute, source, code in parser(grammar):
+                    if isinstance(code, LazyRule):
+                        code.owner, code.cache = cls, cache
+                        attributes.append((attribute, None, None))
+                    else:
+                        attributes.append((attribute, source, compile(source, "<string>", "exec")))
+                    setattr(cls, attribute, code)
+                if cache:
+                    cache.save(attributes)
+
+    def compile_rules(cls):
+        """ compile the rules of a lazy grammar that have not been used yet
+
+        This can be used to pay the compilation cost ahead of time.
+        """
+        for klass in cls.__mro__:
+            for attribute, value in list(vars(klass).items()):
+                if isinstance(value, LazyRule):
+                    value.materialize()
 
 if __python__ == 3:
     exec("class _Parser(metaclass=ParserMetaClass): pass")
@@ -884,12 +2628,32 @@ class Parser(_Parser):
     # The metaclass of this class is ParserMetaClass.
     #
     # Attributes:
-    #   lexer : lexer build from the grammar
+    #   lexer         : lexer build from the grammar (the lexer of the last parse of the thread once a parse is completed)
+    #   parse_states  : state of the parses of the parser in each thread (see ParseState)
+    #   lexer_prototype : lexer built once per parser class and copied for each parser
+    #   grammar_cache : directory where the generated code is cached
+    #                   (True for the __pycache__ directory of the module, False to disable the cache,
+    #                   None to use the TPG_GRAMMAR_CACHE environment variable)
+    #   memoize       : True for packrat parsers (set memoize = True)
+    #   memo_size     : maximum number of entries of the memoization table
+    #   memo          : memoization table (Memo) of the last parse of packrat parsers
+    #   incremental   : True for incremental parsers (set incremental = True)
     #
     # Methods added to the generated parsers:
     #   init_lexer(self) : return a lexer object to scan the tokens defined by the grammar
     #   <rule>           : each rule is translated into a method with the same name
 
+    grammar_cache = None
+    memoize = False
+    memo_size = 100000
+    incremental = False
+    lexer_prototype = None
+
+    lexer = parse_state_property("lexer")
+    memo = parse_state_property("memo")
+    axiom_call = parse_state_property("axiom_call")
+    string_prefix = parse_state_property("string_prefix")
+
     def __init__(self):
         """ Parser is the base class for parsers.
 
@@ -903,7 +2667,29 @@ class Parser(_Parser):
             init_lexer(self) : return a lexer object to scan the tokens defined by the grammar
             <rule>           : each rule is translated into a method with the same name
         """
-        self.lexer = self.init_lexer()
+        self.parse_states = ParseState(lexer=self.new_lexer())
+
+    def new_lexer(self):
+        """ return the lexer of a new parser
+
+        The lexer returned by init_lexer is built once per parser class
+        (lexer_prototype) and copied for each parser (see clone). The
+        copies share the compiled regular expressions of the prototype
+        and have their own token tables and state. The options changed on
+        the lexer of a parser (e.g. max_groups) and the tokens defined on
+        it are used when the copy is built again at the next parse.
+        """
+        cls = self.__class__
+        prototype = cls.__dict__.get("lexer_prototype")
+        if prototype is None:
+            prototype = self.init_lexer()
+            if hasattr(prototype, "build"):
+                prototype.build()
+            cls.lexer_prototype = prototype
+        elif isinstance(prototype, ContextSensitiveLexer):
+            # done by init_lexer for context sensitive lexers
+            self.eat = self.eatCSL
+        return prototype.clone()
 
     def eat(self, name):
         """ eat the current token if it matches the expected token
@@ -911,9 +2697,10 @@ class Parser(_Parser):
         Parameters:
             name : name of the expected token
         """
-        token = self.lexer.token()
+        lexer = self.lexer
+        token = lexer.token()
         if token.match(name):
-            self.lexer.next_token()
+            lexer.next_token()
             return token.value
         else:
             raise WrongToken
@@ -949,7 +2736,47 @@ class Parser(_Parser):
             input : input string to parse
             *args : argument list to pass to START
             **kws : argument dictionnary to pass to START
+
+        input can also be a file object, a mmap object or an iterable of chunks.
+        It is read by chunks with streaming lexers (set lexer = StreamNamedGroupLexer)
+        and in full with the other lexers.
+
+        Each parse has its own lexer (a copy of the lexer of the parser) and
+        its own state (see ParseState), so the same parser can parse several
+        inputs at the same time (in several threads or in semantic actions).
+        At the end of a parse, the lexer and the state of the parse are kept
+        by the thread and the state of an enclosing parse is restored.
+        """
+        state = self.parse_states
+        outer_state = state.parsing and dict(state.__dict__)
+        lexer = self.lexer
+        if hasattr(lexer, "build"):
+            lexer.build()
+        state.lexer = copy.copy(lexer)
+        state.parsing = True
+        try:
+            return self.parse_axiom(axiom, input, args, kws)
+        finally:
+            if outer_state:
+                state.__dict__.clear()
+                state.__dict__.update(outer_state)
+            else:
+                state.parsing = False
+
+    def parse_axiom(self, axiom, input, args, kws):
+        """ parse a string starting from a given axiom with the lexer of the parse
+
+        Parameters:
+            axiom : rule name where the parser starts
+            input : input string to parse
+            args  : argument list to pass to START
+            kws   : argument dictionnary to pass to START
         """
+        if self.memoize:
+            self.memo = Memo(self.memo_size)
+        if not isinstance(input, string_types) and not self.lexer.streaming:
+            input = "".join(chunks(input, 65536))
+        self.axiom_call = axiom, args, kws
         try:
             self.lexer.start(input)
             if __python__ == 2 and isinstance(input, unicode):
@@ -960,15 +2787,45 @@ class Parser(_Parser):
             if not self.lexer.eof():
                 raise WrongToken
         except WrongToken:
-            if self.lexer.last_token is None:
-                last_token = ""
-                line, column = 1, 1
-            else:
-                last_token = self.lexer.last_token.text
-                line, column = self.lexer.last_token.line, self.lexer.last_token.column
-            raise SyntacticError((line, column), "Syntax error near %s"%last_token)
+            raise self.syntax_error()
         return value
 
+    def reparse(self, start, stop, text):
+        """ parse the last input string again after an edit
+
+        Parameters:
+            start : position of the first character replaced in the last input string
+            stop  : position following the last character replaced
+            text  : text replacing the characters between start and stop
+
+        This requires an incremental parser (set incremental = True).
+        Only the tokens around the edit are scanned again and the results
+        of the rules that have not examined the edited tokens are reused.
+        The axiom and the arguments of the last parse are used again.
+        """
+        if not self.incremental or self.memo is None:
+            raise SemanticError("reparse requires a previous parse by an incremental parser")
+        self.memo.update(*self.lexer.update(start, stop, text))
+        axiom, args, kws = self.axiom_call
+        try:
+            value = getattr(self, axiom)(*args, **kws)
+            if not self.lexer.eof():
+                raise WrongToken
+        except WrongToken:
+            raise self.syntax_error()
+        return value
+
+    def syntax_error(self):
+        """ return the SyntacticError raised at the last token reached by the lexer
+        """
+        if self.lexer.last_token is None:
+            last_token = ""
+            line, column = 1, 1
+        else:
+            last_token = self.lexer.last_token.text
+            line, column = self.lexer.last_token.line, self.lexer.last_token.column
+        return SyntacticError((line, column), "Syntax error near %s"%last_token)
+
     def line(self, token=None):
         """ return the line number of a token
 
@@ -1047,6 +2904,7 @@ class VerboseParser(Parser):
     #   <rule>           : each rule is translated into a method with the same name
 
     verbose = 1
+    axiom = parse_state_property("axiom")
 
     def __init__(self):
         """ VerboseParser is the base class for debugging parsers.
@@ -1107,22 +2965,23 @@ class VerboseParser(Parser):
             return value
         except WrongToken:
             if self.verbose >= 2:
-                token = Token("???", self.lexer.input[self.lexer.pos:self.lexer.pos+10].replace('\n', ' '), "???", self.lexer.line, self.lexer.column, self.lexer.line, self.lexer.column, self.lexer.pos, self.lexer.pos, self.lexer.pos)
+                line, column = self.lexer.position()
+                token = Token("???", self.lexer.input[self.lexer.pos:self.lexer.pos+10].replace('\n', ' '), "???", line, column, line, column, self.lexer.pos, self.lexer.pos, self.lexer.pos)
                 #print(self.token_info(token, "!=", name))
                 sys.stderr.write(self.token_info(token, "!=", name)+"\n")
             raise
 
-    def parse(self, axiom, input, *args, **kws):
-        """ parse a string starting from a given axiom
+    def parse_axiom(self, axiom, input, args, kws):
+        """ parse a string starting from a given axiom with the lexer of the parse
 
         Parameters:
             axiom : rule name where the parser starts
             input : input string to parse
-            *args : argument list to pass to START
-            **kws : argument dictionnary to pass to START
+            args  : argument list to pass to START
+            kws   : argument dictionnary to pass to START
         """
         self.axiom = axiom
-        return Parser.parse(self, axiom, input, *args, **kws)
+        return Parser.parse_axiom(self, axiom, input, args, kws)
 
     def token_info(self, token, op, expected):
         """ return information about a token
@@ -1145,6 +3004,156 @@ class VerboseParser(Parser):
         found = "(%d,%d) %s %s"%(token.line, token.column, token.name, token.text)
         return "[%3d][%2d]%s: %s %s %s"%(eatcnt, stackdepth, callernames, found, op, expected)
 
+class ParserPool:
+    """ ParserPool(parser_class, size=8)
+
+    ParserPool keeps parsers that can be reused for several parses.
+    A parser is taken from the pool by checkout and given back by checkin.
+    The pool can be shared by several threads.
+
+    Attributes:
+        parser_class : class of the parsers
+        size         : maximum number of parsers kept in the pool
+        parsers      : parsers available in the pool
+    """
+
+    def __init__(self, parser_class, size=8):
+        self.parser_class = parser_class
+        self.size = size
+        self.parsers = []
+        self.lock = threading.Lock()
+
+    def checkout(self):
+        """ return a parser of the pool (a new parser if the pool is empty)
+        """
+        self.lock.acquire()
+        try:
+            if self.parsers:
+                return self.parsers.pop()
+        finally:
+            self.lock.release()
+        return self.parser_class()
+
+    def checkin(self, parser):
+        """ give a parser back to the pool
+
+        The parser is dropped if the pool is full.
+        """
+        self.lock.acquire()
+        try:
+            if len(self.parsers) < self.size:
+                self.parsers.append(parser)
+        finally:
+            self.lock.release()
+
+    def parse(self, axiom, input, *args, **kws):
+        """ parse a string starting from a given axiom with a parser of the pool
+        """
+        parser = self.checkout()
+        try:
+            return parser.parse(axiom, input, *args, **kws)
+        finally:
+            self.checkin(parser)
+
+    def __call__(self, input, *args, **kws):
+        """ parse a string starting from the default axiom with a parser of the pool
+        """
+        return self.parse('START', input, *args, **kws)
+
+def parse_inputs(parser, axiom, inputs):
+    """ parse a list of (index, input) and return a list of (index, value, error)
+    """
+    results = []
+    for index, input in inputs:
+        try:
+            results.append((index, parser.parse(axiom, input), None))
+        except Error:
+            results.append((index, None, exc()))
+    return results
+
+worker_parsers = {}
+
+def parse_batch(parser_class, axiom, inputs):
+    """ parse a list of (index, input) in a worker process of parse_many
+
+    The parser is created once in each worker process.
+    """
+    parser = worker_parsers.get(parser_class)
+    if parser is None:
+        parser = worker_parsers[parser_class] = parser_class()
+    return parse_inputs(parser, axiom, inputs)
+
+def parse_many(parser_class, inputs, workers=None, axiom="START", ordered=True, batch_size=16):
+    """ parse independent inputs in worker processes
+
+    Parameters:
+        parser_class : parser class (it must be defined at the top level of a module)
+        inputs       : iterable of inputs to parse
+        workers      : number of worker processes (the number of processors by default)
+                       0 parses the inputs in the current process
+        axiom        : rule name where the parsers start
+        ordered      : if True results are generated in the order of the inputs,
+                       otherwise as soon as they are available
+        batch_size   : number of inputs sent at once to a worker process
+
+    Generates (index, value, error) tuples where index is the index of the
+    input in inputs, value the value returned by the parser and error the
+    tpg.Error raised by the parser (value is None if error is not None).
+    Other exceptions abort the batch. Parsers are created by parser_class
+    in each worker process, so inputs and values must be picklable.
+    Inputs are parsed in the current process if concurrent.futures is not
+    available. Inputs are read as the results are consumed: at most two
+    batches per worker are submitted ahead of the results generated.
+    """
+    batches = input_batches(inputs, batch_size)
+    if workers == 0 or futures is None:
+        parser = parser_class()
+        for batch in batches:
+            for result in parse_inputs(parser, axiom, batch):
+                yield result
+        return
+    executor = futures.ProcessPoolExecutor(workers)
+    # only a few batches per worker are submitted at once so that the
+    # inputs are read as the results are consumed
+    window = 2 * (workers or getattr(os, 'cpu_count', lambda: None)() or 1)
+    jobs = collections.deque()
+    try:
+        while True:
+            for batch in batches:
+                jobs.append(executor.submit(parse_batch, parser_class, axiom, batch))
+                if len(jobs) >= window:
+                    break
+            if not jobs:
+                break
+            if ordered:
+                done = [jobs.popleft()]
+            else:
+                done = futures.wait(jobs, return_when=futures.FIRST_COMPLETED).done
+                jobs = collections.deque([job for job in jobs if job not in done])
+            for job in done:
+                for result in job.result():
+                    yield result
+    finally:
+        # the jobs not started yet are useless if the results are not consumed
+        if sys.version_info >= (3, 9):
+            executor.shutdown(cancel_futures=True)
+        else:
+            for job in jobs:
+                job.cancel()
+            executor.shutdown()
+
+def input_batches(inputs, batch_size):
+    """ generate the lists of at most batch_size (index, input) tuples of inputs
+    """
+    batch = []
+    for index, input in enumerate(inputs):
+        batch.append((index, input))
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
 blank_line_re = re.compile("^\s*$")
 indent_re = re.compile("^\s*")
 
@@ -1155,9 +3164,12 @@ class tpg:
     Lexer = Lexer
     CacheNamedGroupLexer = CacheNamedGroupLexer
     CacheLexer = CacheLexer
+    CompactCacheNamedGroupLexer = CompactCacheNamedGroupLexer
+    StreamNamedGroupLexer = StreamNamedGroupLexer
     ContextSensitiveLexer = ContextSensitiveLexer
     Parser = Parser
     WrongToken = WrongToken
+    memoized = staticmethod(memoized)
     re = re
 
 class TPGParser(tpg.Parser):
@@ -1321,6 +3333,7 @@ class TPGParser(tpg.Parser):
 
     def init_lexer(self):
         lexer = tpg.NamedGroupLexer(True, tpg.re.VERBOSE)
+        lexer.unbound_tokens = ('_tok_1', '_tok_2', '_tok_3', '_tok_4', '_tok_5', '_tok_6', '_tok_7', '_tok_8', '_tok_9', '_tok_10', '_tok_11', '_tok_12', '_tok_13', '_tok_14', '_tok_15', '_tok_16', '_tok_17', '_tok_18', '_tok_19', 'lcbra', 'rcbra', 'star2', 'star')
         lexer.def_token('_tok_1', r'set')
         lexer.def_token('_tok_2', r'=')
         lexer.def_token('_tok_3', r'separator')
@@ -1387,6 +3400,7 @@ class TPGParser(tpg.Parser):
         options = self.Options(self)
         while True:
             _p1 = self.lexer.token()
+            if _p1.name != '_tok_1': break
             try:
                 self.eat('_tok_1') # 'set'
                 name = self.eat('ident')
@@ -1408,6 +3422,7 @@ class TPGParser(tpg.Parser):
         ts = []
         while True:
             _p1 = self.lexer.token()
+            if _p1.name not in ('_tok_3', '_tok_4'): break
             try:
                 t = self.TOKEN()
                 ts.append(t)
@@ -1418,33 +3433,31 @@ class TPGParser(tpg.Parser):
 
     def TOKEN(self, ):
         r""" ``TOKEN -> ('separator' | 'token') ident ':'? string (PY_EXPR ';'? | ';') ;`` """
-        _p1 = self.lexer.token()
-        try:
+        if self.lexer.token().name == '_tok_3':
             self.eat('_tok_3') # 'separator'
             token_type = self.DefSeparator
-        except tpg.WrongToken:
-            self.lexer.back(_p1)
+        else:
             self.eat('_tok_4') # 'token'
             token_type = self.DefToken
         name = self.eat('ident')
-        _p2 = self.lexer.token()
-        try:
-            self.eat('_tok_5') # ':'
-        except tpg.WrongToken:
-            self.lexer.back(_p2)
+        _p1 = self.lexer.token()
+        if _p1.name == '_tok_5':
+            try:
+                self.eat('_tok_5') # ':'
+            except tpg.WrongToken:
+                self.lexer.back(_p1)
         t = self.mark()
         expr = self.eat('string')
         self.re_check(expr, t)
-        _p3 = self.lexer.token()
-        try:
+        if self.lexer.token().name in ('_tok_17', 'code', 'ident', 'string'):
             code = self.PY_EXPR()
-            _p4 = self.lexer.token()
-            try:
-                self.eat('_tok_6') # ';'
-            except tpg.WrongToken:
-                self.lexer.back(_p4)
-        except tpg.WrongToken:
-            self.lexer.back(_p3)
+            _p2 = self.lexer.token()
+            if _p2.name == '_tok_6':
+                try:
+                    self.eat('_tok_6') # ';'
+                except tpg.WrongToken:
+                    self.lexer.back(_p2)
+        else:
             self.eat('_tok_6') # ';'
             code = None
         return token_type(name, self.string_prefix, expr, code)
@@ -1454,6 +3467,7 @@ class TPGParser(tpg.Parser):
         rs = self.Rules()
         while True:
             _p1 = self.lexer.token()
+            if _p1.name != 'ident': break
             try:
                 r = self.RULE()
                 rs.append(r)
@@ -1498,6 +3512,7 @@ class TPGParser(tpg.Parser):
         and_expr = self.And()
         while True:
             _p1 = self.lexer.token()
+            if _p1.name not in ('_tok_11', '_tok_12', '_tok_13', '_tok_9', 'code', 'ident', 'string'): break
             try:
                 a = self.ATOM_EXPR()
                 a = self.REP(a)
@@ -1509,39 +3524,32 @@ class TPGParser(tpg.Parser):
 
     def ATOM_EXPR(self, ):
         r""" ``ATOM_EXPR -> SYMBOL | INLINE_TOKEN | code | '\(' OR_EXPR '\)' | 'check' PY_EXPR | 'error' PY_EXPR | '@' PY_EXPR ;`` """
-        _p1 = self.lexer.token()
-        try:
-            try:
+        if self.lexer.token().name in ('code', 'ident', 'string'):
+            if self.lexer.token().name == 'ident':
                 a = self.SYMBOL()
-            except tpg.WrongToken:
-                self.lexer.back(_p1)
-                try:
+            else:
+                if self.lexer.token().name == 'string':
                     a = self.INLINE_TOKEN()
-                except tpg.WrongToken:
-                    self.lexer.back(_p1)
+                else:
                     t = self.mark()
                     a = self.eat('code')
                     self.code_check(a, t)
-        except tpg.WrongToken:
-            self.lexer.back(_p1)
-            try:
-                try:
+        else:
+            if self.lexer.token().name in ('_tok_11', '_tok_9'):
+                if self.lexer.token().name == '_tok_9':
                     self.eat('_tok_9') # '\('
                     a = self.OR_EXPR()
                     self.eat('_tok_10') # '\)'
-                except tpg.WrongToken:
-                    self.lexer.back(_p1)
+                else:
                     self.eat('_tok_11') # 'check'
                     cond = self.PY_EXPR()
                     a = self.Check(cond)
-            except tpg.WrongToken:
-                self.lexer.back(_p1)
-                try:
+            else:
+                if self.lexer.token().name == '_tok_12':
                     self.eat('_tok_12') # 'error'
                     msg = self.PY_EXPR()
                     a = self.Error(msg)
-                except tpg.WrongToken:
-                    self.lexer.back(_p1)
+                else:
                     self.eat('_tok_13') # '@'
                     mark = self.PY_EXPR()
                     a = self.Mark(mark)
@@ -1550,45 +3558,43 @@ class TPGParser(tpg.Parser):
     def REP(self, a):
         r""" ``REP -> ('\*' | '\+' | '\?' | '\{' (PY_EXPR | ) (',' (PY_EXPR | ) | ) '\}')? ;`` """
         _p1 = self.lexer.token()
-        try:
+        if _p1.name in ('_tok_14', '_tok_15', 'lcbra', 'star'):
             try:
-                try:
-                    self.eat('star') # '\*'
-                    a = self.Rep(a, 0, None)
-                except tpg.WrongToken:
-                    self.lexer.back(_p1)
-                    self.eat('_tok_14') # '\+'
-                    a = self.Rep(a, 1, None)
-            except tpg.WrongToken:
-                self.lexer.back(_p1)
-                try:
-                    self.eat('_tok_15') # '\?'
-                    a = self.Rep(a, 0, 1)
-                except tpg.WrongToken:
-                    self.lexer.back(_p1)
-                    self.eat('lcbra') # '\{'
-                    _p2 = self.lexer.token()
-                    try:
-                        min = self.PY_EXPR()
-                    except tpg.WrongToken:
-                        self.lexer.back(_p2)
-                        min = self.PY_Ident("0") 
-                    _p3 = self.lexer.token()
-                    try:
-                        self.eat('_tok_16') # ','
-                        _p4 = self.lexer.token()
+                if _p1.name in ('_tok_14', 'star'):
+                    if _p1.name == 'star':
+                        self.eat('star') # '\*'
+                        a = self.Rep(a, 0, None)
+                    else:
+                        self.eat('_tok_14') # '\+'
+                        a = self.Rep(a, 1, None)
+                else:
+                    if _p1.name == '_tok_15':
+                        self.eat('_tok_15') # '\?'
+                        a = self.Rep(a, 0, 1)
+                    else:
+                        self.eat('lcbra') # '\{'
+                        _p2 = self.lexer.token()
                         try:
-                            max = self.PY_EXPR()
+                            min = self.PY_EXPR()
                         except tpg.WrongToken:
-                            self.lexer.back(_p4)
-                            max = self.PY_Ident("None") 
-                    except tpg.WrongToken:
-                        self.lexer.back(_p3)
-                        max = min 
-                    self.eat('rcbra') # '\}'
-                    a = self.Rep(a, min, max)
-        except tpg.WrongToken:
-            self.lexer.back(_p1)
+                            self.lexer.back(_p2)
+                            min = self.PY_Ident("0") 
+                        _p3 = self.lexer.token()
+                        try:
+                            self.eat('_tok_16') # ','
+                            _p4 = self.lexer.token()
+                            try:
+                                max = self.PY_EXPR()
+                            except tpg.WrongToken:
+                                self.lexer.back(_p4)
+                                max = self.PY_Ident("None") 
+                        except tpg.WrongToken:
+                            self.lexer.back(_p3)
+                            max = min 
+                        self.eat('rcbra') # '\}'
+                        a = self.Rep(a, min, max)
+            except tpg.WrongToken:
+                self.lexer.back(_p1)
         return a
 
     def SYMBOL(self, ):
@@ -1621,32 +3627,35 @@ class TPGParser(tpg.Parser):
         self.eat('_tok_17') # '<'
         args = self.Args()
         _p1 = self.lexer.token()
-        try:
-            arg = self.ARG()
-            args.append(arg)
-            while True:
-                _p2 = self.lexer.token()
-                try:
-                    self.eat('_tok_16') # ','
-                    arg = self.ARG()
-                    args.append(arg)
-                except tpg.WrongToken:
-                    self.lexer.back(_p2)
-                    break
-            _p3 = self.lexer.token()
+        if _p1.name in ('_tok_17', 'code', 'ident', 'star', 'star2', 'string'):
             try:
-                self.eat('_tok_16') # ','
+                arg = self.ARG()
+                args.append(arg)
+                while True:
+                    _p2 = self.lexer.token()
+                    if _p2.name != '_tok_16': break
+                    try:
+                        self.eat('_tok_16') # ','
+                        arg = self.ARG()
+                        args.append(arg)
+                    except tpg.WrongToken:
+                        self.lexer.back(_p2)
+                        break
+                _p3 = self.lexer.token()
+                if _p3.name == '_tok_16':
+                    try:
+                        self.eat('_tok_16') # ','
+                    except tpg.WrongToken:
+                        self.lexer.back(_p3)
             except tpg.WrongToken:
-                self.lexer.back(_p3)
-        except tpg.WrongToken:
-            self.lexer.back(_p1)
+                self.lexer.back(_p1)
         self.eat('_tok_18') # '>'
         return args
 
     def ARG(self, ):
         r""" ``ARG -> ident '=' PY_EXPR | PY_EXPR | '\*' ident | '\*\*' ident ;`` """
-        _p1 = self.lexer.token()
-        try:
+        if self.lexer.token().name in ('_tok_17', 'code', 'ident', 'string'):
+            _p1 = self.lexer.token()
             try:
                 name = self.eat('ident')
                 self.eat('_tok_2') # '='
@@ -1656,14 +3665,12 @@ class TPGParser(tpg.Parser):
                 self.lexer.back(_p1)
                 a = self.PY_EXPR()
                 a = self.PY_PositionArgument(a)
-        except tpg.WrongToken:
-            self.lexer.back(_p1)
-            try:
+        else:
+            if self.lexer.token().name == 'star':
                 self.eat('star') # '\*'
                 name = self.eat('ident')
                 a = self.PY_PositionArgumentList(name)
-            except tpg.WrongToken:
-                self.lexer.back(_p1)
+            else:
                 self.eat('star2') # '\*\*'
                 name = self.eat('ident')
                 a = self.PY_KeywordArgumentList(name)
@@ -1672,30 +3679,27 @@ class TPGParser(tpg.Parser):
     def RET(self, ret=None):
         r""" ``RET -> ('/' PY_EXPR)? ;`` """
         _p1 = self.lexer.token()
-        try:
-            self.eat('_tok_19') # '/'
-            ret = self.PY_EXPR()
-        except tpg.WrongToken:
-            self.lexer.back(_p1)
+        if _p1.name == '_tok_19':
+            try:
+                self.eat('_tok_19') # '/'
+                ret = self.PY_EXPR()
+            except tpg.WrongToken:
+                self.lexer.back(_p1)
         return ret
 
     def PY_EXPR(self, ):
         r""" ``PY_EXPR -> ident | string | code | ARGS ;`` """
-        _p1 = self.lexer.token()
-        try:
-            try:
+        if self.lexer.token().name in ('ident', 'string'):
+            if self.lexer.token().name == 'ident':
                 name = self.eat('ident')
                 expr = self.PY_Ident(name)
-            except tpg.WrongToken:
-                self.lexer.back(_p1)
+            else:
                 st = self.eat('string')
                 expr = self.PY_Ident(st)
-        except tpg.WrongToken:
-            self.lexer.back(_p1)
-            try:
+        else:
+            if self.lexer.token().name == 'code':
                 expr = self.eat('code')
-            except tpg.WrongToken:
-                self.lexer.back(_p1)
+            else:
                 expr = self.ARGS()
         return expr
 
@@ -1727,13 +3731,13 @@ class TPGParser(tpg.Parser):
 
     def re_check(self, expr, tok):
         try:
-            sre_parse.parse(eval(self.string_prefix+expr))
+            sre_parse.parse(ast.literal_eval(self.string_prefix+expr))
         except Exception:
             raise LexicalError((tok.line, tok.column), "Invalid regular expression: %s (%s)"%(expr, exc()))
 
     def code_check(self, code, tok):
         try:
-            parser.suite(code.code)
+            compile(code.code, "<string>", "exec")
         except Exception:
             erroneous_code = "\n".join([ "%2d: %s"%(i+1, l) for (i, l) in enumerate(code.code.splitlines()) ])
             raise LexicalError((tok.line, tok.column), "Invalid Python code (%s): \n%s"%(exc, erroneous_code))
@@ -1745,9 +3749,17 @@ class TPGParser(tpg.Parser):
                                   'Lexer': Lexer,
                                   'CacheNamedGroupLexer': CacheNamedGroupLexer,
                                   'CacheLexer': CacheLexer,
+                                  'CompactCacheNamedGroupLexer': CompactCacheNamedGroupLexer,
+                                  'StreamNamedGroupLexer': StreamNamedGroupLexer,
                                   'ContextSensitiveLexer': ContextSensitiveLexer,
+                                  'auto': None,
                                  },                                                     'NamedGroupLexer'),
             'word_boundary':    ({'True': True, 'False': False},                        'True'),
+            'lazy':             ({'True': True, 'False': False},                        'False'),
+            'memoize':          ({'True': True, 'False': False},                        'False'),
+            'incremental':      ({'True': True, 'False': False},                        'False'),
+            'left_factoring':   ({'True': True, 'False': False},                        'False'),
+            'lazy_positions':   ({'True': True, 'False': False},                        'False'),
             #'indent':           ({'True': True, 'False': False},                        'False'),
             'lexer_ignorecase': ({'True': "IGNORECASE", 'False': False},                'False'),
             'lexer_locale':     ({'True': "LOCALE",     'False': False},                'False'),
@@ -1772,23 +3784,33 @@ class TPGParser(tpg.Parser):
                 values = options.keys()
                 self.parser.error("Unknown value (%s). Valid values for %s are %s"%(value, name, ', '.join(sorted(values))))
             setattr(self, name, value)
+        def lexer_compile_flags(self):
+            return [ opt for opt in (self.lexer_ignorecase,
+                                     self.lexer_locale,
+                                     self.lexer_multiline,
+                                     self.lexer_dotall,
+                                     self.lexer_verbose,
+                                     self.lexer_unicode,
+                                    ) if opt ]
         def lexer_compile_options(self):
-            options = [ self.lexer_ignorecase,
-                        self.lexer_locale,
-                        self.lexer_multiline,
-                        self.lexer_dotall,
-                        self.lexer_verbose,
-                        self.lexer_unicode,
-                      ]
-            return "+".join([ "tpg.re.%s"%opt for opt in options if opt ]) or 0
+            return "+".join([ "tpg.re.%s"%opt for opt in self.lexer_compile_flags() ]) or 0
+        def lexer_flags(self):
+            flags = 0
+            for opt in self.lexer_compile_flags():
+                flags |= getattr(re, opt)
+            return flags
 
     class Empty:
         def empty(self):
             return True
 
     class NotEmpty:
+        first_set = None
+        nullable = True
         def empty(self):
             return False
+        def left_factor(self):
+            return self
 
     class Code(NotEmpty):
         def __init__(self, code):
@@ -1821,11 +3843,15 @@ class TPGParser(tpg.Parser):
                 return [indent+line for line in self.code.splitlines()]
         def links_symbols_to_tokens(self, tokens):
             pass
+        def first(self, firsts):
+            # semantic actions are executed even if the following tokens don't match
+            return True, None
         def gen_doc(self, parent):
             return ""
 
     class DefToken:
         def_method = "def_token"
+        bound = False
         def __init__(self, name, string_prefix, expr, code=None):
             self.name = name
             self.string_prefix = string_prefix
@@ -1852,6 +3878,9 @@ class TPGParser(tpg.Parser):
         def links_symbols_to_tokens(self, tokens):
             for rule in self:
                 rule.links_symbols_to_tokens(tokens)
+        def left_factor(self):
+            for rule in self:
+                rule.left_factor()
         def gen_code(self):
             for rule in self:
                 yield rule.gen_code()
@@ -1862,6 +3891,8 @@ class TPGParser(tpg.Parser):
                 n = self.get(name, 1)
                 self[name] = n+1
                 return "_%s%s"%(name, n)
+        memoize = False
+        doc = None
         def __init__(self, head, body):
             self.head = head
             self.body = body
@@ -1873,11 +3904,16 @@ class TPGParser(tpg.Parser):
                 raise SemanticError("%s is both a token and a symbol"%self.head.name)
             else:
                 self.body.links_symbols_to_tokens(tokens)
+        def left_factor(self):
+            # the docstring shows the rule as written in the grammar
+            self.doc = self.body.gen_doc(self)
+            self.body = self.body.left_factor()
         def gen_code(self):
             counters = self.Counters()
             return self.head.name, [
+                self.memoize and "@tpg.memoized" or (),
                 self.head.gen_def(),
-                tab + 'r""" ``%s -> %s ;`` """'%(self.head.gen_doc(self), self.body.gen_doc(self)),
+                tab + 'r""" ``%s -> %s ;`` """'%(self.head.gen_doc(self), self.doc or self.body.gen_doc(self)),
                 self.head.gen_init_ret(tab),
                 self.body.gen_code(tab, counters, None),
                 self.head.gen_ret(tab),
@@ -1895,6 +3931,14 @@ class TPGParser(tpg.Parser):
             self.token = tokens.get(self.name, None)
             if self.token is not None and self.args:
                 raise SemanticError("Token %s can not have arguments"%self.name)
+            if self.token is not None and self.ret is not None:
+                self.token.bound = True
+        def first(self, firsts):
+            if self.token is not None:
+                self.nullable, self.first_set = False, frozenset([self.token.name])
+            else:
+                self.nullable, self.first_set = firsts.get(self.name, (True, None))
+            return self.nullable, self.first_set
         def gen_def(self):
             return "def %s(self, %s):"%(self.name, self.args.gen_code())
         def gen_init_ret(self, indent):
@@ -1927,6 +3971,9 @@ class TPGParser(tpg.Parser):
             return self.explicit_token.gen_def()
         def links_symbols_to_tokens(self, tokens):
             pass
+        def first(self, firsts):
+            self.nullable, self.first_set = False, frozenset([self.explicit_token.name])
+            return self.nullable, self.first_set
         def gen_code(self, indent, counters, pos):
             if self.ret is not None:
                 return indent + "%s = self.eat('%s') # %s"%(self.ret.gen_code(), self.explicit_token.name, self.expr)
@@ -1965,6 +4012,8 @@ class TPGParser(tpg.Parser):
             return "**%s"%self.name
 
     class And(list):
+        first_set = None
+        nullable = True
         def empty(self):
             for a in self:
                 if not a.empty():
@@ -1977,6 +4026,23 @@ class TPGParser(tpg.Parser):
         def links_symbols_to_tokens(self, tokens):
             for a in self:
                 a.links_symbols_to_tokens(tokens)
+        def left_factor(self):
+            self[:] = [a.left_factor() for a in self]
+            return self
+        def head(self):
+            # key of the first symbol or token of a sequence (None if it can not be factored)
+            if self and isinstance(self[0], (TPGParser.Symbol, TPGParser.InlineToken)):
+                return self[0].gen_code("", None, None)
+        def first(self, firsts):
+            nullable, first_set = True, frozenset()
+            for a in self:
+                a_nullable, a_first_set = a.first(firsts)
+                if nullable:
+                    if first_set is not None:
+                        first_set = TPGParser.union(first_set, a_first_set)
+                    nullable = a_nullable
+            self.nullable, self.first_set = nullable, first_set
+            return self.nullable, self.first_set
         def gen_code(self, indent, counters, pos):
             return self and [
                 self[0].gen_code(indent, counters, pos),
@@ -2002,7 +4068,36 @@ class TPGParser(tpg.Parser):
         def links_symbols_to_tokens(self, tokens):
             self.a.links_symbols_to_tokens(tokens)
             self.b.links_symbols_to_tokens(tokens)
+        def alternatives(self):
+            for x in (self.a, self.b):
+                if isinstance(x, TPGParser.Or):
+                    for y in x.alternatives():
+                        yield y
+                else:
+                    yield x
+        def left_factor(self):
+            return TPGParser.factor([a.left_factor() for a in self.alternatives()])
+        def first(self, firsts):
+            a_nullable, a_first_set = self.a.first(firsts)
+            b_nullable, b_first_set = self.b.first(firsts)
+            self.nullable = a_nullable or b_nullable
+            self.first_set = TPGParser.union(a_first_set, b_first_set)
+            return self.nullable, self.first_set
+        def predictable(self):
+            # the current token is enough to choose between a and b
+            # if both can not be empty and start with different tokens
+            for x in (self.a, self.b):
+                if x.first_set is None or x.nullable:
+                    return False
+            return not (self.a.first_set & self.b.first_set)
         def gen_code(self, indent, counters, pos):
+            if self.predictable():
+                return [
+                    indent + "if %s:"%TPGParser.gen_token_test(pos, self.a.first_set),
+                    self.a.gen_code(indent+tab, counters, pos),
+                    indent + "else:",
+                    self.b.gen_code(indent+tab, counters, pos),
+                ]
             p = pos or counters("p")
             return [
                 pos is None and indent + "%s = self.lexer.token()"%p or (),
@@ -2018,12 +4113,42 @@ class TPGParser(tpg.Parser):
                 doc = "(%s)"%doc
             return doc
 
-    def balance(self, xs):
+    def balance(xs):
         if len(xs) == 1:
             return xs[0]
         else:
             m = len(xs)//2
-            return self.Or(self.balance(xs[:m]), self.balance(xs[m:]))
+            return TPGParser.Or(TPGParser.balance(xs[:m]), TPGParser.balance(xs[m:]))
+    balance = staticmethod(balance)
+
+    def factor(alternatives):
+        """ left factoring of a list of alternatives
+
+        Consecutive alternatives starting with the same symbol or token
+        (with the same arguments and return value) share a single
+        parse of this prefix: A B | A C | D becomes A (B | C) | D.
+        """
+        groups = []
+        for a in alternatives:
+            head = isinstance(a, TPGParser.And) and a.head() or None
+            if head is not None and groups and groups[-1][0] == head:
+                groups[-1][1].append(a)
+            else:
+                groups.append((head, [a]))
+        factored = []
+        for head, group in groups:
+            if len(group) == 1:
+                factored.append(group[0])
+                continue
+            tails = []
+            for a in group:
+                tails.append(TPGParser.And(a[1:]))
+                if tails[-1].empty():
+                    # the next alternatives of the group can not be reached
+                    break
+            factored.append(TPGParser.And([group[0][0], TPGParser.factor(tails)]))
+        return TPGParser.balance(factored)
+    factor = staticmethod(factor)
 
     class Rep(NotEmpty):
         def __init__(self, a, min, max):
@@ -2035,10 +4160,28 @@ class TPGParser(tpg.Parser):
                 yield token
         def links_symbols_to_tokens(self, tokens):
             self.a.links_symbols_to_tokens(tokens)
+        def left_factor(self):
+            self.a = self.a.left_factor()
+            return self
+        def first(self, firsts):
+            a_nullable, a_first_set = self.a.first(firsts)
+            self.nullable, self.first_set = a_nullable or self.min != 1, a_first_set
+            return self.nullable, self.first_set
         def gen_code(self, indent, counters, pos):
+            # A is not tried when the current token can not start A
+            predictable = self.a.first_set is not None and not self.a.nullable
             # A?
             if (self.min, self.max) == (0, 1):
                 p = pos or counters("p")
+                if predictable:
+                    return [
+                        pos is None and indent + "%s = self.lexer.token()"%p or (),
+                        indent + "if %s:"%TPGParser.gen_token_test(p, self.a.first_set),
+                        indent + tab + "try:",
+                        self.a.gen_code(indent+tab+tab, counters, p),
+                        indent + tab + "except tpg.WrongToken:",
+                        indent + tab + tab + "self.lexer.back(%s)"%p,
+                    ]
                 return [
                     pos is None and indent + "%s = self.lexer.token()"%p or (),
                     indent + "try:",
@@ -2052,6 +4195,7 @@ class TPGParser(tpg.Parser):
                 return [
                     indent + "while True:",
                     indent + tab + "%s = self.lexer.token()"%p,
+                    predictable and indent + tab + "if %s: break"%TPGParser.gen_token_test(p, self.a.first_set, True) or (),
                     indent + tab + "try:",
                     self.a.gen_code(indent+tab+tab, counters, p),
                     indent + tab + "except tpg.WrongToken:",
@@ -2066,6 +4210,7 @@ class TPGParser(tpg.Parser):
                     indent + "%s = 0"%n,
                     indent + "while True:",
                     indent + tab + "%s = self.lexer.token()"%p,
+                    predictable and indent + tab + "if %s >= 1 and %s: break"%(n, TPGParser.gen_token_test(p, self.a.first_set, True)) or (),
                     indent + tab + "try:",
                     self.a.gen_code(indent+tab+tab, counters, p),
                     indent + tab + tab + "%s += 1"%n,
@@ -2084,6 +4229,7 @@ class TPGParser(tpg.Parser):
                     indent + "%s = 0"%n,
                     indent + "while %s:"%(max=="None" and "True" or "%s < %s"%(n, max)),
                     indent + tab + "%s = self.lexer.token()"%p,
+                    predictable and indent + tab + "if %s >= %s and %s: break"%(n, min, TPGParser.gen_token_test(p, self.a.first_set, True)) or (),
                     indent + tab + "try:",
                     self.a.gen_code(indent+tab+tab, counters, p),
                     indent + tab + tab + "%s += 1"%n,
@@ -2121,6 +4267,8 @@ class TPGParser(tpg.Parser):
             yield None
         def links_symbols_to_tokens(self, tokens):
             pass
+        def first(self, firsts):
+            return True, None
         def gen_doc(self, parent):
             return ""
         def gen_code(self, indent, counters, pos):
@@ -2134,6 +4282,8 @@ class TPGParser(tpg.Parser):
             yield None
         def links_symbols_to_tokens(self, tokens):
             pass
+        def first(self, firsts):
+            return True, None
         def gen_doc(self, parent):
             return ""
         def gen_code(self, indent, counters, pos):
@@ -2147,6 +4297,8 @@ class TPGParser(tpg.Parser):
             yield None
         def links_symbols_to_tokens(self, tokens):
             pass
+        def first(self, firsts):
+            return True, frozenset()
         def gen_doc(self, parent):
             return ""
         def gen_code(self, indent, counters, pos):
@@ -2156,6 +4308,145 @@ class TPGParser(tpg.Parser):
         def gen_code(self):
             return str(self)
 
+    def union(a, b):
+        """ union of two FIRST sets (None stands for an unknown set) """
+        if a is None or b is None:
+            return None
+        return a | b
+    union = staticmethod(union)
+
+    def gen_token_test(token, names, negate=False):
+        """ return a Python expression testing if the name of a token is in names
+
+        token is the variable containing the current token
+        (None to read it from the lexer).
+        """
+        token = token or "self.lexer.token()"
+        names = sorted(names)
+        if len(names) == 1:
+            return "%s.name %s '%s'"%(token, negate and "!=" or "==", names[0])
+        return "%s.name %s (%s)"%(token, negate and "not in" or "in", ", ".join([ "'%s'"%name for name in names ]))
+    gen_token_test = staticmethod(gen_token_test)
+
+    def first_sets(self, rules):
+        """ compute the FIRST sets of the rules and of their nodes
+
+        The FIRST set of a node is the set of the names of the tokens
+        that can start it or None if it can not be computed (check,
+        error and semantic actions before the first token). The nodes
+        also know if they can match an empty sequence (nullable).
+        """
+        defined = {}
+        firsts = {}
+        for rule in rules:
+            defined[rule.head.name] = rule
+            firsts[rule.head.name] = False, frozenset()
+        changed = True
+        while changed:
+            changed = False
+            for name, rule in defined.items():
+                first = rule.body.first(firsts)
+                if first != firsts[name]:
+                    firsts[name] = first
+                    changed = True
+        for rule in rules:
+            rule.body.first(firsts)
+
+    def backtracking_choices(self, rules):
+        """ count the choices of the rules that may read many tokens again
+
+        A choice A | B is not predictable when A and B can start with the
+        same token. If A starts with a rule that starts with another rule
+        or with a token and another rule (e.g. Decl | Expr ';' where
+        Decl -> Expr '=' Expr ';'), a whole phrase may be read before A
+        fails and read again to parse B.
+        Choices that fail after a token (e.g. ident '=' Expr | Expr)
+        are not counted.
+        """
+        defined = {}
+        for rule in rules:
+            defined[rule.head.name] = rule
+        def leading(node):
+            # elements of a sequence that read tokens
+            if isinstance(node, TPGParser.And):
+                return [a for a in node if not (a.nullable and not a.first_set)]
+            return [node]
+        def alternatives(node):
+            if isinstance(node, TPGParser.Or):
+                return list(node.alternatives())
+            return [node]
+        def is_rule(node):
+            return isinstance(node, TPGParser.Symbol) and node.token is None
+        def starts_with_rule(node):
+            for alternative in alternatives(node):
+                elements = leading(alternative)
+                if elements and (is_rule(elements[0]) or len(elements) > 1 and is_rule(elements[1])):
+                    return True
+            return False
+        def deep(a, b):
+            elements = leading(a)
+            if not elements or not is_rule(elements[0]) or elements[0].name not in defined:
+                return False
+            if elements[0].first_set is None or b.first_set is None or not elements[0].first_set & b.first_set:
+                return False
+            return starts_with_rule(defined[elements[0].name].body)
+        def choices(node):
+            if isinstance(node, TPGParser.Or):
+                n = choices(node.a) + choices(node.b)
+                if not node.predictable() and deep(node.a, node.b):
+                    n += 1
+                return n
+            if isinstance(node, TPGParser.Rep):
+                return choices(node.a)
+            if isinstance(node, TPGParser.And):
+                return sum([choices(a) for a in node])
+            return 0
+        return sum([choices(rule.body) for rule in rules])
+
+    auto_dispatch_tokens = 24
+
+    def auto_lexer(self, options, tokens, rules):
+        """ choose the lexer of a grammar with set lexer = auto
+
+        Return the lexer class and the reason of the choice.
+
+        Lexer only tries the tokens that can start with the current
+        character and is faster than NamedGroupLexer when there are many
+        tokens (auto_dispatch_tokens) but it returns the longest match
+        instead of the first one: it is chosen only if they are always
+        the same token. Cache lexers are chosen for incremental parsers
+        and when choices may read tokens again (backtracking_choices).
+        The stream and context sensitive lexers are never chosen.
+        """
+        reasons = ["%d token%s"%(len(tokens), len(tokens) != 1 and "s" or "")]
+        dispatch = False
+        if len(tokens) >= self.auto_dispatch_tokens:
+            try:
+                flags = options.lexer_flags()
+                regexps = []
+                for token in tokens:
+                    expr = ast.literal_eval(token.string_prefix+token.expr)
+                    if options.word_boundary and LexerOptions.word_re.match(expr):
+                        expr = r"\b%s\b"%expr
+                    regexps.append(re.compile(expr, flags))
+            except Exception:
+                regexps = None
+            dispatch = regexps is not None and first_match_is_longest(regexps)
+            if dispatch:
+                reasons.append("first matches are the longest")
+            else:
+                reasons.append("first matches may be shorter than the longest")
+        backtracking = self.backtracking_choices(rules)
+        if backtracking:
+            reasons.append("%d backtracking choice%s"%(backtracking, backtracking != 1 and "s" or ""))
+        if options.incremental:
+            reasons.append("incremental")
+        if backtracking or options.incremental:
+            lexer = dispatch and CacheLexer or CacheNamedGroupLexer
+        else:
+            lexer = dispatch and Lexer or NamedGroupLexer
+        return lexer, ", ".join(reasons)
+
     def flatten_nl(self, *lines):
         for sublines in lines:
             if isinstance(sublines, (list, tuple)):
@@ -2191,21 +4482,51 @@ class TPGParser(tpg.Parser):
                 token.set_explicit_token(self.DefToken("_tok_%s"%token_number, self.string_prefix, token.expr))
                 explicit_tokens[token.expr[1:-1]] = token.explicit_token
                 inline_tokens.append(token)
+            if token.ret is not None:
+                token.explicit_token.bound = True
+        # building the parser
+        tokens_from_name = {}
+        for token in inline_tokens:
+            tokens_from_name[token.explicit_token.name] = token
+        for token in tokens:
+            tokens_from_name[token.name] = token
+        rules.links_symbols_to_tokens(tokens_from_name)
+        if options.left_factoring:
+            rules.left_factor()
+        if lexer is not ContextSensitiveLexer:
+            self.first_sets(rules)
+        doc = ()
+        if lexer is None:
+            lexer, reason = self.auto_lexer(options, [tok.explicit_token for tok in inline_tokens] + tokens, rules)
+            doc = tab + 'r""" set lexer = auto: %s (%s) """'%(lexer.__name__, reason)
+        # named group lexers create lightweight tokens for the literal tokens never bound
+        unbound_tokens = [ tok.name for tok in [tok.explicit_token for tok in inline_tokens] + tokens
+                                    if tok.def_method == "def_token" and not tok.bound ]
         yield self.make_code("init_lexer",
             "def init_lexer(self):",
+            doc,
             lexer is ContextSensitiveLexer and [tab + "self.eat = self.eatCSL"] or (),
             tab + "lexer = tpg.%s(%s, %s)"%(lexer.__name__, word_bounded, lexer_options),
+            options.lazy_positions and [tab + "lexer.lazy_positions = True"] or (),
+            issubclass(lexer, NamedGroupLexer) and unbound_tokens and [tab + "lexer.unbound_tokens = %r"%(tuple(unbound_tokens),)] or (),
             [ tab + tok.gen_def() for tok in inline_tokens ],
             [ tab + tok.gen_def() for tok in tokens ],
             tab + "return lexer",
         )
-        # building the parser
-        tokens_from_name = {}
-        for token in inline_tokens:
-            tokens_from_name[token.explicit_token.name] = token
-        for token in tokens:
-            tokens_from_name[token.name] = token
-        rules.links_symbols_to_tokens(tokens_from_name)
-        for name, code in rules.gen_code():
-            yield self.make_code(name, *code)
+        if options.lazy_positions and (lexer is StreamNamedGroupLexer or options.incremental):
+            raise SemanticError("Lazy positions are not available with StreamNamedGroupLexer and incremental parsers")
+        if options.incremental:
+            if lexer not in (CacheNamedGroupLexer, CacheLexer):
+                raise SemanticError("Incremental parsers require a cache lexer (CacheNamedGroupLexer or CacheLexer)")
+            yield self.make_code("incremental", "incremental = True")
+        if options.memoize or options.incremental:
+            yield self.make_code("memoize", "memoize = True")
+            for rule in rules:
+                rule.memoize = True
+        if options.lazy:
+            for rule in rules:
+                yield rule.head.name, None, LazyRule(self, rule)
+        else:
+            for name, code in rules.gen_code():
+                yield self.make_code(name, *code)
 
@@ -1,8 +1,16 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import io
+import itertools
+import mmap
+import multiprocessing
+import os
 import re
+import shutil
 import sys
+import tempfile
+import threading
 import unittest
 
 import tpg
@@ -828,6 +836,1330 @@ for PARSER, VERBOSE in ( (tpg.Parser, None),
                 self.assertRaises(tpg.SyntacticError, self.NOK3)
                 self.assertRaises(tpg.SyntacticError, self.NOK4)
 
+        class GrammarCacheTestCase(unittest.TestCase):
+
+            grammar = r"""
+                set lexer = %(LEXER)s
+
+                separator spaces '\s+' ;
+
+                token int '\d+' $ int
+
+                START/lst ->            $ lst = []
+                    (   int/i           $ lst.append(i)
+                    )*
+                    ;
+            """%tpg.Py()
+
+            def setUp(self):
+                self.directory = tempfile.mkdtemp()
+                self.dont_write_bytecode = sys.dont_write_bytecode
+                sys.dont_write_bytecode = False
+
+            def tearDown(self):
+                sys.dont_write_bytecode = self.dont_write_bytecode
+                shutil.rmtree(self.directory)
+
+            def make_parser(self, grammar):
+                class Parser(PARSER):
+                    __doc__ = grammar
+                    grammar_cache = self.directory
+                    verbose = VERBOSE
+                return Parser
+
+            def testCache(self):
+                Parser = self.make_parser(self.grammar)
+                self.assertEqual(len(os.listdir(self.directory)), 1)
+                self.assertTrue(tpg.grammar_cache(Parser, globals(), self.grammar).load() is not None)
+                Parser = self.make_parser(self.grammar)
+                self.assertEqual(Parser()('1 2 3'), [1, 2, 3])
+                self.assertEqual(Parser().parse('START', '4'), [4])
+
+            def testOutdatedCache(self):
+                self.make_parser(self.grammar)
+                grammar = self.grammar.replace('lst.append(i)', 'lst.append(-i)')
+                self.assertTrue(tpg.grammar_cache(self.make_parser(self.grammar), globals(), grammar).load() is None)
+                Parser = self.make_parser(grammar)
+                self.assertEqual(Parser()('1 2 3'), [-1, -2, -3])
+                self.assertEqual(len(os.listdir(self.directory)), 1)
+
+            def testNoCache(self):
+                Parser = self.make_parser(self.grammar)
+                Parser.grammar_cache = False
+                self.assertTrue(tpg.grammar_cache(Parser, globals(), self.grammar) is None)
+
+            def testDefault(self):
+                environ = os.environ.pop('TPG_GRAMMAR_CACHE', None)
+                try:
+                    Parser = self.make_parser(self.grammar)
+                    Parser.grammar_cache = None
+                    # disabled unless the environment variable is set
+                    self.assertTrue(tpg.grammar_cache(Parser, globals(), self.grammar) is None)
+                    os.environ['TPG_GRAMMAR_CACHE'] = self.directory
+                    cache = tpg.grammar_cache(Parser, globals(), self.grammar)
+                    self.assertEqual(os.path.dirname(cache.path), self.directory)
+                    Parser.grammar_cache = False
+                    self.assertTrue(tpg.grammar_cache(Parser, globals(), self.grammar) is None)
+                finally:
+                    if environ is None:
+                        os.environ.pop('TPG_GRAMMAR_CACHE', None)
+                    else:
+                        os.environ['TPG_GRAMMAR_CACHE'] = environ
+
+            def testGeneratorChanged(self):
+                Parser = self.make_parser(self.grammar)
+                generator = tpg.generator_hash()
+                try:
+                    tpg.generator_source_hash = "another generator"
+                    self.assertTrue(tpg.grammar_cache(Parser, globals(), self.grammar).load() is None)
+                finally:
+                    tpg.generator_source_hash = generator
+                self.assertTrue(tpg.grammar_cache(Parser, globals(), self.grammar).load() is not None)
+
+        class LazyTestCase(unittest.TestCase):
+
+            grammar = r"""
+                set lexer = %(LEXER)s
+                set lazy = True
+
+                separator spaces '\s+' ;
+
+                token int '\d+' $ int
+
+                START/lst ->            $ lst = []
+                    (   Int/i           $ lst.append(i)
+                    )*
+                    ;
+
+                Int/i -> int/i ;
+
+                Neg/$-i$ -> '-' int/i ;
+            """%tpg.Py()
+
+            def make_parser(self):
+                class Parser(PARSER):
+                    __doc__ = self.grammar
+                    grammar_cache = False
+                    verbose = VERBOSE
+                return Parser
+
+            def testLazy(self):
+                Parser = self.make_parser()
+                for rule in ('START', 'Int', 'Neg'):
+                    self.assertTrue(isinstance(Parser.__dict__[rule], tpg.LazyRule))
+                self.assertEqual(Parser()('1 2 3'), [1, 2, 3])
+                self.assertFalse(isinstance(Parser.__dict__['START'], tpg.LazyRule))
+                self.assertFalse(isinstance(Parser.__dict__['Int'], tpg.LazyRule))
+                self.assertTrue(isinstance(Parser.__dict__['Neg'], tpg.LazyRule))
+                self.assertEqual(Parser().parse('Neg', '- 4'), -4)
+
+            def testCompileRules(self):
+                Parser = self.make_parser()
+                Parser.compile_rules()
+                for rule in ('START', 'Int', 'Neg'):
+                    self.assertFalse(isinstance(Parser.__dict__[rule], tpg.LazyRule))
+                self.assertEqual(Parser().parse('Neg', '- 4'), -4)
+
+            def testCache(self):
+                directory = tempfile.mkdtemp()
+                dont_write_bytecode, sys.dont_write_bytecode = sys.dont_write_bytecode, False
+                try:
+                    def make_parser():
+                        class Parser(PARSER):
+                            __doc__ = self.grammar
+                            grammar_cache = directory
+                            verbose = VERBOSE
+                        return Parser
+                    Parser = make_parser()
+                    rule = Parser.__dict__['START']
+                    self.assertEqual(Parser()('1 2 3'), [1, 2, 3])
+                    self.assertEqual((rule.parser, rule.rule), (None, None))
+                    Parser = make_parser()
+                    self.assertFalse(isinstance(Parser.__dict__['START'], tpg.LazyRule))
+                    self.assertFalse(isinstance(Parser.__dict__['Int'], tpg.LazyRule))
+                    self.assertTrue(isinstance(Parser.__dict__['Neg'], tpg.LazyRule))
+                    self.assertEqual(Parser()('1 2 3'), [1, 2, 3])
+                    self.assertEqual(Parser().parse('Neg', '- 4'), -4)
+                    Parser = make_parser()
+                    for rule in ('START', 'Int', 'Neg'):
+                        self.assertFalse(isinstance(Parser.__dict__[rule], tpg.LazyRule))
+                    self.assertEqual(Parser().parse('Neg', '- 4'), -4)
+                finally:
+                    sys.dont_write_bytecode = dont_write_bytecode
+                    shutil.rmtree(directory)
+
+        class MemoizeTestCase(unittest.TestCase):
+
+            class Parser(PARSER):
+                __doc__ = r"""
+                    set lexer = %(LEXER)s
+                    set memoize = True
+                    set left_factoring = False
+
+                    separator spaces '\s+' ;
+
+                    token int '\d+' $ int
+
+                    START/n -> Expr/n ;
+
+                    Expr/n ->
+                            Term/n '-' Expr/m       $ n = n - m
+                        |   Term/n '\+' Expr/m      $ n = n + m
+                        |   Term/n
+                        ;
+
+                    Term/n -> int/n                 $ self.calls += 1
+                        ;
+                """%tpg.Py()
+                verbose = VERBOSE
+                calls = 0
+
+            def testMemoize(self):
+                p = self.Parser()
+                self.assertEqual(p('1 + 2 - 3 + 4'), 1 + (2 - (3 + 4)))
+                self.assertEqual(p.calls, 4)
+                self.assertEqual(p.memo.misses, 9)
+                self.assertEqual(p.memo.hits, 4)
+
+            class RepeatParser(PARSER):
+                __doc__ = r"""
+                    set lexer = %(LEXER)s
+                    set memoize = True
+
+                    separator spaces '\s+' ;
+
+                    START/n -> $ n = 0 $ ( R $ n += 1 $ )* ;
+
+                    R -> $ pass $ 'a' ;
+                """%tpg.Py()
+                verbose = VERBOSE
+
+            def testEOF(self):
+                # R is retried at EOF, after its call on the last token
+                p = self.RepeatParser()
+                self.assertEqual(p(''), 0)
+                self.assertEqual(p('a'), 1)
+                self.assertEqual(p('a a a '), 3)
+                self.assertRaises(tpg.Error, p, 'a a b')
+
+            def testMemoSize(self):
+                p = self.Parser()
+                p.memo_size = 2
+                self.assertEqual(p('1 + 2 - 3 + 4'), 1 + (2 - (3 + 4)))
+                self.assertTrue(len(p.memo.table) <= 2)
+
+            def testSyntaxError(self):
+                p = self.Parser()
+                self.assertRaises(tpg.SyntacticError, p, '1 + 2 -')
+                self.assertRaises(tpg.SyntacticError, p, '1 2')
+
+        class PredictionTestCase(unittest.TestCase):
+
+            class Parser(PARSER):
+                __doc__ = r"""
+                    set lexer = %(LEXER)s
+
+                    separator spaces '\s+' ;
+
+                    token int '\d+' $ int
+                    token ident '\w+' ;
+
+                    START/l -> $ l = []
+                        ( Literal/x $ l.append(x)
+                        )* ;
+
+                    Literal/x ->
+                            '\[' $ x = []
+                                ( Literal/y $ x.append(y)
+                                )*
+                            '\]'
+                        |   int/x
+                        |   Var/x
+                        |   '"' ident/x '"' $ x = '"%%s"'%%x
+                        ;
+
+                    Var/x -> ident/x check $ x != 'stop' $ ;
+                """%tpg.Py()
+                verbose = VERBOSE
+
+            def testPrediction(self):
+                p = self.Parser()
+                self.assertEqual(p(''), [])
+                self.assertEqual(p('1 a "b" [2 [c]]'), [1, 'a', '"b"', [2, ['c']]])
+
+            def testFallback(self):
+                p = self.Parser()
+                self.assertEqual(p('a b'), ['a', 'b'])
+                self.assertRaises(tpg.SyntacticError, p, 'a stop')
+                self.assertRaises(tpg.SyntacticError, p, '[1')
+                self.assertRaises(tpg.SyntacticError, p, '"a')
+
+        class LeftFactoringTestCase(unittest.TestCase):
+
+            class Parser(PARSER):
+                __doc__ = r"""
+                    set lexer = %(LEXER)s
+                    set left_factoring = True
+
+                    separator spaces '\s+' ;
+
+                    token int '\d+' $ int
+
+                    START/l -> Array/l ;
+
+                    Array/a ->
+                            '\[' $ a = []
+                            Item/x $ a.append(x)
+                            ( ',' Item/x $ a.append(x)
+                            )*
+                            '\]'
+                        |   '\[' '\]' $ a = []
+                        ;
+
+                    Item/x ->
+                            Int/x '\+' Int/y $ x = ('+', x, y)
+                        |   Int/x '\-' Int/y $ x = ('-', x, y)
+                        |   Int/x
+                        |   Int/x '\*' Int/y $ x = ('*', x, y)
+                        |   Array/x
+                        ;
+
+                    Int/x -> int/x $ self.calls += 1
+                        ;
+                """%tpg.Py()
+                verbose = VERBOSE
+                calls = 0
+
+            def notFactored(self):
+                class NotFactored(self.Parser):
+                    __doc__ = self.Parser.__doc__.replace("set left_factoring = True", "set left_factoring = False")
+                return NotFactored
+
+            def testLeftFactoring(self):
+                for parser in (self.Parser, self.notFactored()):
+                    p = parser()
+                    self.assertEqual(p('[]'), [])
+                    self.assertEqual(p('[1, 2 + 3, [4 - 5]]'), [1, ('+', 2, 3), [('-', 4, 5)]])
+                    self.assertRaises(tpg.SyntacticError, p, '[1 * 2]')
+                    self.assertRaises(tpg.SyntacticError, p, '[1,]')
+                p = self.Parser()
+                p('[1, 2, 3]')
+                self.assertEqual(p.calls, 3)
+                p = self.notFactored()()
+                p('[1, 2, 3]')
+                self.assertEqual(p.calls, 9)
+
+            def testDoc(self):
+                self.assertEqual(self.Parser.Item.__doc__, self.notFactored().Item.__doc__)
+
+            def testDefault(self):
+                class Parser(self.Parser):
+                    __doc__ = self.Parser.__doc__.replace("set left_factoring = True", "")
+                p = Parser()
+                p('[1, 2, 3]')
+                self.assertEqual(p.calls, 9)
+
+        class StreamTestCase(unittest.TestCase):
+
+            class Parser(PARSER):
+                __doc__ = r"""
+                    set lexer = %(LEXER)s
+
+                    separator spaces '\s+' ;
+
+                    token word '\w+' ;
+
+                    START/l -> $ l = []
+                        (   word/w $ l.append(w)
+                                   $ self.size = max(self.size, len(self.lexer.input))
+                        )*
+                        ;
+                """%tpg.Py()
+                verbose = VERBOSE
+                size = 0
+
+            def setUp(self):
+                self.p = self.Parser()
+                if self.p.lexer.streaming:
+                    self.p.lexer.window = 4
+
+            def testChunks(self):
+                words = ["w%d"%i for i in range(100)] + ["abcdefghijklmnopqrstuvwxyz"]
+                text = " ".join(words)
+                self.assertEqual(self.p(io.StringIO(u(text))), words)
+                self.assertEqual(self.p(iter([text])), words)
+                self.p.size = 0
+                self.assertEqual(self.p([text[i:i+3] for i in range(0, len(text), 3)]), words)
+                if self.p.lexer.streaming:
+                    self.assertTrue(self.p.size < 64)
+
+            def testBytes(self):
+                if tpg.__python__ == 2:
+                    # bytes are str on Python 2, they are not decoded
+                    return
+                self.assertEqual(self.p([b'a\xc3', b'\xa9 b']), [u('a\xe9'), 'b'])
+                self.assertEqual(self.p(io.BytesIO(b'a\xc3\xa9 b')), [u('a\xe9'), 'b'])
+
+            def testMmap(self):
+                f = tempfile.TemporaryFile()
+                try:
+                    f.write(b"a b c")
+                    f.flush()
+                    m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                    try:
+                        self.assertEqual(self.p(m), ['a', 'b', 'c'])
+                    finally:
+                        m.close()
+                finally:
+                    f.close()
+
+            def testSyntaxError(self):
+                if LEXER in ('ContextSensitiveLexer',):
+                    self.assertRaises(tpg.SyntacticError, self.p, ["a b", " c !"])
+                else:
+                    self.assertRaises(tpg.LexicalError, self.p, ["a b", " c !"])
+
+        class IncrementalTestCase(unittest.TestCase):
+
+            class Parser(PARSER):
+                __doc__ = r"""
+                    set lexer = %(LEXER)s
+                    set incremental = True
+
+                    separator spaces '\s+' ;
+
+                    token int '\d+' $ int
+                    token ident '\w+' ;
+
+                    START/l -> $ l = []
+                        ( Stmt/s $ l.append(s)
+                        )* ;
+
+                    Stmt/$(x, e)$ -> ident/x '=' Expr/e ';' $ self.calls += 1
+                        ;
+
+                    Expr/e ->
+                            Atom/e
+                            ( '\+' Atom/a $ e = ('+', e, a)
+                            )*
+                        ;
+
+                    Atom/a -> int/a | ident/a | '\(' Expr/a '\)' ;
+                """%{'LEXER': LEXER.startswith('Cache') and LEXER or 'CacheNamedGroupLexer'}
+                verbose = VERBOSE
+                calls = 0
+
+            def tokens(self, p):
+                return [ (t.name, t.text, t.start, t.stop, t.prev_stop, t.line, t.column, t.end_line, t.end_column, t.index)
+                         for t in p.lexer.cache ]
+
+            def check(self, text, start, stop, new):
+                p = self.Parser()
+                p(text)
+                calls = p.calls
+                p.calls = 0
+                text = text[:start] + new + text[stop:]
+                q = self.Parser()
+                self.assertEqual(p.reparse(start, stop, new), q(text))
+                self.assertEqual(self.tokens(p), self.tokens(q))
+                self.assertEqual(p.lexer.input, text)
+                return p.calls, calls
+
+            def testReparse(self):
+                text = "a = 1;\nb = a + 2;\nc = (a + b) + 3; d = 4;\ne = d;\n"
+                calls, total = self.check(text, 32, 33, "30 + x")
+                self.assertEqual((calls, total), (1, 5))
+                self.check(text, 0, 1, "xyz")
+                self.check(text, 0, 0, "z = 0;\n")
+                self.check(text, len(text), len(text), "f = 5;")
+                self.check(text, 4, 5, "42")
+                self.check(text, 4, 4, "1")
+                self.check(text, 6, 7, "")
+                self.check(text, 15, 32, "")
+                self.check(text, 0, len(text), "z = 0;")
+
+            def testSuccessiveEdits(self):
+                p = self.Parser()
+                text = "a = 1; b = 2; c = 3;"
+                p(text)
+                for start, stop, new in [(4, 5, "10"), (12, 13, "(1 + 2)"), (0, 7, ""), (0, 0, "\n\nx = y;")]:
+                    text = text[:start] + new + text[stop:]
+                    q = self.Parser()
+                    self.assertEqual(p.reparse(start, stop, new), q(text))
+                    self.assertEqual(self.tokens(p), self.tokens(q))
+
+            def testEmptyInput(self):
+                self.check("", 0, 0, "a = 1; b = a;")
+                p = self.Parser()
+                p("c = 1;")
+                self.assertEqual(p.reparse(0, 6, ""), [])
+                self.assertEqual(p.reparse(0, 0, "x = 1;"), [('x', 1)])
+                self.assertEqual(p.reparse(0, 6, ""), [])
+                self.assertEqual(p.reparse(0, 0, "y = 2;"), [('y', 2)])
+
+            def error(self, parse, *args):
+                try:
+                    parse(*args)
+                except tpg.SyntacticError:
+                    return tpg.exc().line, tpg.exc().column, tpg.exc().msg
+                self.fail("no syntax error")
+
+            def testSyntaxError(self):
+                p = self.Parser()
+                p("a = 1; b = 2;")
+                self.assertEqual(self.error(p.reparse, 5, 6, ""), self.error(self.Parser(), "a = 1 b = 2;"))
+                self.assertEqual(p.reparse(5, 5, ";"), [('a', 1), ('b', 2)])
+                p("a = 1; b = (2 + c) + 3; d = e;")
+                self.assertEqual(self.error(p.reparse, 29, 30, " +"), self.error(self.Parser(), "a = 1; b = (2 + c) + 3; d = e +"))
+                self.assertEqual(self.error(p.reparse, 0, 0, "x"), self.error(self.Parser(), "xa = 1; b = (2 + c) + 3; d = e +"))
+
+            def testLexicalError(self):
+                p = self.Parser()
+                p("a = 1; b = 2;")
+                tokens = self.tokens(p)
+                self.assertRaises(tpg.LexicalError, p.reparse, 4, 5, "1 ! 2")
+                self.assertEqual(p.lexer.input, "a = 1; b = 2;")
+                self.assertEqual(self.tokens(p), tokens)
+                self.assertEqual(p.reparse(4, 5, "10"), [('a', 10), ('b', 2)])
+
+            def testNotIncremental(self):
+                class NotIncremental(PARSER):
+                    __doc__ = r"""
+                        START -> 'x' ;
+                    """
+                p = NotIncremental()
+                p('x')
+                self.assertRaises(tpg.SemanticError, p.reparse, 0, 1, 'x')
+                if LEXER in ('NamedGroupLexer', 'Lexer'):
+                    def parser():
+                        class CacheRequired(PARSER):
+                            __doc__ = r"""
+                                set lexer = %s
+                                set incremental = True
+                                START -> 'x' ;
+                            """%LEXER
+                    self.assertRaises(tpg.SemanticError, parser)
+
+        class TokenStorageTestCase(unittest.TestCase):
+
+            grammar = r"""
+                set lexer = %s
+
+                separator spaces '\s+' ;
+
+                token int '\d+' $ int
+                token nl '\n\w*' ;
+                token ident '\w+' ;
+                token op '[+-]' $ 'op'
+
+                START/l -> $ l = []
+                    ( @t ( int | nl | ident | op ) $ l.append(t)
+                    )* ;
+            """
+
+            def parser(self, lexer):
+                class Parser(PARSER):
+                    __doc__ = self.grammar%lexer
+                    verbose = VERBOSE
+                return Parser()
+
+            def tokens(self, lexer, text):
+                return [ (t.name, t.text, t.value, t.line, t.column, t.end_line, t.end_column, t.start, t.stop, t.prev_stop)
+                         for t in self.parser(lexer)(text) ]
+
+            def testSlots(self):
+                p = self.parser(LEXER)
+                for t in p('a 1\nb') + [tpg.EOFToken(1, 1, 0, 0), tpg.SOFToken()]:
+                    self.assertFalse(hasattr(t, '__dict__'))
+
+            def testCompactCache(self):
+                text = "a + 12\n  - b\nc 3 +"
+                self.assertEqual(self.tokens('CompactCacheNamedGroupLexer', text), self.tokens('CacheNamedGroupLexer', text))
+
+        class LazyPositionsTestCase(unittest.TestCase):
+
+            grammar = r"""
+                set lexer = %(LEXER)s
+                set lazy_positions = %(LAZY)s
+
+                separator spaces '\s+' ;
+
+                token int '\d+' $ int
+                token nl '\n\w*' ;
+                token ident '\w+' ;
+
+                START/l -> $ l = []
+                    ( @t ( int | nl | ident ) $ l.append(t)
+                    )*
+                    @t $ l.append(t)
+                    ;
+            """
+
+            def parser(self, lazy):
+                class Parser(PARSER):
+                    __doc__ = self.grammar%{'LEXER': LEXER, 'LAZY': lazy}
+                    verbose = VERBOSE
+                return Parser()
+
+            def error(self, p, text):
+                try:
+                    p(text)
+                except tpg.Error:
+                    return str(tpg.exc())
+
+            def testLazyPositions(self):
+                if LEXER in ('StreamNamedGroupLexer',):
+                    self.assertRaises(tpg.SemanticError, self.parser, True)
+                    return
+                text = "a 12\n  b\nc\n\n 3 x  \n"
+                lazy, eager = self.parser(True), self.parser(False)
+                lazy_tokens, eager_tokens = lazy(text), eager(text)
+                for t in lazy_tokens:
+                    if t.name not in ('SOF', 'EOF'):
+                        self.assertTrue(isinstance(t, tpg.LazyToken))
+                self.assertEqual(
+                    [ (t.name, t.text, t.value, t.line, t.column, t.end_line, t.end_column, t.start, t.stop, t.prev_stop) for t in lazy_tokens ],
+                    [ (t.name, t.text, t.value, t.line, t.column, t.end_line, t.end_column, t.start, t.stop, t.prev_stop) for t in eager_tokens ])
+                for text in ("a\n  b !", "a\n 1 \n ;"):
+                    self.assertEqual(self.error(lazy, text), self.error(eager, text))
+
+            def testNoLineIndex(self):
+                if LEXER in ('StreamNamedGroupLexer',):
+                    return
+                p = self.parser(True)
+                tokens = p("a 12\n  b\nc\n")
+                if not VERBOSE:
+                    # verbose parsers print the positions of the tokens
+                    self.assertEqual(p.lexer.lines.starts, None)
+                if LEXER not in ('ContextSensitiveLexer',):
+                    self.assertTrue(isinstance(tokens[-1], tpg.EOFToken))
+                    self.assertEqual((tokens[-1].line, tokens[-1].column), (4, 1))
+
+        class SeparatorTestCase(unittest.TestCase):
+
+            class Parser(PARSER):
+                __doc__ = r"""
+                    set lexer = %(LEXER)s
+                    set lexer_unicode = True
+
+                    separator spaces '\s+' ;
+                    separator comment '\#.*' ;
+
+                    token int '\d+' $ int
+                    token ident '\w+' ;
+                    token op '[-+*/=();]' ;
+
+                    START/l -> $ l = []
+                        ( @t ( int | ident | op ) $ l.append(t)
+                        )*
+                        ;
+                """%tpg.Py()
+                verbose = VERBOSE
+
+            class Overlap(PARSER):
+                __doc__ = r"""
+                    set lexer = %(LEXER)s
+
+                    token nl '\n' ;
+                    separator spaces '\s+' ;
+
+                    token ident '\w+' ;
+
+                    START/l -> $ l = []
+                        ( ident/x $ l.append(x)
+                        | nl $ l.append('nl')
+                        )*
+                        ;
+                """%tpg.Py()
+                verbose = VERBOSE
+
+            def positions(self, tokens):
+                return [ (t.name, t.text, t.line, t.column, t.end_line, t.end_column, t.start, t.stop, t.prev_stop) for t in tokens ]
+
+            def testSkip(self):
+                if tpg.__python__ == 2 and VERBOSE:
+                    # the trace of non ascii tokens can not be written to sys.stderr on Python 2
+                    return
+                text = u("x = 1 # one\n\n  y=(x+2) ;\t# two\n\n\xa0z\n")
+                fast, slow = self.Parser(), self.Parser()
+                slow.lexer.separator_re = None
+                tokens = fast(text)
+                self.assertEqual(self.positions(tokens), self.positions(slow(text)))
+                if LEXER in ('NamedGroupLexer', 'CacheNamedGroupLexer', 'CompactCacheNamedGroupLexer'):
+                    self.assertTrue(fast.lexer.separator_re is not None)
+                    self.assertTrue(fast.lexer.separator_re.match(u("\xa0")) is None)
+                    self.assertEqual(fast.lexer.separator_re.match(u(" \t# x\n  y")).end(), 8)
+
+            def testOverlap(self):
+                if LEXER in ('NamedGroupLexer', 'CacheNamedGroupLexer', 'CompactCacheNamedGroupLexer', 'StreamNamedGroupLexer'):
+                    # nl is defined before spaces and has precedence
+                    p = self.Overlap()
+                    self.assertEqual(p("a\n b \n"), ['a', 'nl', 'b'])
+                    self.assertTrue(p.lexer.separator_re is None)
+
+        class TokenValueTestCase(unittest.TestCase):
+
+            class Parser(PARSER):
+                __doc__ = r"""
+                    set lexer = %(LEXER)s
+
+                    separator spaces '\s+' ;
+                    separator comment '\#.*' $ str.upper
+
+                    token yes 'yes' $ True
+                    token no 'no' $ None
+                    token int '\d+' $ int
+                    token ident '\w+' ;
+
+                    START/l -> $ l = []
+                        ( ( yes/x | no/x | int/x | ident/x ) $ l.append(x)
+                        )*
+                        ;
+                """%tpg.Py()
+                verbose = VERBOSE
+
+            def testValues(self):
+                p = self.Parser()
+                self.assertEqual(p("yes # comment\nno 12 abc"), [True, None, 12, 'abc'])
+                token = p.lexer.last_token
+                self.assertEqual(token.name, 'ident')
+                self.assertTrue(token.value is token.text)
+
+            def testSeparatorHook(self):
+                # separator values are computed only for separator_hook
+                separators = []
+                p = self.Parser()
+                p.lexer.separator_hook = lambda name, text, value: separators.append((name, value))
+                p("yes # x\n1")
+                expected = [('spaces', ' '), ('comment', '# X'), ('spaces', '\n')]
+                if LEXER in ('ContextSensitiveLexer',):
+                    # separators are scanned again when the parser backtracks
+                    self.assertEqual(set(separators), set(expected))
+                else:
+                    self.assertEqual(separators, expected)
+
+        class TokenizeTestCase(unittest.TestCase):
+
+            class Parser(PARSER):
+                __doc__ = r"""
+                    set lexer = %(LEXER)s
+
+                    separator spaces '\s+' ;
+                    separator comment '\#.*' ;
+
+                    token int '\d+' $ int
+                    token ident '\w+' ;
+                    token op '[-+*/=;()]' ;
+
+                    START -> ( int | ident | op )* ;
+                """%tpg.Py()
+                verbose = VERBOSE
+
+            def tokens(self, tokens):
+                return [ (t.name, t.text, t.value, t.line, t.column, t.end_line, t.end_column, t.start, t.stop, t.prev_stop) for t in tokens ]
+
+            def testTokenize(self):
+                text = "x = (y + 12) # comment\n\n  * z;\n"
+                p = self.Parser()
+                if LEXER in ('ContextSensitiveLexer',):
+                    self.assertRaises(tpg.SemanticError, tpg.tokenize_all, p, text)
+                    return
+                tokens = self.tokens(tpg.tokenize(p, text))
+                self.assertEqual([ t[2] for t in tokens ], ['x', '=', '(', 'y', '+', 12, ')', '*', 'z', ';'])
+                self.assertEqual(tokens[7], ('op', '*', '*', 3, 3, 3, 4, 26, 27, 12))
+                self.assertEqual(self.tokens(tpg.tokenize_all(p, text)), tokens)
+                self.assertEqual(self.tokens(tpg.tokenize_all(p.lexer, [text[:10], text[10:]])), tokens)
+                self.assertEqual(p(text), None)
+
+            def testLexerState(self):
+                if LEXER in ('ContextSensitiveLexer',):
+                    return
+                p = self.Parser()
+                p.lexer.start("a b")
+                token = p.lexer.token()
+                # only the copies of the lexer are built again
+                p.lexer.max_groups = 1
+                token_re = getattr(p.lexer, "token_re", None)
+                for tokenize in (tpg.tokenize, tpg.tokenize_all):
+                    self.assertEqual(len(list(tokenize(p, "x = 1;"))), 4)
+                    self.assertEqual(len(list(tokenize(p.lexer, "x = 1;"))), 4)
+                    self.assertEqual((p.lexer.input, p.lexer.pos, p.lexer.token()), ("a b", token.stop, token))
+                    self.assertTrue(getattr(p.lexer, "token_re", None) is token_re)
+                self.assertEqual(p.lexer.next_token().text, 'b')
+
+            def testLexicalError(self):
+                if LEXER in ('ContextSensitiveLexer',):
+                    return
+                p = self.Parser()
+                for tokenize in (tpg.tokenize, tpg.tokenize_all):
+                    try:
+                        list(tokenize(p, "x = 1\n  y ! z"))
+                        self.fail()
+                    except tpg.LexicalError:
+                        self.assertEqual(tpg.exc().line, 2)
+                        self.assertEqual(tpg.exc().column, 5)
+
+        class ParseManyTestCase(unittest.TestCase):
+
+            class Parser(PARSER):
+                __doc__ = r"""
+                    set lexer = %(LEXER)s
+
+                    separator spaces '\s+' ;
+
+                    token int '\d+' $ int
+
+                    START/l -> $ l = []
+                        ( int/x $ l.append(x)
+                        )*
+                        ;
+
+                    SUM/s -> $ s = 0
+                        ( int/x $ s += x
+                        )*
+                        ;
+                """%tpg.Py()
+                verbose = VERBOSE
+
+            inputs = ["1 2", "", "3 x", "4 5 6", "7 8 9 10"]
+
+            def check(self, results):
+                self.assertEqual([ (index, value) for index, value, error in results ],
+                                 [ (0, [1, 2]), (1, []), (2, None), (3, [4, 5, 6]), (4, [7, 8, 9, 10]) ])
+                error = results[2][2]
+                self.assertTrue(isinstance(error, tpg.Error))
+                self.assertEqual(str(error), str(self.error("3 x")))
+
+            def error(self, input):
+                try:
+                    self.Parser()(input)
+                except tpg.Error:
+                    return tpg.exc()
+
+            def testSerial(self):
+                self.check(list(tpg.parse_many(self.Parser, self.inputs, workers=0, batch_size=2)))
+                self.assertEqual([ value for _, value, _ in tpg.parse_many(self.Parser, ["1 2", "3"], workers=0, axiom="SUM") ], [3, 3])
+                results = tpg.parse_many(self.Parser, itertools.repeat("1"), workers=0)
+                self.assertEqual(list(itertools.islice(results, 20))[-1], (19, [1], None))
+
+            def testProcesses(self):
+                if tpg.futures is None or VERBOSE is not None:
+                    return
+                # the parser class of the test loop can only be used by forked workers
+                if not hasattr(multiprocessing, 'get_start_method') or multiprocessing.get_start_method() != 'fork':
+                    return
+                self.check(list(tpg.parse_many(self.Parser, self.inputs, workers=2, batch_size=2)))
+                self.check(sorted(tpg.parse_many(self.Parser, self.inputs, workers=2, batch_size=2, ordered=False), key=lambda result: result[0]))
+                for ordered in (True, False):
+                    results = tpg.parse_many(self.Parser, itertools.repeat("1"), workers=2, batch_size=2, ordered=ordered)
+                    self.assertEqual(sorted(itertools.islice(results, 20))[-1][1:], ([1], None))
+                    results.close()
+
+        class ReentrantTestCase(unittest.TestCase):
+
+            class Parser(PARSER):
+                __doc__ = r"""
+                    set lexer = %(LEXER)s
+
+                    separator spaces '\s+' ;
+
+                    token int '\d+' $ int
+                    token nested '\[[^\]]*\]' ;
+
+                    START/l -> $ l = []
+                        ( int/x $ l.append(x)
+                        | nested/x $ l.append(self.parse('START', x[1:-1]))
+                        )*
+                        ;
+                """%tpg.Py()
+                verbose = VERBOSE
+
+            def testRecursive(self):
+                p = self.Parser()
+                self.assertEqual(p("1 [2 3] 4 [] 5"), [1, [2, 3], 4, [], 5])
+                # the lexer of the last parse (the outer parse) is kept
+                self.assertEqual(p.lexer.input, "1 [2 3] 4 [] 5")
+
+            def testThreads(self):
+                p = self.Parser()
+                errors = []
+                def work(n):
+                    try:
+                        for i in range(20):
+                            numbers = list(range(n, n+20*(i%7)))
+                            text = " ".join([str(x) for x in numbers])
+                            self.assertEqual(p(text + " [%d]"%i), numbers + [[i]])
+                    except Exception:
+                        errors.append(tpg.exc())
+                threads = [threading.Thread(target=work, args=(100*n,)) for n in range(8)]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+                self.assertEqual(errors, [])
+
+            def testOverlappingParses(self):
+                if not hasattr(threading, 'Barrier'):
+                    return
+                class Parser(self.Parser):
+                    __doc__ = r"""
+                        set lexer = %(LEXER)s
+
+                        separator spaces '\s+' ;
+
+                        token int '\d+' $ int
+
+                        START/l -> $ l = []
+                            ( int/x $ l.append(x)
+                            )*
+                            $ self.sync(l)
+                            ;
+                    """%tpg.Py()
+                    def sync(self, l):
+                        # both parses wait here until the main thread has changed the parser
+                        self.barrier.wait()
+                        self.barrier.wait()
+                        self.last = l
+                p = Parser()
+                p.barrier = threading.Barrier(3)
+                p.option = "before"
+                results = {}
+                def work(text):
+                    results[text] = p(text), p.lexer.input
+                threads = [threading.Thread(target=work, args=(text,)) for text in ("1 2", "3")]
+                for thread in threads:
+                    thread.start()
+                p.barrier.wait()
+                p.option = "after"
+                p.barrier.wait()
+                for thread in threads:
+                    thread.join()
+                # each thread keeps the lexer of its own last parse
+                self.assertEqual(results, {"1 2": ([1, 2], "1 2"), "3": ([3], "3")})
+                self.assertEqual(p.option, "after")
+                self.assertTrue(p.last in ([1, 2], [3]))
+                self.assertFalse(p.parse_states.parsing)
+
+            def testParserMethods(self):
+                class Base(PARSER):
+                    def value(self, x):
+                        return x
+                class Parser(Base):
+                    __doc__ = r"""
+                        set lexer = %(LEXER)s
+
+                        separator spaces '\s+' ;
+
+                        token int '\d+' $ int
+
+                        START/l -> $ l = []
+                            ( int/x $ l.append(self.value(x))
+                            )*
+                            $ l.append(self.info)
+                            ;
+                    """%tpg.Py()
+                    verbose = VERBOSE
+                    @property
+                    def info(self):
+                        return self.lexer.input, isinstance(self, Parser)
+                    def value(self, x):
+                        return 10 * super(Parser, self).value(x)
+                p = Parser()
+                self.assertEqual(p("1 2"), [10, 20, ("1 2", True)])
+
+            def testDictParser(self):
+                class Parser(PARSER, dict):
+                    __doc__ = r"""
+                        set lexer = %(LEXER)s
+
+                        separator spaces '\s+' ;
+
+                        token int '\d+' $ int
+                        token ident '\w+' ;
+
+                        START/x ->
+                            ident/v '=' EXPR/x $ self[v] = x $
+                        |   EXPR/x
+                        ;
+                        EXPR/x -> ATOM/x ( '\+' ATOM/y $ x += y $ )* ;
+                        ATOM/x -> int/x | ident/v $ x = self[v] $ ;
+                    """%tpg.Py()
+                    verbose = VERBOSE
+                p = Parser()
+                self.assertEqual(p("x = 3"), 3)
+                self.assertEqual(p("x + 1"), 4)
+                self.assertEqual(p("y = x + x"), 6)
+                self.assertEqual(dict(p), {"x": 3, "y": 6})
+
+        class ParserPoolTestCase(unittest.TestCase):
+
+            class Parser(PARSER):
+                __doc__ = r"""
+                    set lexer = %(LEXER)s
+
+                    separator spaces '\s+' ;
+
+                    token int '\d+' $ int
+                    token ident '\w+' ;
+
+                    START/l -> $ l = []
+                        ( int/x $ l.append(x)
+                        | ident/x $ l.append(x)
+                        )*
+                        ;
+                """%tpg.Py()
+                verbose = VERBOSE
+
+            def testSharedLexer(self):
+                p1, p2 = self.Parser(), self.Parser()
+                self.assertTrue(p1.lexer is not p2.lexer)
+                self.assertTrue(p1.lexer.tokens is not p2.lexer.tokens)
+                self.assertEqual(p1.lexer.tokens, self.Parser.lexer_prototype.tokens)
+                if LEXER in ('NamedGroupLexer', 'CacheNamedGroupLexer', 'CompactCacheNamedGroupLexer', 'StreamNamedGroupLexer'):
+                    self.assertTrue(p1.lexer.token_re is p2.lexer.token_re)
+                self.assertEqual(p1("a 1"), ['a', 1])
+                self.assertEqual(p2("2 b c"), [2, 'b', 'c'])
+                self.assertEqual(p1.lexer.input, "a 1")
+                self.assertEqual(p2.lexer.input, "2 b c")
+
+            def testDefineTokens(self):
+                p1, p2 = self.Parser(), self.Parser()
+                p1.lexer.def_separator('bang', '!')
+                self.assertEqual(p1("a ! 1"), ['a', 1])
+                self.assertRaises(tpg.Error, p2, "a ! 1")
+                self.assertRaises(tpg.Error, self.Parser(), "a ! 1")
+                self.assertEqual(p2("b 2"), ['b', 2])
+                self.assertEqual(p1("c ! ! 3"), ['c', 3])
+
+            def testPool(self):
+                pool = tpg.ParserPool(self.Parser, size=2)
+                p1 = pool.checkout()
+                p2 = pool.checkout()
+                p3 = pool.checkout()
+                for p in (p1, p2, p3):
+                    pool.checkin(p)
+                self.assertEqual(pool.parsers, [p1, p2])
+                self.assertTrue(pool.checkout() is p2)
+                self.assertEqual(pool("x 1 y"), ['x', 1, 'y'])
+                self.assertEqual(pool.parse('START', "3"), [3])
+                self.assertEqual(pool.parsers, [p1])
+
+        class LiteralTestCase(unittest.TestCase):
+
+            class Parser(PARSER):
+                __doc__ = r"""
+                    set lexer = %(LEXER)s
+
+                    separator spaces '\s+' ;
+
+                    token ident '[a-z]\w*' ;
+
+                    START/l -> $ l = []
+                        ( @t ( 'print' | '\(' | '\)' | '==' | ident ) $ l.append(t)
+                        )*
+                        ;
+                """%tpg.Py()
+                verbose = VERBOSE
+
+            def testLiteralText(self):
+                self.assertEqual(tpg.literal_text(re.compile(r"\bprint\b")), "print")
+                self.assertEqual(tpg.literal_text(re.compile(r"\(")), "(")
+                self.assertEqual(tpg.literal_text(re.compile(r"= =", re.VERBOSE)), "==")
+                self.assertEqual(tpg.literal_text(re.compile(r"a|b")), None)
+                self.assertEqual(tpg.literal_text(re.compile(r"a+")), None)
+                self.assertEqual(tpg.literal_text(re.compile(r"a", re.I)), None)
+
+            def testSharedText(self):
+                p = self.Parser()
+                tokens = [t for t in p("print(x) print (y==z)") if t.name not in ('SOF', 'EOF')]
+                if LEXER not in ('ContextSensitiveLexer',):
+                    self.assertEqual([t.text for t in tokens if t.name != 'ident'], ['print', '(', ')', 'print', '(', '==', ')'])
+                if LEXER in ('NamedGroupLexer', 'CacheNamedGroupLexer', 'StreamNamedGroupLexer'):
+                    prints = [t for t in tokens if t.text == 'print']
+                    self.assertTrue(prints[0].text is prints[1].text)
+                    self.assertTrue(prints[0].value is prints[1].text)
+
+            def testUnboundTokens(self):
+                class Parser(PARSER):
+                    __doc__ = r"""
+                        set lexer = %(LEXER)s
+
+                        separator spaces '[ ]+' ;
+
+                        token nl '\n' ;
+                        token ident '[a-z]\w*' ;
+
+                        START/l -> $ l = []
+                            ( @t ( '\(' | '\)'/x | '\n' | ident/x ) $ l.append(t)
+                            )*
+                            ;
+                    """%tpg.Py()
+                    verbose = VERBOSE
+                p = Parser()
+                text = "(a)\n ( b\n\n) c"
+                tokens = [t for t in p(text) if t.name not in ('SOF', 'EOF')]
+                if LEXER not in ('ContextSensitiveLexer',):
+                    self.assertEqual([t.text for t in tokens], ['(', 'a', ')', '\n', '(', 'b', '\n', '\n', ')', 'c'])
+                if LEXER in ('NamedGroupLexer', 'CacheNamedGroupLexer'):
+                    self.assertEqual(p.lexer.unbound_tokens, ('_tok_1', 'nl'))
+                    self.assertEqual([isinstance(t, tpg.LiteralToken) for t in tokens[:5]], [True, False, False, True, True])
+                    self.assertEqual(sorted(set([len(definition) for definition in p.lexer.tokens.values()])), [2])
+                    fields = lambda t: (t.name, t.text, t.value, t.line, t.column, t.end_line, t.end_column, t.start, t.stop, t.prev_stop)
+                    self.assertEqual([fields(t) for t in tokens], [fields(t) for t in tpg.tokenize_all(p, text)])
+                    self.assertEqual(str(tokens[4]), "line 2, column 2: _tok_1 ( (")
+
+        class AutoLexerTestCase(unittest.TestCase):
+
+            keywords = ["kw%d"%i for i in range(20)]
+
+            grammar = r"""
+                set lexer = auto
+                %s
+
+                separator spaces '\s+' ;
+
+                token number '\d+' ;
+                token ident '[a-z]\w*' ;
+
+                START/l -> $ l = []
+                    ( ( %s | %s | number/x | ident/x ) $ l.append(x)
+                    )*
+                    ;
+            """
+
+            def parser(self, operators, options=""):
+                keywords = " | ".join(["'%s'/x"%kw for kw in self.keywords])
+                operators = " | ".join(["'%s'/x"%op for op in operators])
+                class Parser(PARSER):
+                    __doc__ = self.grammar%(options, keywords, operators)
+                    verbose = VERBOSE
+                return Parser
+
+            def testLongerMatchPossible(self):
+                self.assertTrue(tpg.longer_match_possible(re.compile(r"<"), re.compile(r"<=")))
+                self.assertFalse(tpg.longer_match_possible(re.compile(r"<="), re.compile(r"<")))
+                self.assertFalse(tpg.longer_match_possible(re.compile(r"\bin\b"), re.compile(r"\bint\b")))
+                self.assertFalse(tpg.longer_match_possible(re.compile(r"\bif\b"), re.compile(r"\w+")))
+                self.assertTrue(tpg.longer_match_possible(re.compile(r"if"), re.compile(r"\w+")))
+                self.assertFalse(tpg.longer_match_possible(re.compile(r"(cos|sin)\b"), re.compile(r"[a-z]\w*")))
+                self.assertFalse(tpg.longer_match_possible(re.compile(r"\d*\.\d*|\.\d*"), re.compile(r"\d+")))
+                self.assertTrue(tpg.longer_match_possible(re.compile(r"\d+"), re.compile(r"\d+\.\d+")))
+                self.assertFalse(tpg.longer_match_possible(re.compile(r"\s+"), re.compile(r"\d+")))
+                self.assertFalse(tpg.longer_match_possible(re.compile(r"\*\*|\^"), re.compile(r"[*/]")))
+                self.assertTrue(tpg.longer_match_possible(re.compile(r"a", re.I), re.compile(r"b")))
+
+            def testFirstMatchIsLongest(self):
+                self.assertTrue(tpg.first_match_is_longest([re.compile(r) for r in (r"<=", r"<", r"\bif\b", r"\w+")]))
+                self.assertFalse(tpg.first_match_is_longest([re.compile(r) for r in (r"<", r"<=", r"\bif\b", r"\w+")]))
+                self.assertFalse(tpg.first_match_is_longest([re.compile(r) for r in (r"<=", r"a*")]))
+
+            def testDispatch(self):
+                Parser = self.parser(['<=', '<', '=', '\(', '\)'])
+                self.assertTrue("auto: Lexer (" in Parser.init_lexer.__doc__)
+                p = Parser()
+                self.assertTrue(isinstance(p.lexer, tpg.Lexer))
+                self.assertEqual(p("kw1 kw12 kw123 (x <= 1) < ="), ['kw1', 'kw12', 'kw123', '(', 'x', '<=', '1', ')', '<', '='])
+
+            def testFirstMatch(self):
+                Parser = self.parser(['<', '<=', '=', '\(', '\)'])
+                self.assertTrue("auto: NamedGroupLexer (" in Parser.init_lexer.__doc__)
+                p = Parser()
+                self.assertTrue(isinstance(p.lexer, tpg.NamedGroupLexer))
+                self.assertEqual(p("x <= 1"), ['x', '<', '=', '1'])
+
+            def testFewTokens(self):
+                class Parser(PARSER):
+                    r"""
+                    set lexer = auto
+                    separator spaces '\s+' ;
+                    token ident '\w+' ;
+                    START/l -> ident/x '=' ident/y $ l = [x, y]
+                        ;
+                    """
+                    verbose = VERBOSE
+                self.assertEqual(Parser.init_lexer.__doc__.strip(), "set lexer = auto: NamedGroupLexer (3 tokens)")
+                self.assertEqual(Parser()("a = b"), ['a', 'b'])
+
+            def testBacktracking(self):
+                class Parser(PARSER):
+                    r"""
+                    set lexer = auto
+                    separator spaces '\s+' ;
+                    token number '\d+' ;
+                    token ident '\w+' ;
+                    START/l -> $ l = []
+                        ( Stmt/s $ l.append(s)
+                        )*
+                        ;
+                    Stmt/s -> Decl/s | Expr ';' $ s = 'expr'
+                        ;
+                    Decl/'decl' -> Expr '=' Expr ';' ;
+                    Assign/'assign' -> ident '=' Expr ';' ;
+                    Expr -> Atom ( '[-+]' Atom )* ;
+                    Atom -> number | ident | '\(' Expr '\)' ;
+                    """
+                    verbose = VERBOSE
+                self.assertTrue("auto: CacheNamedGroupLexer (" in Parser.init_lexer.__doc__)
+                self.assertTrue("1 backtracking choice)" in Parser.init_lexer.__doc__)
+                self.assertEqual(Parser()("(a + 1) = b; a + (b - 1);"), ['decl', 'expr'])
+
+            def testIncremental(self):
+                Parser = self.parser(['<=', '<'], "set incremental = True")
+                self.assertTrue("auto: CacheLexer (" in Parser.init_lexer.__doc__)
+                self.assertTrue(", incremental)" in Parser.init_lexer.__doc__)
+                self.assertEqual(Parser()("kw1 <= 2"), ['kw1', '<=', '2'])
+
+        class DispatchTestCase(unittest.TestCase):
+
+            class Parser(PARSER):
+                __doc__ = r"""
+                    set lexer = %(LEXER)s
+                    set lexer_unicode = True
+
+                    separator spaces '\s+' ;
+                    separator comment '\#.*' ;
+
+                    token keyword 'if' ;
+                    token ident '[a-z_]\w*' ;
+                    token float '\d+\.\d*|\.\d+' ;
+                    token int '\d+' ;
+                    token op '<=|<|=|(?=[*])[*]' ;
+                    token other '[^a-z\s\xe9]' ;
+                    token accent '\xe9\w*' ;
+
+                    START/l -> $ l = []
+                        (   keyword     $ l.append('keyword')
+                        |   ident       $ l.append('ident')
+                        |   float       $ l.append('float')
+                        |   int         $ l.append('int')
+                        |   op          $ l.append('op')
+                        |   other       $ l.append('other')
+                        |   accent      $ l.append('accent')
+                        )*
+                        ;
+                """%tpg.Py()
+                verbose = VERBOSE
+
+            def testFirstChars(self):
+                self.assertEqual(tpg.first_chars(re.compile(r"\b(ab|[c-e])x*")), (set("ac") | set("de"), False))
+                self.assertEqual(tpg.first_chars(re.compile(r"a?b")), (set("ab"), False))
+                self.assertEqual(tpg.first_chars(re.compile(r"\xe9")), (set(), True))
+                self.assertEqual(tpg.first_chars(re.compile(r"a?")), None)
+                self.assertEqual(tpg.first_chars(re.compile(r"(?=a)a")), None)
+                self.assertEqual(tpg.first_chars(re.compile(r"a", re.I)), None)
+                if sys.version_info >= (3, 6):
+                    self.assertEqual(tpg.first_chars(re.compile(r"(?i:if)")), None)
+                    self.assertEqual(tpg.first_chars(re.compile(r"(?-i:a)b", re.I)), None)
+
+            def testFirstCharsCache(self):
+                for i in range(tpg.first_chars_cache_size + 10):
+                    self.assertEqual(tpg.first_chars(re.compile(r"a%d"%i)), (set("a"), False))
+                self.assertEqual(len(tpg.first_chars_cache), tpg.first_chars_cache_size)
+                self.assertEqual(list(tpg.first_chars_cache)[-1], (r"a%d"%i, re.compile(r"a%d"%i).flags))
+
+            def testInlineFlags(self):
+                if sys.version_info < (3, 6):
+                    return
+                class Parser(PARSER):
+                    __doc__ = r"""
+                        set lexer = %(LEXER)s
+
+                        separator spaces '\s+' ;
+
+                        token kw '(?i:if)' ;
+                        token other '[A-Z]+' ;
+
+                        START/l -> $ l = []
+                            (   kw/x        $ l.append(('kw', x))
+                            |   other/x     $ l.append(('other', x))
+                            )*
+                            ;
+                    """%tpg.Py()
+                    verbose = VERBOSE
+                self.assertEqual(Parser()("IF If ABC"), [('kw', 'IF'), ('kw', 'If'), ('other', 'ABC')])
+
+            def testDispatch(self):
+                if tpg.__python__ == 2 and VERBOSE:
+                    # the trace of non ascii tokens can not be written to sys.stderr on Python 2
+                    return
+                text = u("if iff x1 < <= 1.5 .5 12 # comment\n * $ \xe9t\xe9 ?")
+                p = self.Parser()
+                tokens = p(text)
+                self.assertEqual(tokens,
+                                 ['keyword', 'ident', 'ident', 'op', 'op', 'float', 'float', 'int', 'op', 'other', 'accent', 'other'])
+                if LEXER in ('Lexer', 'CacheLexer'):
+                    # same tokens when every token is tried at every position
+                    p.lexer.dispatch = {}
+                    p.lexer.default = p.lexer.tokens
+                    self.assertEqual(p(text), tokens)
+
+        class ManyTokensTestCase(unittest.TestCase):
+
+            class Parser(PARSER):
+                __doc__ = (r"""
+                    set lexer = %(LEXER)s
+
+                    separator spaces '\s+' ;
+                """ + "".join(["""
+                    token kw%d 'kw%d' ;""" % (i, i) for i in range(150)]) + r"""
+                    token ident '\w+' $ str.upper
+
+                    START/l -> $ l = []
+                        ( ( """ + " | ".join(["kw%d/x" % i for i in range(150)]) + r""" | ident/x ) $ l.append(x)
+                        )*
+                        ;
+                """)%tpg.Py()
+                verbose = VERBOSE
+
+            class Groups(PARSER):
+                __doc__ = r"""
+                    set lexer = %(LEXER)s
+
+                    separator spaces '\s+' ;
+
+                    token number '\d+' $ int
+                    token word '(\w)(\w*)' ;
+                    token ab 'ab' ;
+                    token sym '[-+]' ;
+
+                    START/l -> $ l = []
+                        ( ( number/x | word/x $ x = 'word:'+x
+                        | ab/x $ x = 'ab'
+                        | sym/x ) $ l.append(x)
+                        )*
+                        ;
+                """%tpg.Py()
+                verbose = VERBOSE
+
+            def testManyTokens(self):
+                text = "kw0 kw42 x kw149 kw150 kw7"
+                for max_groups in (None, 99, 10):
+                    p = self.Parser()
+                    if max_groups is not None:
+                        p.lexer.max_groups = max_groups
+                    self.assertEqual(p(text), ['kw0', 'kw42', 'X', 'kw149', 'KW150', 'kw7'])
+                    if LEXER in ('NamedGroupLexer', 'CacheNamedGroupLexer', 'CompactCacheNamedGroupLexer', 'StreamNamedGroupLexer'):
+                        if max_groups is not None:
+                            self.assertEqual(len(p.lexer.token_re.regexps), (152+max_groups-1)//max_groups)
+
+            def testGroups(self):
+                p = self.Groups()
+                p.lexer.max_groups = 3
+                self.assertEqual(p("12 ab + x - 3"), [12, 'word:ab', '+', 'word:x', '-', 3])
+                if LEXER in ('NamedGroupLexer', 'CacheNamedGroupLexer', 'CompactCacheNamedGroupLexer', 'StreamNamedGroupLexer'):
+                    # [spaces, number], [word], [ab, sym]
+                    self.assertEqual(len(p.lexer.token_re.regexps), 3)
+
+            def testParserOptions(self):
+                text = "kw0 kw42 x kw149 kw150 kw7"
+                p1, p2 = self.Parser(), self.Parser()
+                p1.lexer.max_groups = 10
+                self.assertEqual(p1(text), p2(text))
+                if LEXER in ('NamedGroupLexer', 'CacheNamedGroupLexer', 'CompactCacheNamedGroupLexer', 'StreamNamedGroupLexer'):
+                    self.assertEqual(len(p1.lexer.token_re.regexps), 16)
+                    self.assertEqual(isinstance(p2.lexer.token_re, tpg.Alternation), p2.lexer.max_groups < 152)
+                    self.assertTrue(p2.lexer.token_re is self.Parser.lexer_prototype.token_re)
+
         class ReSTTestCase(unittest.TestCase):
 
             class OK1(PARSER):
@@ -2,4 +2,5 @@
 
 python2.7 tpg_tests_py2.py && \
 python2.7 tpg_tests.py && \
-python3.2 tpg_tests.py
+python3.2 tpg_tests.py && \
+python3.2 main_tests.py